@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""asyncio version of UBXManager."""
+
+import os
+import sys
+import asyncio
+from UBXManager import UBXDispatcher, Correlator
+
+_EOF = object()     # put into the message queues at the end of the stream
+
+
+class FileReader:
+    """Minimal asyncio stream reader for regular files.
+
+    The event loop can't wait for regular files, so they are simply read.
+    """
+
+    def __init__(self, f):
+        self.f = f
+
+    async def read(self, n):
+        await asyncio.sleep(0)      # let other tasks run between chunks
+        return self.f.read(n)
+
+
+class AsyncUBXManager(UBXDispatcher):
+    """The NMEA/UBX reader/writer on an asyncio stream.
+
+    reader is an asyncio.StreamReader (or anything with an async read(n)),
+    writer an asyncio.StreamWriter or None for a read-only stream. The
+    open* class methods create managers for TCP, devices and files. Many
+    managers can share one event loop.
+
+    Messages are parsed and handed to the same hooks and subscriptions as
+    in UBXManager. In addition messages() iterates over messages and
+    request() sends a message and waits for the response.
+    """
+
+    def __init__(self, reader, writer=None, chunkSize=4096, lazy=False,
+                 dispatchAll=True):
+        """Instantiate with an asyncio stream, see UBXManager for the rest."""
+        UBXDispatcher.__init__(self, lazy, dispatchAll)
+        self.framer = self._newFramer()
+        self.reader = reader
+        self.writer = writer
+        self.chunkSize = chunkSize
+        self._task = None
+        self._queues = set()
+        self._shutDown = False
+        self._readTransport = None      # closed by shutdown()
+        self.correlator = Correlator(self, self.send)
+
+    @classmethod
+    async def openConnection(cls, host, port, **kwargs):
+        """Return a manager for a TCP connection, e.g. to a ser2net port."""
+        reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer, **kwargs)
+
+    @classmethod
+    async def openDevice(cls, path, baudrate=None, **kwargs):
+        """Return a manager for a serial device or pty.
+
+        The terminal is switched to raw mode and, if given, to baudrate.
+        """
+        import tty
+        import termios
+        fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(fd)
+        if baudrate is not None:
+            attrs = termios.tcgetattr(fd)
+            attrs[4] = attrs[5] = getattr(termios, 'B{}'.format(baudrate))
+            termios.tcsetattr(fd, termios.TCSANOW, attrs)
+        loop = asyncio.get_running_loop()
+        reader = asyncio.StreamReader()
+        readTransport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader),
+            open(fd, 'rb', buffering=0)
+        )
+        transport, protocol = await loop.connect_write_pipe(
+            asyncio.streams.FlowControlMixin,
+            open(os.dup(fd), 'wb', buffering=0)
+        )
+        writer = asyncio.StreamWriter(transport, protocol, None, loop)
+        manager = cls(reader, writer, **kwargs)
+        manager._readTransport = readTransport
+        return manager
+
+    @classmethod
+    async def openFile(cls, filename, **kwargs):
+        """Return a read-only manager for a capture file."""
+        reader = FileReader(open(filename, 'rb'))
+        manager = cls(reader, None, **kwargs)
+        manager._readTransport = reader.f
+        return manager
+
+    def start(self):
+        """Start run() as a task of the running loop and return the task."""
+        return asyncio.ensure_future(self.run())
+
+    async def run(self):
+        """Read and parse messages until the end of the stream or shutdown()."""
+        self._task = asyncio.current_task()
+        self.framer.reset()
+        try:
+            while not self._shutDown:
+                data = await self.reader.read(self.chunkSize)
+                if not data:
+                    break
+                self.framer.feed(data)
+        except asyncio.CancelledError:
+            if not self._shutDown:
+                raise
+        finally:
+            self._task = None
+            for queue in list(self._queues):
+                queue.put_nowait(_EOF)
+
+    def shutdown(self):
+        """Stop the manager, also while it is waiting for data."""
+        self._shutDown = True
+        if self._task is not None:
+            self._task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+        if self._readTransport is not None:
+            self._readTransport.close()
+
+    async def messages(self, filter=None, raw=False):
+        """Iterate over the UBX messages of the types in filter.
+
+        filter is a message type or predicate as in subscribe(), a list of
+        them, or None for all UBX messages. With raw=True the items are
+        (msgClass, msgId, payload) tuples. The iteration ends with the
+        stream.
+        """
+        if filter is None:
+            filter = [lambda msgClass, msgId, length: True]
+        elif not isinstance(filter, list):
+            filter = [filter]
+        queue = asyncio.Queue()
+        if raw:
+            def callback(*msg):
+                queue.put_nowait(msg)
+        else:
+            callback = queue.put_nowait
+        subscriptions = [self.subscribe(f, callback, raw) for f in filter]
+        self._queues.add(queue)
+        try:
+            while True:
+                msg = await queue.get()
+                if msg is _EOF:
+                    return
+                yield msg
+        finally:
+            self._queues.discard(queue)
+            for s in subscriptions:
+                self.unsubscribe(s)
+
+    def send(self, msg):
+        """Write a message (an object with serialize() or bytes)."""
+        if hasattr(msg, 'serialize'):
+            msg = msg.serialize()
+        self.writer.write(msg)
+
+    async def request(self, msg, timeout=None):
+        """Send msg and return the response.
+
+        The response to a poll request is the polled message, the response
+        to a CFG message the ACK-ACK; an ACK-NAK raises an Exception. See
+        UBXMessage.expectedResponse. Returns None right after sending if no
+        response is expected. Raises asyncio.TimeoutError after timeout
+        seconds. Requests don't wait for each other, the responses are
+        matched as in UBXManager, see Correlator.
+        """
+        future = asyncio.wrap_future(self.correlator.request(msg))
+        await self.writer.drain()
+        return await asyncio.wait_for(future, timeout)
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 2:
+        sys.stderr.write(
+            "Usage:\n  AsyncUBXManager.py DEVICE|FILE|HOST:PORT\n\n" +
+            __doc__
+        )
+        sys.exit(1)
+
+    import UBX     # registers the message classes
+
+    async def main(target):
+        if os.path.isfile(target):
+            manager = await AsyncUBXManager.openFile(target)
+        elif ':' in target:
+            host, port = target.rsplit(':', 1)
+            manager = await AsyncUBXManager.openConnection(host, int(port))
+        else:
+            manager = await AsyncUBXManager.openDevice(target)
+        await manager.run()
+
+    try:
+        asyncio.run(main(sys.argv[1]))
+    except KeyboardInterrupt:
+        pass
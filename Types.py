@@ -3,12 +3,15 @@
 Each type must have a variable typ and ord.
 - typ: Contains the python struct packing letter
 - ord: Contains a sequential ordering number
-"""
+- ctype, dtype: The corresponding C type and NumPy dtype string
 
-from struct import Struct, unpack, pack
+Besides parse(msg), which returns the value and the rest of msg, every type
+has parse_from(buffer, offset) and pack_into(buffer, offset, val). Both
+return the offset after the field, so a decoder or encoder can walk one
+buffer (bytes, bytearray or memoryview) without slicing it.
+"""
 
-# Note: All classes listed here must be also listed in UBXMessages.py,
-# function classFromMessageClass !!
+from struct import Struct
 
 
 def _InitGenericType(cls):
@@ -25,12 +28,14 @@ def _InitGenericType(cls):
                 err = "Message length {} is shorter than required {}"\
                       .format(len(msg), self._size)
                 raise Exception(err)
-            val = unpack(self.fmt, msg[0:self._size])[0]
+            val = self._struct.unpack_from(msg)[0]
             return val, msg[self._size:]
         setattr(cls, "parse", parse)
-    # 3. add _size variable to cls
+    # 3. add _struct and _size variables to cls
+    if cls.__dict__.get('_struct') is None:
+        setattr(cls, '_struct', Struct('<' + cls.fmt))    # UBX is little-endian
     if cls.__dict__.get('_size') is None:
-        setattr(cls, '_size', Struct(cls.fmt).size)
+        setattr(cls, '_size', cls._struct.size)
     # 4. add toString static method
     if cls.__dict__.get('toString') is None:
         @staticmethod
@@ -41,8 +46,20 @@ def _InitGenericType(cls):
     # 5. add serialize method
     if cls.__dict__.get('serialize') is None:
         def serialize(self, val):
-            return pack(self.fmt, val)
+            return self._struct.pack(val)
         setattr(cls, 'serialize', serialize)
+    # 6. add parse_from method
+    if cls.__dict__.get('parse_from') is None:
+        def parse_from(self, buffer, offset=0):
+            return self._struct.unpack_from(buffer, offset)[0], \
+                   offset + self._size
+        setattr(cls, 'parse_from', parse_from)
+    # 7. add pack_into method
+    if cls.__dict__.get('pack_into') is None:
+        def pack_into(self, buffer, offset, val):
+            self._struct.pack_into(buffer, offset, val)
+            return offset + self._size
+        setattr(cls, 'pack_into', pack_into)
     return cls
 
 
@@ -56,60 +73,70 @@ class U1:
     """UBX Unsigned Char."""
     fmt = "B"
     ctype = "uint8_t"
+    dtype = "u1"
 
 @_InitGenericType
 class I1:
     """UBX Signed Char."""
     fmt = "b"
     ctype = "int8_t"
+    dtype = "i1"
 
 @_InitGenericType
 class X1:
     """UBX 1-byte bitfield."""
     fmt = "B"
     ctype = "uint8_t"
+    dtype = "u1"
 
 @_InitGenericType
 class U2:
     """UBX Unsigned Short."""
     fmt = "H"
     ctype = "uint16_t"
+    dtype = "<u2"
 
 @_InitGenericType
 class I2:
     """UBX Signed Short."""
     fmt = "h"
     ctype = "int16_t"
+    dtype = "<i2"
 
 @_InitGenericType
 class X2:
     """UBX 2-byte bitfield."""
     fmt = "H"
     ctype = "uint16_t"
+    dtype = "<u2"
 
 @_InitGenericType
 class U4:
     """UBX Unsigned Int."""
     fmt = "I"
     ctype = "uint32_t"
+    dtype = "<u4"
 
 @_InitGenericType
 class I4:
     """UBX Signed Int."""
     fmt = "i"
     ctype = "int32_t"
+    dtype = "<i4"
 
 @_InitGenericType
 class X4:
     """UBX 4-byte bitfield."""
     fmt = "I"
     ctype = "uint32_t"
+    dtype = "<u4"
 
 @_InitGenericType
 class R4:
     """UBX single precision float."""
     fmt = "f"
     ctype = "float"
+    dtype = "<f4"
     @staticmethod
     def toString(val):
         return '"{}"'.format(val)
@@ -119,44 +146,70 @@ class R8:
     """UBX double precision float."""
     fmt = "d"
     ctype = "double"
+    dtype = "<f8"
     @staticmethod
     def toString(val):
         return '"{}"'.format(val)
 
 class CH:
     """ASCII / ISO 8859.1 Encoding."""
-    fmt = None  # Not needed
     def __init__(self, _ord, N, allowed=[], nullTerminatedString=False):
         self.N = N
+        self.fmt = "{}s".format(N)
+        self._struct = Struct(self.fmt)
         self.ord = _ord
         self._size = N
         self._nullTerminatedString = nullTerminatedString
         self.ctype = "char[{}]".format(self.N)
+        self.dtype = "S{}".format(self.N)
     def parse(self, msg):
         if len(msg) < self.N:
             err = "Message length {} is shorter than required {}"\
                   .format(len(msg), self._size)
             raise Exception(err)
-        val = msg[0:self._size]
+        return self.decode(msg[0:self._size]), msg[self._size:]
+    def parse_from(self, buffer, offset=0):
+        val = self._struct.unpack_from(buffer, offset)[0]
+        return self.decode(val), offset + self._size
+    def decode(self, val):
+        """Convert the raw bytes to the field value."""
         if self._nullTerminatedString:
             val = stringFromByteString(val)
-        return val, msg[self._size:]
-    @staticmethod
-    def toString(val):
-        return '"{}"'.format(val)
-    def serialize(self, val):
+        return val
+    def encode(self, val):
+        """Convert the field value to raw bytes, the inverse of decode."""
+        if self._nullTerminatedString:
+            if isinstance(val, str):
+                val = val.encode('ascii')
+            if len(val) >= self.N:
+                err = "String length {} too long for {} bytes with null"\
+                      .format(len(val), self._size)
+                raise Exception(err)
+            return val.ljust(self.N, b'\x00')
         if len(val) != self.N:
             err = "Value length {} not equal to the required {}"\
                   .format(len(val), self._size)
             raise Exception(err)
+        return bytes(val)
+    @staticmethod
+    def toString(val):
+        return '"{}"'.format(val)
+    def serialize(self, val):
+        return self.encode(val)
+    def pack_into(self, buffer, offset, val):
+        self._struct.pack_into(buffer, offset, self.encode(val))
+        return offset + self._size
 
 class U:
     """Variable-length array of unsigned chars."""
-    fmt = None  # Not needed
     def __init__(self, _ord, N, allowed=[]):
         self.ord = _ord
         self.N = N
+        self.fmt = "{}s".format(N)
+        self._struct = Struct(self.fmt)
+        self._size = N
         self.ctype = "uint8_t[{}]".format(self.N)
+        self.dtype = "V{}".format(self.N)
     def parse(self, msg):
         if len(msg) < self.N:
             err = "Message length {} is shorter than required {}"\
@@ -172,4 +225,9 @@ class U:
             err = "Value length {} not equal to the required {}"\
                   .format(len(val), self._size)
             raise Exception(err)
-        return val
+        return bytes(val)
+    def parse_from(self, buffer, offset=0):
+        return self._struct.unpack_from(buffer, offset)[0], offset + self._size
+    def pack_into(self, buffer, offset, val):
+        self._struct.pack_into(buffer, offset, self.serialize(val))
+        return offset + self._size
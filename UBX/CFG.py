@@ -137,7 +137,7 @@ class CFG:
             reserved1   = U1(2)
             txReady     = X2(3)
             mode        = X4(4)
-            reserved2   = U4(5)
+            baudRate    = U4(5)     # UART only, reserved for USB, SPI, DDC
             inProtoMask = X2(6)
             outProtoMask= X2(7)
             flags       = X2(8)
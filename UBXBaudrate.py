@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Detect and change the baud rate of a receiver on a UART.
+
+The serial object is a pyserial Serial or anything with the same
+baudrate, timeout, read(), write(), in_waiting, reset_input_buffer() and
+flush().
+"""
+
+import sys
+from time import monotonic
+from UBXFramer import scan, UBX, NMEA
+from UBXMessage import UBXMessage
+
+BAUDRATES = [9600, 115200, 38400, 57600, 230400, 460800, 19200, 921600, 4800]
+PRT_POLL = UBXMessage.make(0x06, 0x00, b'')     # CFG-PRT of the current port
+
+
+def _valid(data):
+    """Whether data has a UBX frame or two NMEA sentences with checksums."""
+    frames = {UBX: 0, NMEA: 0}
+    for kind, i, j in scan(data):
+        if kind in frames:
+            frames[kind] += 1
+    return frames[UBX] >= 1 or frames[NMEA] >= 2
+
+
+def detectBaudrate(ser, baudrates=BAUDRATES, timeout=1):
+    """Find the baud rate at which the receiver on ser talks.
+
+    Each baud rate is tried for up to timeout seconds: CFG-PRT is polled
+    and the rate is taken as soon as frames with correct checksums arrive,
+    which garbage at a wrong rate practically never has. ser is left at
+    the detected rate, which is returned, or None if nothing was found.
+    """
+    oldTimeout = ser.timeout
+    ser.timeout = 0.05
+    try:
+        for baudrate in baudrates:
+            ser.baudrate = baudrate
+            ser.reset_input_buffer()
+            ser.write(PRT_POLL)
+            data = bytearray()
+            deadline = monotonic() + timeout
+            while monotonic() < deadline:
+                data += ser.read(max(ser.in_waiting, 1))
+                if _valid(data):
+                    return baudrate
+        return None
+    finally:
+        ser.timeout = oldTimeout
+
+
+def changeBaudrate(manager, baudrate, timeout=1, retries=2):
+    """Switch the receiver of a running UBXManager and its port to baudrate.
+
+    The CFG-PRT of the current port is polled, sent back with the new
+    baud rate, and the serial port is switched as soon as that message is
+    transmitted, because the receiver changes its rate right away and its
+    ACK is often lost. The change is then verified by polling CFG-PRT at
+    the new rate. If that fails in any way, e.g. with a timeout or an
+    ACK-NAK, the port is switched back and an Exception is raised.
+    """
+    ser = manager.ser
+    prt = manager.request(PRT_POLL, timeout, retries).result()
+    if prt.portID not in [1, 2]:
+        raise Exception("Port {} is not a UART".format(prt.portID))
+    if prt.baudRate == baudrate and ser.baudrate == baudrate:
+        return
+    oldBaudrate = ser.baudrate
+    prt.baudRate = baudrate
+    switched = False
+    try:
+        manager.send(prt.serialize())
+        ser.flush()     # until transmitted
+        ser.baudrate = baudrate
+        try:
+            prt = manager.request(PRT_POLL, timeout, retries).result()
+        except Exception as e:
+            raise Exception("Receiver did not switch to {} baud: {}"
+                            .format(baudrate, e)) from e
+        if prt.baudRate != baudrate:
+            raise Exception(
+                "Receiver did not switch to {} baud".format(baudrate)
+            )
+        switched = True
+    finally:
+        if not switched:
+            ser.baudrate = oldBaudrate
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in [2, 3]:
+        sys.stderr.write("Usage:\n  UBXBaudrate.py DEVICE [BAUDRATE]\n\n" +
+                         __doc__)
+        sys.exit(1)
+
+    import serial
+    import UBX     # registers the message classes
+    from UBXManager import UBXManager
+
+    class Manager(UBXManager):
+        def onUBX(self, obj):
+            pass
+
+        def onNMEA(self, buffer):
+            pass
+
+    ser = serial.Serial(sys.argv[1], 9600, timeout=None)
+    baudrate = detectBaudrate(ser)
+    if baudrate is None:
+        sys.stderr.write("No receiver found\n")
+        sys.exit(1)
+    print("Receiver at {} baud".format(baudrate))
+    if len(sys.argv) == 3:
+        manager = Manager(ser)
+        manager.start()
+        changeBaudrate(manager, int(sys.argv[2]))
+        manager.shutdown()
+        print("Receiver at {} baud".format(sys.argv[2]))
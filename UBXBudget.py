@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""Serial bandwidth budget of the messages a receiver outputs.
+
+The frame sizes come from the Fields definitions in UBX/, with the
+repeated blocks multiplied by the expected number of satellites, and the
+rates from CFG-MSG and CFG-RATE. The budget can be compared with the
+throughput measured on a running UBXManager.
+"""
+
+import sys
+from math import ceil
+from concurrent.futures import wait
+import UBX     # registers the message classes
+from UBXMessage import lookupMessage, messageType
+
+# typical length in bytes of the NMEA sentences output by default
+NMEA_LENGTHS = {'GGA': 75, 'GLL': 52, 'GSA': 67, 'GSV': 70, 'RMC': 70,
+                'VTG': 40}
+
+
+def messageName(msgClass, msgId):
+    """Return e.g. 'RXM-RAWX' for a message type, or its IDs in hex."""
+    Cls = lookupMessage(msgClass, msgId)
+    if Cls is None:
+        return "{:02X}:{:02X}".format(msgClass, msgId)
+    return Cls.__qualname__.replace('.', '-')
+
+
+def frameSize(msgType, nBlocks=0):
+    """Return the size of a UBX frame in bytes, with nBlocks repeated blocks.
+
+    This includes the 8 bytes of header and checksum.
+    """
+    msgType = messageType(msgType)
+    Cls = lookupMessage(*msgType)
+    if Cls is None:
+        raise Exception(
+            "No definition of message {}".format(messageName(*msgType))
+        )
+    layout = Cls._layout
+    size = 8 + layout.once.size
+    if layout.repeat is not None:
+        size += nBlocks * layout.repeat.size
+    return size
+
+
+class Budget:
+    """Expected output of a receiver in bytes per second.
+
+    msgRates maps message types to their CFG-MSG rate on the port, i.e.
+    one message every rate measurements (RXM) or navigation solutions
+    (all others); 0 is off. measRate (ms) and navRate are those of
+    CFG-RATE. Messages with repeated blocks have satellites blocks unless
+    blocks maps their type to another count. nmea maps NMEA sentences
+    ('GGA', ...) to their rate like msgRates, GSV is counted once per 4
+    satellites. baudrate is that of the port, if known.
+    """
+
+    def __init__(self, msgRates, measRate=1000, navRate=1, nmea=None,
+                 satellites=30, blocks=None, baudrate=None):
+        """Instantiate with the rates of the messages."""
+        self.msgRates = {
+            messageType(t): r for t, r in msgRates.items()
+        }
+        self.measRate = measRate
+        self.navRate = navRate
+        self.nmea = nmea or {}
+        self.satellites = satellites
+        self.blocks = {messageType(t): n for t, n in (blocks or {}).items()}
+        self.baudrate = baudrate
+
+    @classmethod
+    def fromProfile(cls, profile, port=None, **kwargs):
+        """Return the budget of a UBXProfile.Profile.
+
+        port selects the rate of msgRates given for all ports, it is
+        required if there are any; the CFG-RATE of the profile is used if it
+        has one.
+        """
+        if port is None and not all(
+                isinstance(r, int) for r in profile.msgRates.values()):
+            raise ValueError("The profile has rates for all ports, "
+                             "select one with port")
+        msgRates = {t: r if isinstance(r, int) else r[port]
+                    for t, r in profile.msgRates.items()}
+        if profile.rate is not None:
+            kwargs.setdefault('measRate', profile.rate.get('measRate', 1000))
+            kwargs.setdefault('navRate', profile.rate.get('navRate', 1))
+        return cls(msgRates, **kwargs)
+
+    @classmethod
+    def fromReceiver(cls, cache, msgTypes, timeout=1, **kwargs):
+        """Return the budget of msgTypes as configured in a receiver.
+
+        cache is a UBXProfile.ConfigCache of the receiver. CFG-RATE, the
+        CFG-PRT of the current port and the CFG-MSG of every type are
+        polled at once, unless they are cached.
+        """
+        msgTypes = list(map(messageType, msgTypes))
+        rate = cache.get(UBX.CFG.RATE, timeout=timeout)
+        prt = cache.get(UBX.CFG.PRT, timeout=timeout)
+        msgs = [cache.get(UBX.CFG.MSG, t, timeout=timeout) for t in msgTypes]
+        wait([rate, prt] + msgs)
+        prt, rate = prt.result(), rate.result()
+        if prt.portID in [1, 2]:
+            kwargs.setdefault('baudrate', prt.baudRate)
+        return cls(
+            {t: m.result()._payload[2 + prt.portID]
+             for t, m in zip(msgTypes, msgs)},
+            rate.measRate, rate.navRate, **kwargs
+        )
+
+    def rows(self, nmeaTotal=False):
+        """Return [(name, frame bytes, frames per second, bytes per second)].
+
+        There is one row per enabled UBX message type, then one per NMEA
+        sentence. With nmeaTotal=True the NMEA sentences are added up in one
+        row 'NMEA' with their average size, as Meter counts them.
+        """
+        measPerSecond = 1000.0 / self.measRate
+        navPerSecond = measPerSecond / self.navRate
+        rows = []
+        for msgType, rate in self.msgRates.items():
+            if not rate:
+                continue
+            events = measPerSecond if msgType[0] == 0x02 else navPerSecond
+            size = frameSize(
+                msgType, self.blocks.get(msgType, self.satellites)
+            )
+            rows.append((messageName(*msgType), size, events / rate,
+                         size * events / rate))
+        nmea = []
+        for sentence, rate in self.nmea.items():
+            if not rate:
+                continue
+            n = ceil(self.satellites / 4) if sentence == 'GSV' else 1
+            size = n * NMEA_LENGTHS[sentence]
+            nmea.append((sentence, size, navPerSecond / rate,
+                         size * navPerSecond / rate))
+        if nmeaTotal and nmea:
+            perSecond = sum(row[2] for row in nmea)
+            bytesPerSecond = sum(row[3] for row in nmea)
+            nmea = [('NMEA', round(bytesPerSecond / perSecond), perSecond,
+                     bytesPerSecond)]
+        return rows + nmea
+
+    def total(self):
+        """Return the expected bytes per second of all messages."""
+        return sum(row[3] for row in self.rows())
+
+    def capacity(self):
+        """Return the bytes per second of the port (8N1), or None."""
+        return None if self.baudrate is None else self.baudrate / 10.0
+
+    def format(self, observed=None):
+        """Return the budget as a table.
+
+        observed is the result of Meter.rates(), then the measured bytes
+        per second are shown next to the expected ones, and the NMEA
+        sentences in one row as in rows(nmeaTotal=True).
+        """
+        lines = ["{:12s} {:>6s} {:>7s} {:>10s}{}".format(
+            "message", "bytes", "per s", "bytes/s",
+            "" if observed is None else " {:>10s}".format("observed")
+        )]
+        for name, size, perSecond, bytesPerSecond in \
+                self.rows(observed is not None):
+            line = "{:12s} {:6d} {:7.2f} {:10.1f}".format(
+                name, size, perSecond, bytesPerSecond
+            )
+            if observed is not None:
+                line += " {:10.1f}".format(observed.get(name, (0, 0))[1])
+            lines.append(line)
+        line = "{:12s} {:6s} {:7s} {:10.1f}".format("total", "", "",
+                                                    self.total())
+        if observed is not None:
+            line += " {:10.1f}".format(sum(b for f, b in observed.values()))
+        if self.baudrate is not None:
+            line += "  {:.0%} of {} baud".format(
+                self.total() / self.capacity(), self.baudrate
+            )
+        lines.append(line)
+        return "\n".join(lines)
+
+
+class Meter:
+    """Measures the throughput of a running UBXManager by type.
+
+    The counts are the difference between two UBXManager.stats()
+    snapshots, so nothing is subscribed or parsed for it. All NMEA
+    sentences are counted under 'NMEA'.
+    """
+
+    def __init__(self, manager):
+        """Start counting."""
+        self.manager = manager
+        self._start = manager.stats()
+
+    def counts(self):
+        """Return {name: (frames, bytes)} counted so far."""
+        stats = self.manager.stats()
+        counts = {}
+        for msgType, n in stats['ubx'].items():
+            start = self._start['ubx'].get(msgType, {'frames': 0, 'bytes': 0})
+            if n['frames'] > start['frames']:
+                counts[messageName(*msgType)] = (
+                    n['frames'] - start['frames'], n['bytes'] - start['bytes']
+                )
+        n, start = stats['nmea'], self._start['nmea']
+        if n['frames'] > start['frames']:
+            counts['NMEA'] = (n['frames'] - start['frames'],
+                              n['bytes'] - start['bytes'])
+        return counts
+
+    def rates(self):
+        """Return {name: (frames per second, bytes per second)}."""
+        seconds = self.manager.stats()['seconds'] - self._start['seconds']
+        return {name: (f / seconds, b / seconds)
+                for name, (f, b) in self.counts().items()}
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        'messages', nargs='*', metavar='MSG=RATE',
+        help='enabled message and its CFG-MSG rate, e.g. RXM-RAWX=1'
+        )
+    parser.add_argument('--measRate', type=int, default=1000,
+                        help='CFG-RATE measurement rate in ms')
+    parser.add_argument('--navRate', type=int, default=1,
+                        help='CFG-RATE navigation rate in measurements')
+    parser.add_argument('--satellites', type=int, default=30,
+                        help='satellites (repeated blocks) per message')
+    parser.add_argument('--baudrate', type=int, help='port baud rate')
+    parser.add_argument('--nmea', action='store_true',
+                        help='the default NMEA sentences are output')
+    parser.add_argument(
+        '--live', metavar='DEVICE',
+        help='read the configuration from the receiver on DEVICE and '
+             'measure the throughput'
+        )
+    parser.add_argument('--seconds', type=float, default=10,
+                        help='measuring time with --live')
+    args = parser.parse_args()
+
+    msgRates = {}
+    for arg in args.messages:
+        name, rate = arg.split('=')
+        msgClass, msgId = name.split('-')
+        msgRates[getattr(getattr(UBX, msgClass), msgId)] = int(rate)
+    nmea = dict.fromkeys(NMEA_LENGTHS, 1) if args.nmea else None
+
+    if args.live is None:
+        budget = Budget(msgRates, args.measRate, args.navRate, nmea,
+                        args.satellites, baudrate=args.baudrate)
+        print(budget.format())
+        sys.exit(0)
+
+    import serial
+    from time import sleep
+    from UBXManager import UBXManager
+    from UBXProfile import ConfigCache
+    from UBXBaudrate import detectBaudrate
+
+    class Manager(UBXManager):
+        def onUBX(self, obj):
+            pass
+
+        def onNMEA(self, buffer):
+            pass
+
+    ser = serial.Serial(args.live, 9600, timeout=0.1)
+    if detectBaudrate(ser) is None:
+        sys.stderr.write("No receiver found on {}\n".format(args.live))
+        sys.exit(1)
+    manager = Manager(ser, dispatchAll=False)
+    manager.start()
+    budget = Budget.fromReceiver(ConfigCache(manager), msgRates,
+                                 nmea=nmea, satellites=args.satellites)
+    meter = Meter(manager)
+    sleep(args.seconds)
+    print(budget.format(meter.rates()))
+    manager.shutdown()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""Buffered capture of the raw bytes read from a receiver.
+
+A capture file holds the bytes exactly as they were read, so UBXLogReader,
+UBXLogIndex and UBXParallelDecoder work on it, after decompression if it
+is compressed. The host time is recorded in a sidecar file with the suffix
+.ts, e.g. UBX.log.ts for UBX.log or UBX.log.gz, as TIMESTAMP records of
+the offset in the capture file after a read and the monotonic and wall
+clock times of that read.
+"""
+
+import sys
+import bz2
+import gzip
+import lzma
+import queue
+import threading
+from struct import Struct
+from time import localtime, strftime, monotonic
+from UBXFramer import hostTime
+
+TIMESTAMP = Struct('<Qdd')  # offset, time.monotonic(), time.time()
+
+COMPRESSION = {'gz': gzip.open, 'bz2': bz2.open, 'xz': lzma.open}
+
+
+def readTimestamps(filename):
+    """Return [(offset, monotonic, wall clock)] of a capture file."""
+    for suffix in COMPRESSION:
+        if filename.endswith('.' + suffix):
+            filename = filename[:-len(suffix)-1]
+    with open(filename + '.ts', 'rb') as f:
+        return list(TIMESTAMP.iter_unpack(f.read()))
+
+
+class UBXCapture:
+    """Writes the bytes read by a UBXManager to capture files.
+
+    write() only appends to a block in memory. Blocks of blockSize bytes,
+    or older than flushSeconds, are written and flushed by a background
+    thread, so capturing costs the reader next to nothing and can run
+    permanently. The age is checked by write() with the times passed to
+    it, and by the writer thread, so the last bytes are written also while
+    the reader waits for more. A TIMESTAMP record is written every interval
+    seconds (0 for every read), and one at the end.
+
+    path is passed to time.strftime with the local time at which each file
+    is started, e.g. 'UBX-%Y%m%d-%H%M%S.log'. A new file is started when
+    the current one has maxBytes bytes or is maxSeconds old. Files are only
+    switched between blocks, so a message can be split between two files.
+    A file name that was already used by this capture gets a suffix .1,
+    .2, ... compress is 'gz', 'bz2' or 'xz' and adds that suffix. The names
+    of the files written so far are in files.
+
+    If writing fails, the capture stops, and close() raises the error.
+    """
+
+    def __init__(self, path="UBX.log", maxBytes=None, maxSeconds=None,
+                 compress=None, blockSize=1 << 16, flushSeconds=1.0,
+                 interval=1.0):
+        """Instantiate and start the writer thread."""
+        if compress is not None and compress not in COMPRESSION:
+            raise Exception("Unknown compression {}".format(compress))
+        self.path = path
+        self.maxBytes = maxBytes
+        self.maxSeconds = maxSeconds
+        self.compress = compress
+        self.blockSize = blockSize
+        self.flushSeconds = flushSeconds
+        self.interval = interval
+        self.files = []
+        self.error = None
+        self._lock = threading.Lock()   # the block, write() vs. writer
+        self._block = bytearray()
+        self._stamps = []       # (offset, monotonic, wall) in the block
+        self._started = None    # monotonic() when the block was started
+        self._offset = 0        # bytes written to the capture so far
+        self._last = None       # (monotonic, wall) of the last write
+        self._stamped = 0       # offset of the last TIMESTAMP record
+        self._nextStamp = self._nextFlush = None
+        self._names = set()
+        self._file = self._stampFile = None
+        self._fileStart = self._fileOffset = self._fileBytes = 0
+        self._blocks = queue.Queue()
+        self._writer = threading.Thread(target=self._run, daemon=True)
+        self._writer.start()
+
+    def write(self, data, now=None):
+        """Append data, read at now = (monotonic, wall clock) time.
+
+        now defaults to hostTime(). Empty data only checks whether the
+        block is due.
+        """
+        if now is None:
+            now = hostTime()
+        with self._lock:
+            if data:
+                if not self._block:
+                    self._nextFlush = now[0] + self.flushSeconds
+                    self._started = monotonic()
+                self._block += data
+                self._offset += len(data)
+                self._last = now
+                if self._nextStamp is None or now[0] >= self._nextStamp:
+                    self._stamp(now)
+                    self._nextStamp = now[0] + self.interval
+            if len(self._block) >= self.blockSize or \
+                    self._block and now[0] >= self._nextFlush:
+                self._handOff(now)
+
+    def _stamp(self, now):
+        self._stamps.append((self._offset,) + tuple(now))
+        self._stamped = self._offset
+
+    def _handOff(self, now):
+        self._blocks.put((bytes(self._block), self._stamps,
+                          self._offset - len(self._block), now))
+        self._block = bytearray()
+        self._stamps = []
+
+    def _flushDue(self):
+        # writer thread: hand off the block if it is flushSeconds old,
+        # return the seconds to wait for the next block
+        with self._lock:
+            if not self._block:
+                return self.flushSeconds
+            age = monotonic() - self._started
+            if age < self.flushSeconds:
+                return self.flushSeconds - age
+            self._handOff(self._last)
+            return self.flushSeconds
+
+    def close(self):
+        """Write what is buffered and close the files."""
+        with self._lock:
+            if self._stamped != self._offset:
+                self._stamp(self._last)
+            if self._block or self._stamps:
+                self._handOff(self._last)
+            self._blocks.put(None)
+        self._writer.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        """Write the blocks handed off by write() or _flushDue()."""
+        timeout = self.flushSeconds
+        while True:
+            try:
+                item = self._blocks.get(timeout=timeout)
+            except queue.Empty:
+                timeout = self._flushDue()
+                continue
+            if item is None:
+                break
+            timeout = self._flushDue()
+            if self.error is None:
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    self.error = e
+                    sys.stderr.write("Capture stopped: {}\n".format(e))
+        try:
+            self._close()
+        except Exception as e:
+            self.error = self.error or e
+
+    def _write(self, block, stamps, offset, now):
+        if self._file is not None and (
+                self.maxBytes is not None and
+                self._fileBytes >= self.maxBytes or
+                self.maxSeconds is not None and
+                now[0] - self._fileStart >= self.maxSeconds):
+            self._close()
+        if self._file is None:
+            self._open(now, offset)
+        self._file.write(block)
+        self._fileBytes += len(block)
+        self._stampFile.write(b''.join(
+            TIMESTAMP.pack(o - self._fileOffset, m, w) for o, m, w in stamps
+        ))
+        self._file.flush()
+        self._stampFile.flush()
+
+    def _open(self, now, offset):
+        name = base = strftime(self.path, localtime(now[1]))
+        n = 0
+        while name in self._names:
+            n += 1
+            name = "{}.{}".format(base, n)
+        self._names.add(name)
+        if self.compress is None:
+            self._file = open(name, 'wb')
+        else:
+            self._file = COMPRESSION[self.compress](
+                name + '.' + self.compress, 'wb'
+            )
+        self._stampFile = open(name + '.ts', 'wb')
+        self.files.append(name if self.compress is None
+                          else name + '.' + self.compress)
+        self._fileStart, self._fileOffset, self._fileBytes = \
+            now[0], offset, 0
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._stampFile.close()
+            self._file = self._stampFile = None
+
+
+if __name__ == '__main__':
+
+    import argparse
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('device', help='serial device of the receiver')
+    parser.add_argument('path', nargs='?', default='UBX-%Y%m%d-%H%M%S.log',
+                        help='capture file name, with strftime fields')
+    parser.add_argument('--baudrate', type=int,
+                        help='default: detect the baud rate')
+    parser.add_argument('--maxBytes', type=int, help='rotate at this size')
+    parser.add_argument('--maxSeconds', type=float,
+                        help='rotate after this time')
+    parser.add_argument('--compress', choices=sorted(COMPRESSION))
+    args = parser.parse_args()
+
+    import serial
+    from UBXManager import UBXManager
+    from UBXBaudrate import detectBaudrate
+    # nothing is parsed without subscriptions
+    ser = serial.Serial(args.device, args.baudrate or 9600, timeout=1)
+    if args.baudrate is None and detectBaudrate(ser) is None:
+        sys.stderr.write("No receiver found on {}\n".format(args.device))
+        sys.exit(1)
+    capture = UBXCapture(args.path, args.maxBytes, args.maxSeconds,
+                         args.compress)
+    manager = UBXManager(ser, dispatchAll=False, capture=capture)
+    manager.onNMEA = lambda sentence: None
+    manager.start()
+    try:
+        manager.join()
+    except KeyboardInterrupt:
+        manager.shutdown()
+        manager.join()
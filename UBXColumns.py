@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Decode many UBX payloads of one message type into NumPy columns.
+
+This is meant for offline processing of long captures, where creating one
+Python object per message is the bottleneck. The dtypes are derived from
+the Fields definitions in UBX/, see Types.py. Requires NumPy.
+"""
+
+from itertools import islice
+from UBXMessage import lookupMessage
+
+
+def decodeColumns(msgClass, msgId, payloads):
+    """Decode payloads of message msgClass, msgId into columns.
+
+    payloads is an iterable of bytes-like objects (e.g. memoryviews). The
+    result is a pair (once, repeated) of dicts that map field names to
+    NumPy arrays:
+    - once has one row per payload and a column per once-block field.
+    - repeated is the long-format table of all repeated blocks with one row
+      per block, a column per Repeated field, and a column 'parent' that
+      holds the row index in once of the payload the block belongs to.
+      It is None for messages without a Repeated block.
+    """
+    import numpy as np
+    Cls = lookupMessage(msgClass, msgId)
+    if Cls is None:
+        raise Exception(
+            "Cannot decode message ID {} of message class {}"
+            .format(msgId, msgClass)
+        )
+    layout = Cls._layout
+    payloads = list(payloads)
+    n = len(payloads)
+    lengths = np.fromiter(map(len, payloads), dtype=np.int64, count=n)
+    sizeOnce = layout.once.size
+    if layout.repeat is None:
+        bad = lengths != sizeOnce
+    else:
+        sizeRepeat = layout.repeat.size
+        bad = (lengths < sizeOnce) | ((lengths - sizeOnce) % sizeRepeat != 0)
+    if bad.any():
+        i = int(np.argmax(bad))
+        raise Exception(
+            "Payload {} has length {}, which does not match {}"
+            .format(i, lengths[i], layout.clsName)
+        )
+    if layout.repeat is None:
+        onceBytes = b''.join(payloads)
+    else:
+        onceBytes = b''.join(p[:sizeOnce] for p in payloads)
+    onceArray = np.frombuffer(onceBytes, dtype=layout.onceDtype(), count=n)
+    once = {name: onceArray[name] for name in layout.onceNames}
+    if layout.repeat is None:
+        return once, None
+    repeatArray = np.frombuffer(
+        b''.join(p[sizeOnce:] for p in payloads), dtype=layout.repeatDtype()
+    )
+    repeated = {name: repeatArray[name] for name in layout.repeatNames}
+    repeated['parent'] = np.repeat(
+        np.arange(n), (lengths - sizeOnce) // sizeRepeat
+    )
+    return once, repeated
+
+
+def iterColumns(msgClass, msgId, payloads, batchSize=10000):
+    """Decode payloads in batches of batchSize messages.
+
+    Yields the (once, repeated) pairs of decodeColumns for each batch, so
+    arbitrarily long streams can be processed in bounded memory. The
+    'parent' column counts rows from the start of the stream, not from the
+    start of the batch.
+    """
+    payloads = iter(payloads)
+    row = 0
+    while True:
+        batch = list(islice(payloads, batchSize))
+        if not batch:
+            return
+        once, repeated = decodeColumns(msgClass, msgId, batch)
+        if repeated is not None:
+            repeated['parent'] += row
+        row += len(batch)
+        yield once, repeated
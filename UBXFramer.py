@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""Split a byte stream into UBX frames and NMEA sentences."""
+
+from functools import reduce
+from operator import xor
+from time import monotonic, time
+from UBXMessage import UBXMessage, _maxLengthTable
+
+# kinds of items yielded by scan()
+UBX, UBX_ERROR, NMEA, NMEA_ERROR, INCOMPLETE, LENGTH_ERROR = range(6)
+
+NMEA_MAX_LENGTH = 1024  # give up on a '$' that isn't followed by a '*'
+
+
+def hostTime():
+    """Return the host time as (time.monotonic(), time.time())."""
+    return monotonic(), time()
+
+
+def scan(buf, pos=0, end=None, checksum=None, final=False):
+    """Scan buf[pos:end] for UBX frames and NMEA sentences.
+
+    buf can be anything with find() and integer indexing, e.g. a bytes,
+    bytearray or mmap object. Sync points are located with find(), and
+    whole length-prefixed UBX frames and whole NMEA sentences are checked
+    at once. Yields (kind, start, stop) tuples, where buf[start:stop] is
+    - UBX: a UBX frame from the sync chars to the checksum, or
+    - UBX_ERROR: the same with an incorrect checksum,
+    - NMEA: an NMEA sentence from '$' to the checksum (without CR/LF), or
+    - NMEA_ERROR: the same with an incorrect checksum, or
+    - LENGTH_ERROR: a UBX header (sync chars, class, ID and length) whose
+      length exceeds maxPayloadLength() of its message type.
+    Bytes between the yielded items don't belong to any message. The last
+    item is always (INCOMPLETE, start, end), where buf[start:end] is the
+    beginning of a message that needs more bytes (start == end if there is
+    none). With final=True buf[end:] will never arrive, so an incomplete
+    message is taken for a false sync and skipped, and the last item is
+    always (INCOMPLETE, end, end).
+
+    After a checksum or length error the scan resumes at the byte after
+    the sync char, so messages inside a false or corrupted frame are not
+    lost. The length is checked as soon as the header is there, whether or
+    not the rest of the frame is, so the result doesn't depend on how the
+    stream is split into chunks. Frames of unknown message classes are
+    length errors too. An NMEA sentence interrupted by a UBX sync char is
+    taken for a false sync right away.
+
+    checksum(buf, start, end) computes the UBX checksum, it defaults to
+    UBXMessage.Checksum.compute.
+    """
+    if end is None:
+        end = len(buf)
+    if checksum is None:
+        checksum = UBXMessage.Checksum.compute
+    sync1 = UBXMessage.sync_char_1
+    sync2 = UBXMessage.sync_char_2[0]
+    maxLength = _maxLengthTable
+    nextUBX = buf.find(sync1, pos, end)
+    while True:
+        # Only search for sync1 again when pos has moved past it, and
+        # only look for '$' up to the next sync1. This keeps the scan
+        # linear in the buffer length for UBX, NMEA and mixed streams.
+        if 0 <= nextUBX < pos:
+            nextUBX = buf.find(sync1, pos, end)
+        nextNMEA = buf.find(b'$', pos, end if nextUBX < 0 else nextUBX)
+        if nextUBX < 0 and nextNMEA < 0:
+            yield INCOMPLETE, end, end
+            return
+        if nextNMEA < 0:
+            i = nextUBX
+            if i + 1 < end and buf[i+1] != sync2:
+                pos = i + 1
+                continue
+            if end - i < 6:
+                if final:       # no more bytes will come
+                    pos = i + 1
+                    continue
+                yield INCOMPLETE, i, end
+                return
+            length = buf[i+4] | (buf[i+5] << 8)
+            if length > maxLength[256 * buf[i+2] + buf[i+3]]:
+                yield LENGTH_ERROR, i, i + 6
+                pos = i + 1
+                continue
+            stop = i + 8 + length
+            if stop > end:
+                if final:       # no more bytes will come
+                    pos = i + 1
+                    continue
+                yield INCOMPLETE, i, end
+                return
+            if buf[stop-2] * 256 + buf[stop-1] == checksum(buf, i+2, stop-2):
+                yield UBX, i, stop
+                pos = stop
+            else:
+                yield UBX_ERROR, i, stop
+                pos = i + 1
+        else:
+            j = nextNMEA
+            starEnd = min(end if nextUBX < 0 else nextUBX,
+                          j + 1 + NMEA_MAX_LENGTH)
+            star = buf.find(b'*', j + 1, starEnd)
+            if star < 0:
+                if starEnd < end:   # no '*' before a sync char or too long
+                    pos = j + 1
+                    continue
+                if final:       # no more bytes will come
+                    pos = j + 1
+                    continue
+                yield INCOMPLETE, j, end
+                return
+            if star + 3 > end:
+                if final:       # no more bytes will come
+                    pos = j + 1
+                    continue
+                yield INCOMPLETE, j, end
+                return
+            try:
+                chksum = int(buf[star+1:star+3], 16)
+            except ValueError:
+                pos = j + 1
+                continue
+            body = buf[j+1:star]
+            if not body.isascii():
+                pos = j + 1
+                continue
+            calc = reduce(xor, body, 0)
+            if chksum == calc:
+                yield NMEA, j, star + 3
+                pos = star + 3
+            else:
+                yield NMEA_ERROR, j, star + 3
+                pos = j + 1
+
+
+class UBXFramer:
+    """Chunked UBX/NMEA framer.
+
+    Bytes are fed in chunks of arbitrary size with feed(), which splits
+    them into messages with scan() instead of running a state machine byte
+    by byte. Incomplete messages stay in the buffer until the next feed().
+
+    The callbacks have the same signatures as the UBXManager handlers:
+    onUBX(msgClass, msgId, payload), onUBXError(msgClass, msgId, errMsg),
+    onNMEA(sentence) and onNMEAError(errMsg).
+
+    If accept(msgClass, msgId, length) is given, UBX frames for which it
+    returns False are dropped without copying their payload.
+
+    Every frame is counted, accepted or not, for UBXManager.stats():
+    - counts: {256 * class ID + message ID: [frames, bytes, checksum
+      errors]}, bytes with header and checksum, checksum errors by the
+      type in the header,
+    - nmeaCounts: [sentences, bytes, checksum errors], bytes with CR/LF,
+    - syncLosses: how often bytes had to be skipped to find the next
+      message, e.g. after a checksum error, and skippedBytes: how many.
+
+    If clock is given, e.g. hostTime, it is read once per feed(), and
+    while a message is handed on, arrival is the (monotonic, wall clock)
+    time at which its first byte arrived, and completed the same for the
+    feed() with its last byte. The last byte of a chunk is taken to
+    arrive at the time of its feed(), and the bytes before it one byteTime
+    (seconds, e.g. 10 / baud rate) apart, but spread no further than over
+    the time since the previous feed().
+    """
+
+    def __init__(self, onUBX, onUBXError, onNMEA, onNMEAError, accept=None,
+                 clock=None):
+        """Instantiate with the four message handlers."""
+        self.onUBX = onUBX
+        self.onUBXError = onUBXError
+        self.onNMEA = onNMEA
+        self.onNMEAError = onNMEAError
+        self.accept = accept
+        self.clock = clock
+        self.byteTime = None
+        self.buffer = bytearray()
+        self.arrival = self.completed = None
+        self._lastFeed = None
+        # (end in buffer, monotonic, seconds per byte, wall - monotonic)
+        self._chunks = []
+        self._gap = False       # skipping bytes at the end of the buffer
+        self._eol = False       # after an NMEA sentence, before its CR/LF
+        self.resetCounts()
+
+    def reset(self):
+        """Drop all buffered bytes."""
+        del self.buffer[:]
+        self._gap = self._eol = False
+        self._lastFeed = None
+        self._chunks = []
+
+    def resetCounts(self):
+        """Set all counts to zero."""
+        self.counts = {}
+        self.nmeaCounts = [0, 0, 0]
+        self.syncLosses = 0
+        self.skippedBytes = 0
+
+    def feed(self, data):
+        """Append data to the buffer and handle all complete messages.
+
+        UBX payloads are handed on as a single bytes copy.
+        """
+        buf = self.buffer
+        buf += data
+        accept = self.accept
+        counts = self.counts
+        clock = self.clock
+        if clock is not None:
+            now, wall = clock()
+            perByte = self.byteTime
+            if self._lastFeed is not None and data:
+                spread = (now - self._lastFeed) / len(data)
+                perByte = spread if perByte is None else min(perByte, spread)
+            self._chunks.append((len(buf), now, perByte or 0, wall - now))
+            self._lastFeed, self.completed = now, (now, wall)
+        last, gap, eol = 0, self._gap, self._eol
+        with memoryview(buf) as view:
+            for kind, start, stop in scan(buf):
+                if eol:
+                    i = last
+                    while last < start and buf[last] in b'\r\n':
+                        last += 1
+                    self.nmeaCounts[1] += last - i
+                    eol = last == start
+                if start > last:
+                    self.skippedBytes += start - last
+                    if not gap:
+                        self.syncLosses += 1
+                    gap, eol = True, False
+                if kind == UBX:
+                    key = 256 * buf[start+2] + buf[start+3]
+                    n = counts.get(key)
+                    if n is None:
+                        n = counts[key] = [0, 0, 0]
+                    n[0] += 1
+                    n[1] += stop - start
+                    last, gap = stop, False
+                    if accept is None or \
+                            accept(buf[start+2], buf[start+3], stop-start-8):
+                        if clock is not None:
+                            self.arrival = self._arrival(start)
+                        self.onUBX(buf[start+2], buf[start+3],
+                                   bytes(view[start+6:stop-2]))
+                elif kind == NMEA:
+                    self.nmeaCounts[0] += 1
+                    self.nmeaCounts[1] += stop - start
+                    last, gap, eol = stop, False, True
+                    if clock is not None:
+                        self.arrival = self._arrival(start)
+                    self.onNMEA(buf[start+1:stop-3].decode('ascii'))
+                elif kind == UBX_ERROR:
+                    # the frame is skipped, up to the next message in it
+                    key = 256 * buf[start+2] + buf[start+3]
+                    counts.setdefault(key, [0, 0, 0])[2] += 1
+                    last = start
+                    self._onChecksumError(buf, start, stop)
+                elif kind == LENGTH_ERROR:
+                    # the header is skipped, like a frame with a bad checksum
+                    last = start
+                    self._onLengthError(buf, start)
+                elif kind == NMEA_ERROR:
+                    self.nmeaCounts[2] += 1
+                    last = start
+                    calc = reduce(xor, buf[start+1:stop-3], 0)
+                    self.onNMEAError(
+                        "Incorrect Checksum: {:02X} should be {:02X}"
+                        .format(calc, int(buf[stop-2:stop], 16))
+                    )
+        self._gap, self._eol = gap, eol
+        del buf[:start]     # start of the INCOMPLETE item
+        if clock is not None and start > 0:
+            self._chunks = [(end - start, t, perByte, offset)
+                            for end, t, perByte, offset in self._chunks
+                            if end > start]
+
+    def _arrival(self, pos):
+        """Return the (monotonic, wall clock) arrival time of buffer[pos]."""
+        for end, t, perByte, offset in self._chunks:
+            if end > pos:
+                t -= (end - 1 - pos) * perByte
+                return t, t + offset
+
+    def _onChecksumError(self, buf, start, stop):
+        calc = UBXMessage.Checksum.compute(buf, start+2, stop-2)
+        self.onUBXError(
+            buf[start+2],
+            buf[start+3],
+            "Incorrect Checksum: {:04X} should be {:04X}"
+                .format(calc, buf[stop-2] * 256 + buf[stop-1])
+        )
+
+    def _onLengthError(self, buf, start):
+        length = buf[start+4] | (buf[start+5] << 8)
+        maxLength = _maxLengthTable[256 * buf[start+2] + buf[start+3]]
+        self.onUBXError(
+            buf[start+2],
+            buf[start+3],
+            "Unknown message class" if maxLength < 0 else
+            "Incorrect Length: {} exceeds {}".format(length, maxLength)
+        )
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""Read many receivers in one thread."""
+
+import os
+import sys
+import select
+import threading
+import selectors
+from queue import SimpleQueue
+from UBXManager import UBXDispatcher
+
+
+class Device:
+    """A receiver connected to a UBXHub.
+
+    f is a file descriptor or an object with fileno(), e.g. a
+    serial.Serial or a socket. id identifies the device in the messages,
+    it is the SEC-UNIQID chip ID if the hub was asked to identify it.
+    """
+
+    def __init__(self, hub, f, deviceId=None):
+        """Instantiate, use UBXHub.add() instead."""
+        self.f = f
+        self.fd = f if isinstance(f, int) else f.fileno()
+        self.id = deviceId
+        self.framer = hub._newFramer()
+
+    def __repr__(self):
+        return "Device({})".format(self.id if self.id is not None else self.fd)
+
+    def send(self, msg):
+        """Write a message (an object with serialize() or bytes).
+
+        If the file descriptor is non-blocking, this waits until it can
+        take the rest of the message.
+        """
+        if hasattr(msg, 'serialize'):
+            msg = msg.serialize()
+        while msg:
+            try:
+                msg = msg[os.write(self.fd, msg):]
+            except BlockingIOError:
+                select.select([], [self.fd], [])
+
+
+class UBXHub(UBXDispatcher, threading.Thread):
+    """One thread that reads many receivers with selectors.
+
+    Each device added with add() has its own framer, but all messages go
+    through the hooks and subscriptions of the hub, as in UBXManager.
+    Every parsed UBX object has an attribute device with the Device it came
+    from, and while a message is dispatched self.device is that Device,
+    e.g. for onNMEA or raw subscriptions, and self.framer is its framer.
+    Devices are added to and removed from devices and the selector by the
+    hub thread, when it next wakes up.
+    stats() adds up the counts of the devices that are still added, and
+    latency() those of all devices.
+    """
+
+    def __init__(self, chunkSize=4096, lazy=False, dispatchAll=True,
+                 trace=False):
+        """Instantiate, see UBXManager for the arguments."""
+        threading.Thread.__init__(self)
+        UBXDispatcher.__init__(self, lazy, dispatchAll, trace)
+        self.chunkSize = chunkSize
+        self.device = None
+        self.devices = []
+        self._selector = selectors.DefaultSelector()
+        self._changes = SimpleQueue()   # (Device, True to add) for run()
+        self._wakeup, self._wakeupWrite = os.pipe()
+        self._selector.register(self._wakeup, selectors.EVENT_READ)
+        self._shutDown = False
+        self.subscribe((0x27, 0x03), self._onUNIQID)
+
+    def add(self, f, deviceId=None, identify=False):
+        """Add a device and return its Device.
+
+        With identify=True a SEC-UNIQID poll is sent and the device id is
+        set to the chip ID in hex when the answer arrives.
+        """
+        device = Device(self, f, deviceId)
+        self._changes.put((device, True))
+        os.write(self._wakeupWrite, b'\x00')
+        if identify:
+            import UBX
+            device.send(UBX.SEC.UNIQID.Get())
+        return device
+
+    def remove(self, device):
+        """Stop reading a device."""
+        self._changes.put((device, False))
+        os.write(self._wakeupWrite, b'\x00')
+
+    def _applyChanges(self):
+        # in the hub thread: add and remove the devices queued since
+        while not self._changes.empty():
+            device, add = self._changes.get()
+            if add:
+                self._selector.register(device.fd, selectors.EVENT_READ,
+                                        device)
+                self.devices.append(device)
+            elif device in self.devices:
+                self._selector.unregister(device.fd)
+                self.devices.remove(device)
+
+    def _onUNIQID(self, obj):
+        if self.device.id is None:
+            self.device.id = "".join(
+                "{:02X}".format(getattr(obj, "uniqueId_{}".format(i)))
+                for i in range(1, 6)
+            )
+
+    @property
+    def framer(self):
+        """The framer of the device being dispatched, or None."""
+        return self.device.framer if self.device is not None else None
+
+    def _framers(self):
+        return [device.framer for device in list(self.devices)]
+
+    def _parse(self, msgClass, msgId, buffer):
+        obj = UBXDispatcher._parse(self, msgClass, msgId, buffer)
+        obj.device = self.device
+        return obj
+
+    def run(self):
+        """Read all devices until shutdown()."""
+        while not self._shutDown:
+            self._applyChanges()
+            for key, events in self._selector.select():
+                device = key.data
+                if device is None:      # woken up by add, remove or shutdown
+                    os.read(self._wakeup, 4096)
+                    continue
+                try:
+                    data = os.read(device.fd, self.chunkSize)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b''          # e.g. EIO of a closed pty
+                if not data:
+                    self._selector.unregister(device.fd)
+                    self.devices.remove(device)
+                    self.onClose(device)
+                    continue
+                self.device = device
+                device.framer.feed(data)
+                self.device = None
+        self._selector.close()
+        os.close(self._wakeup)
+        os.close(self._wakeupWrite)
+
+    def onClose(self, device):
+        """Handle the end of the stream of a device."""
+
+    def onUBX(self, obj):
+        """Default handler for good UBX message."""
+        print("{}: {}".format(obj.device, obj))
+
+    def onNMEA(self, buffer):
+        """Default handler for good NMEA message."""
+        print("{}: NMEA: {}".format(self.device, buffer))
+
+    def shutdown(self):
+        """Stop the hub."""
+        self._shutDown = True
+        os.write(self._wakeupWrite, b'\x00')
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        sys.stderr.write("Usage:\n  UBXHub.py DEVICE ...\n\n" + __doc__)
+        sys.exit(1)
+
+    import tty
+    import UBX     # registers the message classes
+    hub = UBXHub()
+    for path in sys.argv[1:]:
+        fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(fd)
+        hub.add(fd, identify=True)
+    hub.start()
+    try:
+        hub.join()
+    except KeyboardInterrupt:
+        hub.shutdown()
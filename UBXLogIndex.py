@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""Sidecar time index for UBX capture files.
+
+The index lists every UBX frame of a capture with its file offset, class,
+ID, payload length and epoch time, so a time range or a message type can be
+found by binary search instead of parsing the capture from the start.
+"""
+
+import os
+import sys
+from array import array
+from bisect import bisect_left
+from heapq import merge
+from struct import Struct
+import UBX     # registers the message classes
+from UBXMessage import lookupMessage, messageType
+from UBXLogReader import UBXLogReader
+
+WEEK_MS = 7 * 24 * 3600 * 1000
+
+
+def _timeField(msgClass, msgId):
+    """Return (offset, struct, scale) of the iTOW or rcvrTow field, or None.
+
+    scale converts the field value to milliseconds.
+    """
+    Cls = lookupMessage(msgClass, msgId)
+    if Cls is None:
+        return None
+    layout = Cls._layout
+    for name, typ, offset in zip(
+            layout.onceNames, layout.onceTypes, layout.onceOffsets):
+        if name == 'iTOW':      # U4 in ms
+            return offset, typ._struct, 1
+        if name == 'rcvrTow':   # R8 in s
+            return offset, typ._struct, 1000
+    return None
+
+
+class UBXLogIndex:
+    """Time index of a capture file, stored in a sidecar file.
+
+    The index has one record per UBX frame with a correct checksum:
+    - offsets: file offset of the frame
+    - times: epoch time in ms, see below
+    - types: 256 * class ID + message ID
+    - lengths: payload length
+    Each is an array in file order.
+
+    The epoch time is the iTOW (or rcvrTow of RXM-RAWX) of the latest frame
+    that has one, so frames without a time field inherit the time of their
+    epoch. It is counted from the start of the GPS week of the first epoch
+    and keeps increasing over week rollovers, so times never decrease and
+    can be searched with bisect. Frames before the first epoch have -1.
+
+    The sidecar is filename + '.idx' by default. update() indexes only the
+    bytes appended to the capture since the last update, it is called when
+    the index is created unless update=False.
+    """
+
+    MAGIC = b'UBXIDX1\n'
+    HEADER = Struct('<8sQ')     # magic, number of capture bytes indexed
+    RECORD = Struct('<QqBBH')   # offset, time, class ID, message ID, length
+
+    def __init__(self, filename, indexFilename=None, update=True):
+        """Load the index of capture filename, and update it."""
+        self.filename = filename
+        self.indexFilename = indexFilename or filename + '.idx'
+        self._clear()
+        self._load()
+        if update:
+            self.update()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _clear(self):
+        self.offsets = array('Q')
+        self.times = array('q')
+        self.types = array('H')
+        self.lengths = array('H')
+        self.end = 0        # capture bytes covered by the index
+        self._byType = None
+
+    def _append(self, offset, time, msgClass, msgId, length):
+        self.offsets.append(offset)
+        self.times.append(time)
+        self.types.append(256 * msgClass + msgId)
+        self.lengths.append(length)
+
+    def _load(self):
+        try:
+            with open(self.indexFilename, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        if len(data) < self.HEADER.size:
+            return
+        magic, end = self.HEADER.unpack_from(data)
+        if magic != self.MAGIC:
+            raise Exception(
+                "{} is not a UBX index file".format(self.indexFilename)
+            )
+        n = (len(data) - self.HEADER.size) // self.RECORD.size
+        records = data[self.HEADER.size:self.HEADER.size +
+                       n * self.RECORD.size]
+        for record in self.RECORD.iter_unpack(records):
+            if record[0] >= end:    # written after the last header
+                break
+            self._append(*record)
+        self.end = end
+
+    def update(self):
+        """Index the frames appended to the capture since the last update.
+
+        Returns the number of new records. The index is rebuilt from
+        scratch if the capture has become shorter.
+        """
+        size = os.path.getsize(self.filename)
+        if size < self.end:
+            self._clear()
+        if size == self.end:
+            return 0
+        n = len(self)
+        time = self.times[-1] if n else -1
+        week = time - time % WEEK_MS if time >= 0 else 0
+        timeFields = {}
+        with UBXLogReader(self.filename, nmea=False) as reader:
+            for offset, msgClass, msgId, payload in reader.frames(self.end, final=False):
+                msgType = (msgClass, msgId)
+                if msgType not in timeFields:
+                    timeFields[msgType] = _timeField(msgClass, msgId)
+                field = timeFields[msgType]
+                if field is not None and \
+                        len(payload) >= field[0] + field[1].size:
+                    t = field[1].unpack_from(payload, field[0])[0] * field[2]
+                    if 0 <= t < WEEK_MS:
+                        t = week + int(round(t))
+                        if t < time - WEEK_MS // 2:     # week rollover
+                            week += WEEK_MS
+                            t += WEEK_MS
+                        time = max(time, t)
+                self._append(offset, time, msgClass, msgId, len(payload))
+            payload = None
+            stats = reader.stats
+        self.end += stats['bytes'] - stats['truncatedBytes']
+        self._byType = None
+        self._write(n)
+        return len(self) - n
+
+    def _write(self, n):
+        """Write the records from n on, then the header."""
+        mode = 'r+b' if n and os.path.exists(self.indexFilename) else 'w+b'
+        with open(self.indexFilename, mode) as f:
+            f.seek(self.HEADER.size + n * self.RECORD.size)
+            f.truncate()
+            pack = self.RECORD.pack
+            f.write(b''.join(
+                pack(self.offsets[i], self.times[i], self.types[i] >> 8,
+                     self.types[i] & 0xff, self.lengths[i])
+                for i in range(n, len(self))
+            ))
+            f.flush()
+            f.seek(0)
+            f.write(self.HEADER.pack(self.MAGIC, self.end))
+
+    def _typeIndex(self):
+        """Return {type: (times, rows)} with the records of each type."""
+        if self._byType is None:
+            byType = {}
+            for row, (msgType, time) in enumerate(zip(self.types, self.times)):
+                if msgType not in byType:
+                    byType[msgType] = (array('q'), array('L'))
+                times, rows = byType[msgType]
+                times.append(time)
+                rows.append(row)
+            self._byType = byType
+        return self._byType
+
+    @staticmethod
+    def _range(times, start, end):
+        i = 0 if start is None else bisect_left(times, start)
+        j = len(times) if end is None else bisect_left(times, end, i)
+        return i, j
+
+    def search(self, start=None, end=None, msgTypes=None):
+        """Yield the record numbers with start <= time < end in file order.
+
+        msgTypes restricts the records to the given message types, either
+        (class ID, message ID) tuples or message classes. Each type is
+        searched separately, so rare types are found without a scan.
+        """
+        if msgTypes is None:
+            return iter(range(*self._range(self.times, start, end)))
+        byType = self._typeIndex()
+        ranges = []
+        for msgClass, msgId in map(messageType, msgTypes):
+            if 256 * msgClass + msgId in byType:
+                times, rows = byType[256 * msgClass + msgId]
+                i, j = self._range(times, start, end)
+                ranges.append(rows[i:j])
+        return merge(*ranges)
+
+    def records(self, start=None, end=None, msgTypes=None):
+        """Yield (time, offset, msgClass, msgId, length), see search()."""
+        for row in self.search(start, end, msgTypes):
+            msgType = self.types[row]
+            yield self.times[row], self.offsets[row], \
+                msgType >> 8, msgType & 0xff, self.lengths[row]
+
+    def frames(self, start=None, end=None, msgTypes=None):
+        """Yield (time, offset, msgClass, msgId, payload), see search().
+
+        The payloads are memoryviews into the capture, as in UBXLogReader.
+        """
+        with UBXLogReader(self.filename) as reader:
+            for row in self.search(start, end, msgTypes):
+                yield (self.times[row], self.offsets[row]) + \
+                    reader.frameAt(self.offsets[row])
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) not in [2, 4]:
+        sys.stderr.write(
+            "Usage:\n  UBXLogIndex.py FILENAME [START_MS END_MS]\n\n" +
+            __doc__
+        )
+        sys.exit(1)
+
+    index = UBXLogIndex(sys.argv[1])
+    sys.stderr.write("{} frames indexed in {}\n".format(
+        len(index), index.indexFilename
+    ))
+    if len(sys.argv) == 4:
+        for time, offset, msgClass, msgId, length in \
+                index.records(int(sys.argv[2]), int(sys.argv[3])):
+            print("{:10d} {:08X} {:02X}:{:02X} {}".format(
+                time, offset, msgClass, msgId, length
+            ))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""Read UBX frames and NMEA sentences from capture files.
+
+A capture is a file of raw receiver output, such as the UBX.log written by
+UBXManager in debug mode.
+"""
+
+import os
+import sys
+import mmap
+from UBXMessage import UBXMessage, messageType
+from UBXFramer import scan, UBX, UBX_ERROR, NMEA, NMEA_ERROR, INCOMPLETE
+
+
+def _mkNumpyChecksum():
+    """Return a NumPy implementation of Checksum.compute, or None.
+
+    ck_a is the byte sum and ck_b the dot product with the weights n..1.
+    Both are only needed modulo 256, so wrap-around in uint32 is harmless.
+    """
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    weights = np.arange(65536 + 8, 0, -1, dtype=np.uint32)
+    compute = UBXMessage.Checksum.compute
+
+    def checksum(buffer, start, end):
+        n = end - start
+        if n < 64:      # not worth the NumPy call overhead
+            return compute(buffer, start, end)
+        x = np.frombuffer(buffer, np.uint8, n, start)
+        a = int(x.sum()) & 0xff
+        b = int(np.dot(x, weights[-n:])) & 0xff
+        return a * 256 + b
+    return checksum
+
+
+class UBXLogReader:
+    """Memory-mapped reader for UBX/NMEA capture files.
+
+    Iterating yields (offset, msgClass, msgId, payload) for every UBX frame
+    with a correct checksum, where offset is the file offset of the frame
+    and payload is a memoryview into the file. NMEA sentences are yielded
+    as (offset, None, None, sentence) with sentence a str as in onNMEA.
+
+    msgTypes restricts the UBX frames to the given message types, either
+    (class ID, message ID) tuples or message classes such as UBX.RXM.RAWX.
+    With nmea=False no NMEA sentences are yielded.
+
+    After (or during) iteration stats holds the counts of the last pass:
+    - bytes: number of bytes scanned so far
+    - ubx, nmea: number of good UBX frames and NMEA sentences
+    - checksumErrors: number of frames and sentences with a bad checksum
+    - corruptedBytes: bytes that are not part of a good message
+    - truncatedBytes: bytes of the incomplete message at the end, if any
+      (only with final=False, see frames())
+
+    The payload memoryviews point into the memory map, so copy them with
+    bytes() if they are needed after the reader is closed.
+    """
+
+    def __init__(self, filename, msgTypes=None, nmea=True):
+        """Open and memory-map filename."""
+        self.filename = filename
+        self.msgTypes = None if msgTypes is None \
+            else set(map(messageType, msgTypes))
+        self.nmea = nmea
+        self._file = open(filename, 'rb')
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._buf = mmap.mmap(
+                self._file.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        else:
+            self._buf = b''
+        self._view = memoryview(self._buf)
+        self._checksum = _mkNumpyChecksum()
+        self.stats = {}
+
+    def __len__(self):
+        return len(self._buf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Unmap and close the file."""
+        self._view.release()
+        if isinstance(self._buf, mmap.mmap):
+            try:
+                self._buf.close()
+            except BufferError:
+                pass    # payloads still referenced, unmapped when collected
+        self._file.close()
+
+    def __iter__(self):
+        return self.frames()
+
+    def frameAt(self, offset):
+        """Return (msgClass, msgId, payload) of the UBX frame at offset.
+
+        The frame is not validated, offset must come from frames() or an
+        index of the file.
+        """
+        buf = self._buf
+        length = buf[offset+4] | (buf[offset+5] << 8)
+        return buf[offset+2], buf[offset+3], \
+            self._view[offset+6:offset+6+length]
+
+    def frames(self, start=0, end=None, final=True):
+        """Yield the messages in the byte range [start, end) of the file.
+
+        With final=True a message that is cut off at end is skipped like
+        any other false sync, so messages hidden behind it are recovered.
+        Use final=False if the file is still growing: the scan then stops
+        at an incomplete message and stats['truncatedBytes'] tells where
+        to resume.
+        """
+        buf, view = self._buf, self._view
+        msgTypes, nmea = self.msgTypes, self.nmea
+        end = len(buf) if end is None else end
+        stats = self.stats = {
+            'bytes': 0, 'ubx': 0, 'nmea': 0, 'checksumErrors': 0,
+            'corruptedBytes': 0, 'truncatedBytes': 0,
+        }
+        good = 0        # number of bytes in good messages
+        scanned = start
+        try:
+            for kind, i, j in scan(buf, start, end, self._checksum, final):
+                scanned = j
+                if kind == UBX:
+                    stats['ubx'] += 1
+                    good += j - i
+                    msgType = (buf[i+2], buf[i+3])
+                    if msgTypes is None or msgType in msgTypes:
+                        yield i, msgType[0], msgType[1], view[i+6:j-2]
+                elif kind == NMEA:
+                    stats['nmea'] += 1
+                    good += j - i
+                    if nmea:
+                        yield i, None, None, buf[i+1:j-3].decode('ascii')
+                elif kind == UBX_ERROR or kind == NMEA_ERROR:
+                    stats['checksumErrors'] += 1
+                elif kind == INCOMPLETE:
+                    stats['truncatedBytes'] = j - i
+        finally:
+            stats['bytes'] = scanned - start
+            stats['corruptedBytes'] = \
+                stats['bytes'] - good - stats['truncatedBytes']
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        sys.stderr.write("Usage:\n  UBXLogReader.py FILENAME\n\n" + __doc__)
+        sys.exit(1)
+
+    import UBX     # registers the message classes
+    from UBXMessage import parseUBXPayload
+    with UBXLogReader(sys.argv[1]) as reader:
+        for offset, msgClass, msgId, payload in reader:
+            if msgClass is None:
+                print("{:08X} NMEA: {}".format(offset, payload))
+                continue
+            try:
+                print("{:08X} {}".format(
+                    offset, parseUBXPayload(msgClass, msgId, bytes(payload))
+                ))
+            except Exception as e:
+                print("{:08X} UBX {:02X}:{:02X} {}"
+                      .format(offset, msgClass, msgId, e))
+        sys.stderr.write("{}\n".format(reader.stats))
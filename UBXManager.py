@@ -2,11 +2,534 @@
 """TODO."""
 
 import threading
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+from heapq import heappush, heappop
+from time import monotonic
 from enum import Enum
 import sys
 
 
-class UBXManager(threading.Thread):
+# latency stages of UBXDispatcher.latency(): (start, end) timestamp
+LATENCY_STAGES = {
+    'frame': ('sync', 'framed'),        # until the last byte was read
+    'parse': ('framed', 'parsed'),
+    'handle': ('parsed', 'handled'),    # subscriptions and onUBX
+    'total': ('sync', 'handled'),
+}
+
+
+class NMEASentence(str):
+    """An NMEA sentence passed to onNMEA.
+
+    arrival is the (time.monotonic(), time.time()) at which its '$'
+    arrived, see UBXDispatcher.
+    """
+
+
+class Subscription:
+    """A callback for some UBX messages, see UBXDispatcher.subscribe()."""
+
+    def __init__(self, msgType, callback, raw=False):
+        """Instantiate with a message type or predicate, and a callback."""
+        from UBXMessage import messageType
+        if callable(msgType) and not hasattr(msgType, '_id'):
+            self.msgType, self.predicate = None, msgType
+        else:
+            self.msgType, self.predicate = messageType(msgType), None
+        self.callback = callback
+        self.raw = raw
+
+
+class UBXDispatcher:
+    """Parsing and dispatching of the messages split off by a UBXFramer.
+
+    This holds the message handlers and subscriptions shared by UBXManager
+    and AsyncUBXManager. The framer feeding the handlers is self.framer,
+    which the subclass creates with _newFramer().
+
+    Parsed objects get an attribute arrival, the (time.monotonic(),
+    time.time()) at which the first byte of their frame arrived, and the
+    sentences passed to onNMEA are NMEASentence strings with the same
+    attribute. While a message is dispatched, e.g. to a raw subscription,
+    self.framer.arrival is its arrival time.
+    """
+
+    def __init__(self, lazy=False, dispatchAll=True, trace=False):
+        """Instantiate, see UBXManager for lazy, dispatchAll and trace."""
+        self.lazy = lazy
+        self.dispatchAll = dispatchAll
+        self.trace = trace
+        self._subscriptionLock = threading.Lock()
+        self._subscriptions = []
+        # ({(class ID, message ID): [Subscription]}, [predicate Subscription])
+        self._dispatch = ({}, [])
+        self._latency = {}          # (class ID, message ID): {stage: [count]}
+        self._parseErrors = {}      # (class ID, message ID): count
+        self._statsStart = monotonic()
+
+    def _newFramer(self):
+        """Return a UBXFramer feeding the handlers."""
+        from UBXFramer import UBXFramer, hostTime
+        return UBXFramer(
+            self._onUBXTraced if self.trace else self._onUBX,
+            self._onUBXError, self._onNMEA, self._onNMEAError, self._accept,
+            hostTime
+        )
+
+    def _framers(self):
+        """Return the framers counted by stats()."""
+        return [self.framer]
+
+    def _onNMEA(self, buffer):
+        sentence = NMEASentence(buffer)
+        sentence.arrival = self._arrival()
+        self.onNMEA(sentence)
+
+    def onNMEA(self, buffer):
+        """Default handler for good NMEA message."""
+        print("NMEA: {}".format(buffer))
+
+    def _onNMEAError(self, errMsg):
+        self.onNMEAError(errMsg)
+
+    def onNMEAError(self, errMsg):
+        """Default handler for faulty NMEA message."""
+        print("NMEA ERR: {}".format(errMsg))
+
+    def subscribe(self, msgType, callback, raw=False):
+        """Call callback for each UBX message of msgType.
+
+        msgType is a (class ID, message ID) tuple, a message class such as
+        UBX.NAV.PVT, or a predicate(msgClass, msgId, length). Subscriptions
+        are checked as soon as the header of a frame is complete, and with
+        dispatchAll=False frames that no subscription wants are neither
+        buffered nor parsed, so predicates should be cheap.
+        callback(obj) gets the parsed object. With raw=True the payload is
+        not parsed for this subscription and callback(msgClass, msgId,
+        payload) gets the payload bytes instead.
+        Returns the Subscription, to be passed to unsubscribe().
+        """
+        subscription = Subscription(msgType, callback, raw)
+        with self._subscriptionLock:
+            self._setSubscriptions(self._subscriptions + [subscription])
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscription returned by subscribe()."""
+        with self._subscriptionLock:
+            self._setSubscriptions(
+                [s for s in self._subscriptions if s is not subscription]
+            )
+
+    def _setSubscriptions(self, subscriptions):
+        # build new tables and swap them in, so _matching needs no lock
+        byType, predicates = {}, []
+        for s in subscriptions:
+            if s.predicate is None:
+                byType.setdefault(s.msgType, []).append(s)
+            else:
+                predicates.append(s)
+        self._subscriptions = subscriptions
+        self._dispatch = (byType, predicates)
+
+    def _matching(self, msgClass, msgId, length):
+        """Return the subscriptions for a frame, by type first."""
+        byType, predicates = self._dispatch
+        subscriptions = byType.get((msgClass, msgId), [])
+        if predicates:
+            subscriptions = subscriptions + [
+                s for s in predicates if s.predicate(msgClass, msgId, length)
+            ]
+        return subscriptions
+
+    def _accept(self, msgClass, msgId, length):
+        return self.dispatchAll or bool(
+            self._matching(msgClass, msgId, length)
+        )
+
+    def _arrival(self):
+        """Return the arrival time of the message being dispatched."""
+        return self.framer.arrival
+
+    def _parse(self, msgClass, msgId, buffer):
+        from UBXMessage import parseUBXPayload
+        obj = parseUBXPayload(msgClass, msgId, buffer, self.lazy)
+        obj.arrival = self._arrival()
+        return obj
+
+    def _onUBX(self, msgClass, msgId, buffer, trace=None):
+        """Parse and dispatch a UBX frame.
+
+        trace is the dict of timestamps of trace=True, see _onUBXTraced.
+        """
+        from UBXMessage import formatByteString
+        subscriptions = self._matching(msgClass, msgId, len(buffer))
+        obj = None
+        if self.dispatchAll or not all(s.raw for s in subscriptions):
+            try:
+                obj = self._parse(msgClass, msgId, buffer)
+            except Exception as e:
+                key = (msgClass, msgId)
+                self._parseErrors[key] = self._parseErrors.get(key, 0) + 1
+                errMsg = "No parse, \"{}\", payload={}".format(
+                         e, formatByteString(buffer))
+                self.onUBXError(msgClass, msgId, errMsg)
+            else:
+                if trace is not None:
+                    trace['parsed'] = monotonic()
+                    obj.trace = trace
+        for s in subscriptions:
+            if s.raw:
+                s.callback(msgClass, msgId, buffer)
+            elif obj is not None:
+                s.callback(obj)
+        if self.dispatchAll and obj is not None:
+            self.onUBX(obj)
+
+    def _onUBXTraced(self, msgClass, msgId, buffer):
+        """_onUBX with the timestamps of trace=True."""
+        trace = {'sync': self.framer.arrival[0],
+                 'framed': self.framer.completed[0]}
+        UBXDispatcher._onUBX(self, msgClass, msgId, buffer, trace)
+        trace['handled'] = monotonic()
+        self._recordLatency((msgClass, msgId), trace)
+
+    def _recordLatency(self, msgType, trace):
+        histograms = self._latency.get(msgType)
+        if histograms is None:
+            histograms = self._latency[msgType] = {
+                stage: [0] * 40 for stage in LATENCY_STAGES
+            }
+        for stage, (begin, end) in LATENCY_STAGES.items():
+            if begin in trace and end in trace:
+                # bucket n holds latencies below 2**n microseconds
+                us = int((trace[end] - trace[begin]) * 1e6)
+                histograms[stage][min(us.bit_length(), 39)] += 1
+
+    def latency(self, reset=False):
+        """Return the latency histograms of trace=True.
+
+        The result is {(class ID, message ID): {stage: {seconds: count}}},
+        where count messages took less than seconds, but at least half of
+        it, in the stage. The stages are those of LATENCY_STAGES. With
+        reset=True the histograms start again from empty.
+        """
+        latency = {
+            msgType: {
+                stage: {2 ** n / 1e6: c for n, c in enumerate(counts) if c}
+                for stage, counts in histograms.items()
+            }
+            for msgType, histograms in list(self._latency.items())
+        }
+        if reset:
+            self._latency = {}
+        return latency
+
+    def onUBX(self, obj):
+        """Default handler for good UBX message."""
+        print(obj)
+
+    def _onUBXError(self, msgClass, msgId, errMsg):
+        self.onUBXError(msgClass, msgId, errMsg)
+
+    def onUBXError(self, msgClass, msgId, errMsg):
+        """Default handler for faulty or not yet defined UBX message."""
+        print("UBX ERR {:02X}:{:02X} {}"
+              .format(msgClass, msgId, errMsg))
+
+    def stats(self, reset=False):
+        """Return a snapshot of the message counts of the framers.
+
+        The snapshot is a dict with
+        - 'seconds': the time counted, since the start or the last reset,
+        - 'ubx': {(class ID, message ID): {'frames', 'bytes',
+          'checksumErrors', 'parseErrors'}}, for all frames whether they
+          are dispatched or not,
+        - 'nmea': {'frames', 'bytes', 'checksumErrors'} of all sentences,
+        - 'syncLosses' and 'skippedBytes', see UBXFramer.
+        Bytes include headers, checksums and CR/LF. The counters are
+        updated by the reader without a lock, so a snapshot taken from
+        another thread may miss the frame being counted. With reset=True
+        all counts start again from zero.
+        """
+        framers = self._framers()
+        now = monotonic()
+        counts = {}
+        for framer in framers:
+            for key, c in list(framer.counts.items()):
+                total = counts.setdefault(key, [0, 0, 0])
+                for n in range(3):
+                    total[n] += c[n]
+        parseErrors = dict(self._parseErrors)
+        nmea = [sum(f.nmeaCounts[n] for f in framers) for n in range(3)]
+        stats = {
+            'seconds': now - self._statsStart,
+            'ubx': {},
+            'nmea': dict(zip(['frames', 'bytes', 'checksumErrors'], nmea)),
+            'syncLosses': sum(f.syncLosses for f in framers),
+            'skippedBytes': sum(f.skippedBytes for f in framers),
+        }
+        for key, (frames, size, checksumErrors) in counts.items():
+            msgType = divmod(key, 256)
+            stats['ubx'][msgType] = {
+                'frames': frames, 'bytes': size,
+                'checksumErrors': checksumErrors,
+                'parseErrors': parseErrors.pop(msgType, 0),
+            }
+        if reset:
+            for framer in framers:
+                framer.resetCounts()
+            self._parseErrors = {}
+            self._statsStart = now
+        return stats
+
+
+def _setResult(future, result=None, exception=None):
+    """Complete future unless it is already done, e.g. cancelled."""
+    try:
+        if exception is None:
+            future.set_result(result)
+        else:
+            future.set_exception(exception)
+    except InvalidStateError:
+        pass
+
+
+def _copyResult(source, target):
+    """Complete future target like the done future source."""
+    try:
+        result = source.result()
+    except Exception as e:
+        _setResult(target, exception=e)
+    else:
+        _setResult(target, result)
+
+
+class _Request:
+    """A message sent by a Correlator, waiting for its response."""
+
+    def __init__(self, msg, response, ack, timeout, retries):
+        self.msg = msg
+        self.future = Future()
+        self.response = response    # (class, id) still to come, or None
+        self.ack = ack              # (clsID, msgID) still to come, or None
+        self.timeout = timeout
+        self.retries = retries
+        self.result = None
+
+
+class Correlator:
+    """Matches the responses of the receiver to the requests in flight.
+
+    Any number of polls and CFG messages can be in flight at once. A poll
+    is answered by the next message of the polled type, a CFG message by
+    the next ACK-ACK or ACK-NAK with its clsID and msgID, and a poll of a
+    CFG message by both. The receiver answers in order, so requests
+    waiting for the same type are matched first in, first out.
+
+    dispatcher is the UBXDispatcher that reads the answers, send the
+    function that writes a message. The correlator only subscribes to the
+    types it is waiting for.
+    """
+
+    def __init__(self, dispatcher, send):
+        """Instantiate with a dispatcher and a send function."""
+        self.dispatcher = dispatcher
+        self.send = send
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._responses = {}        # (class, id): deque of _Request
+        self._acks = {}             # (clsID, msgID): deque of _Request
+        self._subscriptions = {}    # (class, id): Subscription
+        self._deadlines = []        # heap of (time, n, _Request)
+        self._n = 0
+        self._timer = None
+
+    def request(self, msg, timeout=None, retries=0):
+        """Send msg and return a Future of the response.
+
+        msg is an object with serialize() or bytes. The result of the
+        future is the polled message for polls, the ACK-ACK for CFG
+        messages, see UBXMessage.expectedResponse, and None for messages
+        without response. An ACK-NAK sets an Exception. If there is no
+        answer within timeout seconds, msg is sent again up to retries
+        times, then a TimeoutError is set.
+        """
+        return self.requestAll([msg], timeout, retries)[0]
+
+    def requestAll(self, msgs, timeout=None, retries=0):
+        """Send all msgs with one write and return a list of Futures.
+
+        The futures are those of request(). Only retries are sent one by
+        one.
+        """
+        from UBXMessage import expectedResponse
+        msgs = [m.serialize() if hasattr(m, 'serialize') else m for m in msgs]
+        futures = []
+        with self._lock:
+            for msg in msgs:
+                msgClass, msgId = msg[2], msg[3]
+                response = expectedResponse(msgClass, msgId, len(msg) - 8)
+                if response is None:
+                    future = Future()
+                    future.set_result(None)
+                    futures.append(future)
+                    continue
+                if response[1] is not None:
+                    ack = (msgClass, msgId) if msgClass == 0x06 else None
+                    req = _Request(msg, response, ack, timeout, retries)
+                else:
+                    req = _Request(msg, None, (msgClass, msgId), timeout,
+                                   retries)
+                if req.response is not None:
+                    self._wait(self._responses, req.response, req,
+                               [req.response], self._onResponse)
+                if req.ack is not None:
+                    self._wait(self._acks, req.ack, req,
+                               [(0x05, 0x01), (0x05, 0x00)], self._onAck)
+                if timeout is not None:
+                    self._schedule(req)
+                futures.append(req.future)
+        self.send(b''.join(msgs))
+        return futures
+
+    def modify(self, poll, change, timeout=None, retries=0):
+        """Poll a CFG message, change it and send it back.
+
+        change(obj) modifies the polled object in place. Returns a Future
+        of the ACK-ACK of the changed message, see request().
+        """
+        future = Future()
+
+        def onPolled(polled):
+            try:
+                obj = polled.result()
+                change(obj)
+                acked = self.request(obj, timeout, retries)
+            except Exception as e:
+                _setResult(future, exception=e)
+                return
+            acked.add_done_callback(lambda f: _copyResult(f, future))
+        self.request(poll, timeout, retries).add_done_callback(onPolled)
+        return future
+
+    def _wait(self, table, key, req, msgTypes, callback):
+        # with _lock: queue req, subscribe while something is waiting
+        if key not in table:
+            table[key] = deque()
+            for msgType in msgTypes:
+                if msgType not in self._subscriptions:
+                    self._subscriptions[msgType] = \
+                        self.dispatcher.subscribe(msgType, callback)
+        table[key].append(req)
+
+    def _pop(self, table, key):
+        # with _lock: return the first request waiting for key, or None
+        queue = table.get(key)
+        req = None
+        while queue and req is None:
+            req = queue.popleft()
+            if req.future.done():   # cancelled
+                req = None
+        if queue is not None and not queue:
+            self._drop(table, key)
+        return req
+
+    def _remove(self, req):
+        # with _lock: stop waiting for the answers to req
+        for table, key in [(self._responses, req.response),
+                           (self._acks, req.ack)]:
+            if key in table and req in table[key]:
+                table[key].remove(req)
+                if not table[key]:
+                    self._drop(table, key)
+
+    def _drop(self, table, key):
+        del table[key]
+        if table is self._responses:
+            msgTypes = [key]
+        elif not table:
+            msgTypes = [(0x05, 0x01), (0x05, 0x00)]
+        else:
+            return
+        for msgType in msgTypes:
+            if msgType in self._subscriptions:
+                self.dispatcher.unsubscribe(self._subscriptions.pop(msgType))
+
+    def _onResponse(self, obj):
+        with self._lock:
+            req = self._pop(self._responses, (obj._class, obj._id))
+            if req is None:
+                return
+            req.response, req.result = None, obj
+            done = req.ack is None
+        if done:
+            _setResult(req.future, req.result)
+
+    def _onAck(self, obj):
+        with self._lock:
+            req = self._pop(self._acks, (obj.clsID, obj.msgID))
+            if req is None:
+                return
+            req.ack = None
+            if obj._id == 0x00:
+                self._remove(req)
+            elif req.result is None:
+                req.result = obj
+            done = req.response is None
+        if obj._id == 0x00:
+            _setResult(req.future, exception=Exception(
+                "NAK for message {:02X}:{:02X}".format(obj.clsID, obj.msgID)
+            ))
+        elif done:
+            _setResult(req.future, req.result)
+
+    def _schedule(self, req):
+        # with _lock: (re)arm the timeout of req
+        self._n += 1
+        heappush(self._deadlines, (monotonic() + req.timeout, self._n, req))
+        if self._timer is None:
+            self._timer = threading.Thread(target=self._runTimer, daemon=True)
+            self._timer.start()
+        else:
+            self._wakeup.notify()
+
+    def _runTimer(self):
+        """Resend or fail the requests whose timeout has passed."""
+        while True:
+            resend, expired = [], []
+            with self._lock:
+                now = monotonic()
+                while self._deadlines and (
+                        self._deadlines[0][0] <= now or
+                        self._deadlines[0][2].future.done()):
+                    req = heappop(self._deadlines)[2]
+                    if req.future.done():
+                        continue
+                    if req.retries > 0:
+                        req.retries -= 1
+                        self._schedule(req)
+                        resend.append(req)
+                    else:
+                        self._remove(req)
+                        expired.append(req)
+                if not resend and not expired:
+                    if not self._deadlines:
+                        self._timer = None
+                        return
+                    self._wakeup.wait(self._deadlines[0][0] - now)
+                    continue
+            for req in resend:
+                self.send(req.msg)
+            for req in expired:
+                _setResult(req.future, exception=TimeoutError(
+                    "No response to message {:02X}:{:02X}"
+                    .format(req.msg[2], req.msg[3])
+                ))
+
+
+class UBXManager(UBXDispatcher, threading.Thread):
     """The NMEA/UBX reader/writer thread."""
 
     class STATE(Enum):
@@ -23,17 +546,102 @@ class UBXManager(threading.Thread):
         UBX_CHKSUM_1 = 10
         UBX_CHKSUM_2 = 11
 
-    def __init__(self, ser, debug=False):
-        """Instantiate with serial."""
+    def __init__(self, ser, debug=False, chunked=True, chunkSize=4096,
+                 lazy=False, dispatchAll=True, statsInterval=None,
+                 trace=False, capture=None):
+        """Instantiate with serial.
+
+        With chunked=True (the default) whatever is waiting in ser is read
+        at once, up to chunkSize bytes, and split into messages by a
+        UBXFramer. With chunked=False ser is read byte by byte and parsed
+        with the STATE machine, which only needs ser.read(1).
+        With lazy=True the UBX objects passed to onUBX decode their fields
+        only when they are accessed.
+        With dispatchAll=False onUBX isn't called, and only the UBX
+        messages with a subscription are parsed, see subscribe().
+        The messages are always counted in chunked mode, see stats(). With
+        statsInterval (seconds) onStats is called that often.
+        In chunked mode the objects carry their arrival time, see
+        UBXDispatcher.
+        All bytes read are written to capture, a UBXCapture.UBXCapture,
+        which is closed when the manager stops. With debug=True and no
+        capture they are written to UBX.log.
+        With trace=True (chunked mode only) every parsed object gets a dict
+        trace of monotonic timestamps: 'sync' when its first byte arrived,
+        see arrival, 'framed' when the read with its last byte returned,
+        'parsed' after parsing and 'handled' after the subscriptions and
+        onUBX have returned, which is added after these are called. The
+        latencies are collected in histograms, see latency().
+        """
         from UBXMessage import UBXMessage
         threading.Thread.__init__(self)
+        UBXDispatcher.__init__(self, lazy, dispatchAll, trace)
+        self.framer = self._newFramer()
         self.ser = ser
         self.debug = debug
+        self.capture = capture
+        self.chunked = chunked
+        self.chunkSize = chunkSize
+        self.statsInterval = statsInterval
         self._shutDown = False
         self.ubx_chksum = UBXMessage.Checksum()
+        self.correlator = Correlator(self, self.send)
 
     def run(self):
         """Run the parser."""
+        capture = self.capture
+        if capture is None and self.debug:
+            from UBXCapture import UBXCapture
+            capture = UBXCapture("UBX.log")
+            sys.stderr.write("Writing log to UBX.log\n")
+        try:
+            if self.chunked:
+                self._runChunked(capture)
+            else:
+                self._runBytewise(capture)
+        finally:
+            if capture is not None:
+                capture.close()
+
+    def _read(self):
+        """Read at least one byte plus whatever else is already waiting."""
+        n = getattr(self.ser, 'in_waiting', 0)
+        return self.ser.read(min(max(n, 1), self.chunkSize))
+
+    def _runChunked(self, capture):
+        self.framer.reset()
+        if self.statsInterval is not None:
+            nextStats = monotonic() + self.statsInterval
+        while not self._shutDown:
+            data = self._read()
+            baudrate = getattr(self.ser, 'baudrate', None)
+            self.framer.byteTime = 10.0 / baudrate if baudrate else None
+            try:
+                self.framer.feed(data)
+            finally:       # also the bytes a handler raised on
+                if capture is not None:
+                    capture.write(data, self.framer.completed)
+            if self.statsInterval is not None and monotonic() >= nextStats:
+                nextStats = monotonic() + self.statsInterval
+                self.onStats(self.stats())
+
+    def onStats(self, stats):
+        """Default handler for the periodic stats() snapshot.
+
+        It is called by the reader thread after a read, so with a read
+        timeout on ser also when nothing arrives.
+        """
+        lines = ["{:02X}:{:02X} {frames} frames {bytes} bytes "
+                 "{checksumErrors} checksum {parseErrors} parse errors"
+                 .format(*msgType, **n)
+                 for msgType, n in sorted(stats['ubx'].items())]
+        lines.append("NMEA {frames} sentences {bytes} bytes "
+                     "{checksumErrors} checksum errors".format(**stats['nmea']))
+        lines.append("{syncLosses} sync losses {skippedBytes} bytes skipped "
+                     "in {seconds:.1f} s".format(**stats))
+        print("STATS: " + "\n       ".join(lines))
+
+    def _runBytewise(self, capture):
         transitionFrom = [
             self._fromSTART,
             self._fromNMEA_BODY,
@@ -48,19 +656,15 @@ class UBXManager(threading.Thread):
             self._fromUBX_CHKSUM_1,
             self._fromUBX_CHKSUM_2,
         ]
-        if self.debug:
-            logfile = open("UBX.log", "wb")
-            sys.stderr.write("Writing log to UBX.log\n")
         self._reset()
         while not self._shutDown:
             byte = self.ser.read(1)
-            if self.debug:
-                logfile.write(byte)
-                logfile.flush()
+            if capture is not None:
+                capture.write(byte)
             self.state = transitionFrom[self.state.value](byte)
 
     def _reset(self):
-        self.buffer = b''
+        self.buffer = bytearray()
         self.chksum = 0
         self.chksum_calc = 0
         self.ubx_class = 0
@@ -131,11 +735,16 @@ class UBXManager(threading.Thread):
     def _fromUBX_LENGTH_2(self, byte):
         self.ubx_length = self.ubx_length + 256 * ord(byte)
         self.ubx_chksum.update(byte)
+        if self._accept(self.ubx_class, self.ubx_id, self.ubx_length):
+            self.buffer = bytearray(self.ubx_length)   # filled from the front
+        else:
+            self.buffer = None      # only checked, not buffered
         return UBXManager.STATE.UBX_PAYLOAD
 
     def _fromUBX_PAYLOAD(self, byte):
         if self.ubx_length > 0:
-            self.buffer += byte
+            if self.buffer is not None:
+                self.buffer[-self.ubx_length] = ord(byte)
             self.ubx_length -= 1
             self.ubx_chksum.update(byte)
             return UBXManager.STATE.UBX_PAYLOAD
@@ -149,7 +758,8 @@ class UBXManager(threading.Thread):
 
     def _fromUBX_CHKSUM_2(self, byte):
         if self.chksum == self.ubx_chksum.get():
-            self._onUBX(self.ubx_class, self.ubx_id, self.buffer)
+            if self.buffer is not None:
+                self._onUBX(self.ubx_class, self.ubx_id, bytes(self.buffer))
         else:
             self._onUBXError(
                 self.ubx_class,
@@ -165,43 +775,6 @@ class UBXManager(threading.Thread):
         else:
             return UBXManager.STATE.START
 
-    def _onNMEA(self, buffer):
-        self.onNMEA(buffer)
-
-    def onNMEA(self, buffer):
-        """Default handler for good NMEA message."""
-        print("NMEA: {}".format(buffer))
-
-    def _onNMEAError(self, errMsg):
-        self.onNMEAError(errMsg)
-
-    def onNMEAError(self, errMsg):
-        """Default handler for faulty NMEA message."""
-        print("NMEA ERR: {}".format(errMsg))
-
-    def _onUBX(self, msgClass, msgId, buffer):
-        from UBXMessage import parseUBXPayload, formatByteString
-        try:
-            obj = parseUBXPayload(msgClass, msgId, buffer)
-        except Exception as e:
-            errMsg = "No parse, \"{}\", payload={}".format(
-                     e, formatByteString(buffer))
-            self.onUBXError(msgClass, msgId, errMsg)
-        else:
-            self.onUBX(obj)
-
-    def onUBX(self, obj):
-        """Default handler for good UBX message."""
-        print(obj)
-
-    def _onUBXError(self, msgClass, msgId, errMsg):
-        """Handle an UBX error."""
-
-    def onUBXError(self, msgClass, msgId, errMsg):
-        """Default handler for faulty or not yet defined UBX message."""
-        print("UBX ERR {:02X}:{:02X} {}"
-              .format(msgClass, msgId, errMsg))
-
     def send(self, msg):
         """Send message to ser."""
         from UBXMessage import formatByteString
@@ -209,6 +782,21 @@ class UBXManager(threading.Thread):
             print("SEND: {}".format(formatByteString(msg)))
         self.ser.write(msg)
 
+    def request(self, msg, timeout=None, retries=0):
+        """Send msg and return a concurrent.futures.Future of the response.
+
+        Requests don't wait for each other, see Correlator.request().
+        """
+        return self.correlator.request(msg, timeout, retries)
+
+    def requestAll(self, msgs, timeout=None, retries=0):
+        """Send msgs with one write, see Correlator.requestAll()."""
+        return self.correlator.requestAll(msgs, timeout, retries)
+
+    def modify(self, poll, change, timeout=None, retries=0):
+        """Poll a CFG message, change it and set it, see Correlator.modify()."""
+        return self.correlator.modify(poll, change, timeout, retries)
+
     def shutdown(self):
         """Stop the manger."""
         self._shutDown = True
@@ -2,10 +2,10 @@
 """TODO."""
 
 import struct
-import inspect
+from struct import Struct
 from enum import Enum
-import sys
-from itertools import accumulate
+from functools import lru_cache
+from itertools import accumulate, chain
 
 
 class MessageClass(Enum):
@@ -14,7 +14,10 @@ class MessageClass(Enum):
     NAV = b'\x01'  # Navigation Results Messages: Position, Speed, Time, Acceleration, Heading, DOP, SVs used
     RXM = b'\x02'  # Receiver Manager Messages: Satellite Status, RTC Status
     INF = b'\x04'  # Information Messages: Printf-Style Messages, with IDs such as Error, Warning, Notice
+    ACK = b'\x05'  # Ack/Nak Messages: Acknowledge or Reject messages to UBX-CFG input messages
+    CFG = b'\x06'  # Configuration Input Messages: Set Dynamic Model, Set DOP Mask, Set Baud Rate, etc.
     UPD = b'\x09'  # Firmware Update Messages: Memory/Flash erase/write, Reboot, Flash identification, etc.
+    MON = b'\x0A'  # Monitoring Messages: Communication Status, CPU Load, Stack Usage, Task Status
     AID = b'\x0B'  # AssistNow Aiding Messages: Ephemeris, Almanac, other A-GPS data input
     TIM = b'\x0D'  # Timing Messages: Time Pulse Output, Time Mark Results
     ESF = b'\x10'  # External Sensor Fusion Messages: External Sensor Measurements and Status Information
@@ -24,6 +27,23 @@ class MessageClass(Enum):
     HNR = b'\x28'  # High Rate Navigation Results Messages: High rate time, position, speed, heading
 
 
+# UBX message class ID -> python class, e.g. 0x05 -> UBX.ACK
+_classRegistry = {}
+# (message class ID, message ID) -> python subclass, e.g. (0x05, 0x01) -> UBX.ACK.ACK
+_messageRegistry = {}
+# _messageRegistry as a flat table indexed by 256 * message class ID + message ID
+_messageTable = [None] * 65536
+# index as in _messageTable -> all subclasses, for IDs with several Fields
+# definitions, e.g. CFG-TP5 and CFG-TP5_GET
+_variantTable = {}
+# largest plausible payload length, indexed like _messageTable, -1 for
+# message classes that don't exist
+_maxLengthTable = [-1] * 65536
+for _c in MessageClass:
+    _maxLengthTable[256 * _c.value[0]:256 * _c.value[0] + 256] = [0xffff] * 256
+del _c
+
+
 def _byte(i):
     """Helper function: convert int 0..255 to bytestring byte."""
     return bytes([i])
@@ -51,7 +71,7 @@ class UBXMessage(object):
         msg += struct.pack('cc', _byte(msgClass), _byte(msgId))
         msg += struct.pack('<h', len(payload))
         msg += payload
-        msg += struct.pack('>H', UBXMessage.Checksum(msg[2:]).get())
+        msg += struct.pack('>H', UBXMessage.Checksum.compute(msg, 2))
         return msg
 
     @staticmethod
@@ -66,7 +86,7 @@ class UBXMessage(object):
         msgClass, msgId = struct.unpack('cc', msg[2:4])
         lenPayload = struct.unpack('<h', msg[4:6])[0]
         payload = msg[6:(6+lenPayload)]
-        trueCksum = UBXMessage.Checksum(msg[2:(len(msg)-2)]).get()
+        trueCksum = UBXMessage.Checksum.compute(msg, 2, len(msg)-2)
         msgCksum = struct.unpack('>H', msg[6+lenPayload:])[0]
         if trueCksum != msgCksum:
             raise Exception(
@@ -90,8 +110,7 @@ class UBXMessage(object):
             """
             self.reset()
             if msg is not None:
-                for i in msg:
-                    self.update(bytes([i]))
+                self.update_bytes(msg)
 
         def reset(self):
             """Reset the checksums to zero."""
@@ -105,10 +124,31 @@ class UBXMessage(object):
             self.b += self.a
             self.b &= 0xff
 
+        def update_bytes(self, chunk):
+            """Update checksums with all bytes in chunk.
+
+            chunk can be any bytes-like object, such as a memoryview.
+            ck_b is the sum of the running sums ck_a, which accumulate
+            computes without a Python-level loop.
+            """
+            a = self.a
+            self.b = (self.b + sum(accumulate(chunk, initial=a)) - a) & 0xff
+            self.a = (a + sum(chunk)) & 0xff
+
         def get(self):
             """Return the checksum (a 16-bit integer, ck_a is the MSB)."""
             return self.a * 256 + self.b
 
+        @staticmethod
+        def compute(buffer, start=0, end=None):
+            """Return the checksum of buffer[start:end] without copying it."""
+            with memoryview(buffer) as view:
+                chunk = view[start:end]
+                a = sum(chunk)
+                b = sum(accumulate(chunk))
+                chunk.release()
+            return (a & 0xff) * 256 + (b & 0xff)
+
 
 def _mkFieldInfo(Fields):
     # The following is a list of (name, formatChar) tuples, such as
@@ -128,37 +168,208 @@ def _mkFieldInfo(Fields):
         }
 
 
-def _mkNamesAndTypes(fieldInfo, msgLength):
-    """Make list of variable names and list of variable types.
-
-    Input is the fieldInfo as returned by _mkFieldInfo.
-    The number of repeated objects is deduced from the message length and
-    the types of variables in the 'once' and 'repeat' block of the input."""
-    varTypes, varNames = fieldInfo['once']
-    repeat = fieldInfo['repeat']
-    if repeat:
-        varTypesRepeat, varNamesRepeat = repeat['once']     # nest level 1 only
-        sizeOnce = sum([t._size for t in varTypes])
-        sizeRepeat = sum([t._size for t in varTypesRepeat])
-        N = (msgLength - sizeOnce) // sizeRepeat
-        sizeTotal = sizeOnce + N * sizeRepeat
-        if sizeTotal != msgLength:
-            errmsg = "message length {} does not match {}"\
-                     .format(msgLength, sizeTotal)
+class _Layout:
+    """Compiled layout of the Fields of a message.
+
+    The once block and the repeated block are each compiled into one
+    little-endian struct.Struct when the message class is initialized, so a
+    payload is decoded with one unpack_from and one iter_unpack call. The
+    unrolled variable names and types are cached per payload length in a
+    small LRU cache.
+    """
+
+    CACHE_SIZE = 16     # number of payload lengths cached per message
+    MAX_REPEAT = 255    # repeated blocks are counted in a U1
+
+    def __init__(self, Fields, clsName):
+        """Compile the layout of Fields, clsName is used in error messages."""
+        self.clsName = clsName
+        fieldInfo = _mkFieldInfo(Fields)
+        self.onceTypes, self.onceNames = fieldInfo['once']
+        self.once = Struct('<' + ''.join(t.fmt for t in self.onceTypes))
+        self.onceDecoders = self._mkDecoders(self.onceTypes)
+        self.onceOffsets = self._mkOffsets(self.onceTypes)
+        repeat = fieldInfo['repeat']    # nest level 1 only
+        if repeat:
+            self.repeatTypes, self.repeatNames = repeat['once']
+            self.repeat = Struct(
+                '<' + ''.join(t.fmt for t in self.repeatTypes)
+            )
+            self.repeatDecoders = self._mkDecoders(self.repeatTypes)
+        else:
+            self.repeatTypes, self.repeatNames = [], []
+            self.repeat = None
+            self.repeatDecoders = []
+        # repeated variable name -> (type, offset within the block)
+        self.repeatFields = dict(zip(
+            self.repeatNames,
+            zip(self.repeatTypes, self._mkOffsets(self.repeatTypes))
+        ))
+        if self.repeat is None:
+            self.maxLength = self.once.size
+        else:
+            self.maxLength = min(
+                0xffff, self.once.size + self.MAX_REPEAT * self.repeat.size
+            )
+        self._onceDtype = self._repeatDtype = None
+        self.namesAndTypes = lru_cache(maxsize=self.CACHE_SIZE)(
+            self._mkNamesAndTypes
+        )
+
+    @staticmethod
+    def _mkDecoders(types):
+        """Return (index, decode) for the types that post-process raw bytes."""
+        return [(i, t.decode) for i, t in enumerate(types)
+                if hasattr(t, 'decode')]
+
+    @staticmethod
+    def _mkOffsets(types):
+        offsets, offset = [], 0
+        for t in types:
+            offsets.append(offset)
+            offset += t._size
+        return offsets
+
+    @staticmethod
+    def _decode(values, decoders):
+        values = list(values)
+        for i, decode in decoders:
+            values[i] = decode(values[i])
+        return values
+
+    def fits(self, msgLength):
+        """Return whether a payload of msgLength bytes has this layout."""
+        extra = msgLength - self.once.size
+        if self.repeat is None:
+            return extra == 0
+        return 0 <= extra and msgLength <= self.maxLength and \
+            extra % self.repeat.size == 0
+
+    def _mkNamesAndTypes(self, msgLength):
+        """Make list of variable names and list of variable types.
+
+        The number of repeated blocks is deduced from the message length.
+        Repeated variables are unrolled by appending _1, _2, ... to the names.
+        """
+        sizeOnce = self.once.size
+        if msgLength < sizeOnce:
+            raise Exception(
+                "Message length {} is shorter than required {}"
+                .format(msgLength, sizeOnce)
+            )
+        if self.repeat is None:
+            if msgLength != sizeOnce:
+                raise Exception(
+                    "Message not fully consumed while parsing a {}!"
+                    .format(self.clsName)
+                )
+            varNames, varTypes = self.onceNames, self.onceTypes
+        else:
+            N = (msgLength - sizeOnce) // self.repeat.size
+            sizeTotal = sizeOnce + N * self.repeat.size
+            if sizeTotal != msgLength:
+                errmsg = "message length {} does not match {}"\
+                         .format(msgLength, sizeTotal)
+                raise Exception(errmsg)
+            varNames = self.onceNames + [
+                "{}_{}".format(name, i)
+                for i in range(1, N+1) for name in self.repeatNames
+            ]
+            varTypes = self.onceTypes + N * self.repeatTypes
+        if not varNames:
+            errmsg = 'No variables found in {}.'.format(self.clsName)
+            errmsg += ' Is the \'Fields\' class empty?'
             raise Exception(errmsg)
-        varTypes += N * varTypesRepeat
-        varNames += _flatten(list(
-            map(lambda i: list(map(lambda s: s+"_"+str(i),
-                                   varNamesRepeat)
-                              ),
-                range(1, N+1))
+        return varNames, varTypes
+
+    def unpack(self, msg):
+        """Return the list of variable names and the list of values in msg."""
+        varNames, varTypes = self.namesAndTypes(len(msg))
+        values = self.once.unpack_from(msg)
+        if self.onceDecoders:
+            values = self._decode(values, self.onceDecoders)
+        if self.repeat is not None:
+            blocks = self.repeat.iter_unpack(memoryview(msg)[self.once.size:])
+            if self.repeatDecoders:
+                blocks = (self._decode(b, self.repeatDecoders) for b in blocks)
+            values = list(chain(values, chain.from_iterable(blocks)))
+        return varNames, values
+
+    @staticmethod
+    def _mkDtype(names, types):
+        import numpy as np
+        return np.dtype([(name, t.dtype) for name, t in zip(names, types)])
+
+    def onceDtype(self):
+        """Return the NumPy structured dtype of the once block.
+
+        The dtype is little-endian and packed, so its itemsize equals the
+        size of the once block. NumPy is imported on first use only.
+        """
+        if self._onceDtype is None:
+            self._onceDtype = self._mkDtype(self.onceNames, self.onceTypes)
+        return self._onceDtype
+
+    def repeatDtype(self):
+        """Return the NumPy structured dtype of the repeated block."""
+        if self._repeatDtype is None:
+            self._repeatDtype = self._mkDtype(
+                self.repeatNames, self.repeatTypes
             )
+        return self._repeatDtype
+
+    def repeatArray(self, msg):
+        """Return the repeated blocks of msg as a NumPy structured array.
+
+        The array is a read-only view on msg created with np.frombuffer.
+        """
+        import numpy as np
+        if self.repeat is None:
+            raise Exception("{} has no repeated block".format(self.clsName))
+        N = (len(msg) - self.once.size) // self.repeat.size
+        return np.frombuffer(
+            msg, dtype=self.repeatDtype(), count=N, offset=self.once.size
+        )
+
+    def unpackRepeated(self, msg, varName):
+        """Decode the single unrolled repeated variable varName, e.g. prMeas_3.
+
+        Raises AttributeError if there is no such variable in msg.
+        """
+        name, _, i = varName.rpartition('_')
+        field = self.repeatFields.get(name)
+        if field is not None and i.isdigit():
+            i = int(i)
+            N = (len(msg) - self.once.size) // self.repeat.size
+            if 1 <= i <= N:
+                typ, offset = field
+                offset += self.once.size + (i - 1) * self.repeat.size
+                return typ.parse_from(msg, offset)[0]
+        raise AttributeError(
+            "'{}' object has no attribute '{}'".format(self.clsName, varName)
         )
-    return varNames, varTypes
 
 
-def _flatten(l):
-    return [item for sublist in l for item in sublist]
+class _LazyField:
+    """Descriptor that decodes a once-block field on first access.
+
+    It is only reached when the field is not in the instance __dict__, i.e.
+    for lazily parsed messages. The decoded value is stored in the instance
+    __dict__, which takes precedence over this non-data descriptor from then
+    on, so each field is decoded at most once.
+    """
+
+    def __init__(self, name, typ, offset):
+        self.name = name
+        self.typ = typ
+        self.offset = offset
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        val = self.typ.parse_from(obj._payload, self.offset)[0]
+        obj.__dict__[self.name] = val
+        return val
 
 
 def initMessageClass(cls):
@@ -166,10 +377,20 @@ def initMessageClass(cls):
 
     It does the following in cls:
     - add a dict with name _lookup that maps UBX message ID to python subclass.
+    - register cls and its subclasses for lookupMessage(). If several
+      subclasses have the same ID, the one with the longest Fields is
+      registered, and parseUBXPayload() picks one by the payload length.
     In each subclass it does this:
     - add an __init__ if it doesn't exist
     - add a __str__ if it doesn't exist
-    Function __init__ instantiates the object from a message.
+    - add a serialize if it doesn't exist
+    - add a to_dict if it doesn't exist
+    - add a repeatedArray if it doesn't exist
+    - add the compiled layout of Fields as _layout
+    - add _LazyField descriptors and a __getattr__ for lazy parsing
+    Function __init__ instantiates the object from a message. With
+    lazy=True the payload is only checked for its length and each field is
+    decoded on first access.
     Function __str__ creates a human readable string from the object.
     """
     cls_name = cls.__name__
@@ -177,43 +398,88 @@ def initMessageClass(cls):
 
     lookup = dict([(getattr(subcls, '_id'), subcls) for subcls in subClasses])
     setattr(cls, "_lookup", lookup)
-
+    _classRegistry[cls._class] = cls
+    if _maxLengthTable[256 * cls._class] < 0:
+        _maxLengthTable[256 * cls._class:256 * cls._class + 256] = \
+            [0xffff] * 256
+    maxLengths = {}     # of all subclasses with an ID, e.g. PRT and PRT_GET
     for sc in subClasses:
         if sc.__dict__.get('Fields') is None:       # 'Fields' must be present
             raise Exception(
                 "Class {}.{} has no Fields"
                 .format(cls.__name__, sc.__name__)
             )
+        layout = _Layout(sc.Fields, "UBX.{}.{}".format(cls_name, sc.__name__))
+        setattr(sc, '_layout', layout)
+        key = 256 * cls._class + sc._id
+        if sc._id not in maxLengths or layout.maxLength > maxLengths[sc._id]:
+            maxLengths[sc._id] = layout.maxLength
+            _messageRegistry[(cls._class, sc._id)] = sc
+            _messageTable[key] = sc
+            lookup[sc._id] = sc
+        _maxLengthTable[key] = maxLengths[sc._id]
+        variants = [c for c in subClasses if c._id == sc._id]
+        if len(variants) > 1:
+            _variantTable[key] = variants
         # add __init__ to subclass if necessary
         if sc.__dict__.get('__init__') is None:
-            def __init__(self, msg):
+            def __init__(self, msg, lazy=False):
                 """Instantiate object from message bytestring."""
-                fieldInfo = _mkFieldInfo(self.Fields)
-                varNames, varTypes = _mkNamesAndTypes(fieldInfo, len(msg))
-                if not varNames:
-                    errmsg = 'No variables found in UBX.{}.{}.'\
-                             .format(cls_name, sc.__name__)
-                    errmsg += ' Is the \'Fields\' class empty?'
-                    raise Exception(errmsg)
-                _len = len(msg)     # msg will be consumed in the loop
-                for (varName, varType) in zip(varNames, varTypes):
-                    val, msg = varType.parse(msg)
-                    setattr(self, varName, val)
-                if len(msg) != 0:
-                    clsName = "UBX.{}.{}".format(cls_name, sc.__name__)
-                    raise Exception(
-                        "Message not fully consumed while parsing a {}!"
-                        .format(clsName)
-                    )
-                self._len = _len
+                if lazy:
+                    self._layout.namesAndTypes(len(msg))    # check length
+                    msg = bytes(msg)
+                else:
+                    varNames, values = self._layout.unpack(msg)
+                    self.__dict__.update(zip(varNames, values))
+                self._lazy = lazy
+                self._len = len(msg)
                 self._payload = msg
             setattr(sc, "__init__", __init__)
+        # add descriptors for lazily decoded fields
+        for name, typ, offset in zip(
+                layout.onceNames, layout.onceTypes, layout.onceOffsets):
+            if sc.__dict__.get(name) is None:
+                setattr(sc, name, _LazyField(name, typ, offset))
+        if sc.__dict__.get('__getattr__') is None:
+            def __getattr__(self, name):
+                """Decode a repeated field of a lazy message on first access."""
+                if name.startswith('_'):
+                    raise AttributeError(name)
+                val = self._layout.unpackRepeated(self._payload, name)
+                self.__dict__[name] = val
+                return val
+            setattr(sc, "__getattr__", __getattr__)
+        # add to_dict to subclass if necessary
+        if sc.__dict__.get('to_dict') is None:
+            def to_dict(self):
+                """Return a dict of all (unrolled) variable names and values."""
+                d = self.__dict__
+                if self._lazy:
+                    # decode everything at once, keep values already set
+                    varNames, values = self._layout.unpack(self._payload)
+                    for name, val in zip(varNames, values):
+                        d.setdefault(name, val)
+                    self._lazy = False
+                varNames, _ = self._layout.namesAndTypes(self._len)
+                return {name: d[name] for name in varNames}
+            setattr(sc, "to_dict", to_dict)
+        # add repeatedArray to subclass if necessary
+        if sc.__dict__.get('repeatedArray') is None:
+            def repeatedArray(self):
+                """Return the repeated blocks as a NumPy structured array.
+
+                There is one column per field of the Repeated class, e.g.
+                rawx.repeatedArray()['prMeas']. The array is a read-only
+                view on the payload, so nothing is decoded per element.
+                Values set on the object are not reflected.
+                """
+                return self._layout.repeatArray(self._payload)
+            setattr(sc, "repeatedArray", repeatedArray)
         # add __str__ to subclass if necessary
         if sc.__dict__.get('__str__') is None:
             def __str__(self):
                 """Return human readable string."""
-                fieldInfo = _mkFieldInfo(self.Fields)
-                varNames, varTypes = _mkNamesAndTypes(fieldInfo, self._len)
+                varNames, varTypes = self._layout.namesAndTypes(self._len)
                 s = "{}-{}:".format(cls_name, type(self).__name__)
                 for (varName, varType) in zip(varNames, varTypes):
                     s += "\n  {}={}".format(
@@ -226,12 +492,11 @@ def initMessageClass(cls):
         if sc.__dict__.get('serialize') is None:
             def serialize(self):
                 """UBX-serialize this object."""
-                fieldInfo = _mkFieldInfo(self.Fields)
-                varNames, varTypes = _mkNamesAndTypes(fieldInfo, self._len)
-                payload = b''
+                varNames, varTypes = self._layout.namesAndTypes(self._len)
+                payload = bytearray(self._len)
+                offset = 0
                 for name, typ in zip(varNames, varTypes):
-                    val = getattr(self, name)
-                    payload += typ.serialize(val)
+                    offset = typ.pack_into(payload, offset, getattr(self, name))
                 return UBXMessage.make(
                     self._class, self._id, payload
                     )
@@ -245,31 +510,82 @@ def classFromMessageClass():
     """Look up the python class corresponding to a UBX message class.
 
     The result is something like
-    [(5, UBX.ACK.ACK), (6, UBX.CFG.CFG), (10, UBX.MON.MON)]
+    {5: UBX.ACK.ACK, 6: UBX.CFG.CFG, 10: UBX.MON.MON}
     """
-    return dict([
-        (getattr(v, '_class'), v)
-        for (k, v) in inspect.getmembers(sys.modules["UBX"], inspect.isclass)
-        if v.__name__ not in [
-            "UBXMessage", "U1", "I1", "X1", "U2", "I2", "X2",
-            "U4", "I4", "X4", "R4", "R8", "CH", "U"
-            ]
-    ])
+    return dict(_classRegistry)
+
 
+def lookupMessage(msgClass, msgId):
+    """Return the python class for message class and ID, or None.
 
-def parseUBXPayload(msgClass, msgId, payload):
-    """Parse a UBX payload from message class, message ID and payload."""
-    Cls = classFromMessageClass().get(msgClass)
-    if Cls is None:
-        err = "Cannot parse message class {}.\n Available: {}"\
-              .format(msgClass, classFromMessageClass())
-        raise Exception(err)
-    Subcls = Cls._lookup.get(msgId)
+    The classes are registered by initMessageClass, so this is a single
+    table lookup regardless of the number of message definitions.
+    """
+    return _messageTable[256 * msgClass + msgId]
+
+
+def messageType(t):
+    """Return (message class ID, message ID) of a message class or a tuple.
+
+    E.g. messageType(UBX.ACK.ACK) == messageType((0x05, 0x01)) == (5, 1).
+    """
+    if isinstance(t, tuple):
+        return t
+    return (t._class, t._id)
+
+
+def expectedResponse(msgClass, msgId, length):
+    """Return the response type to a message sent to the receiver, or None.
+
+    A poll request (no payload, or shorter than the Fields of the message)
+    is answered with a message of the same type, so the result is
+    (msgClass, msgId). A CFG message that sets something is acknowledged
+    with an ACK-ACK or ACK-NAK whose clsID and msgID are those of the CFG
+    message, then the result is (0x05, None). The 3-byte CFG-MSG, which
+    sets the rate on the current port, is a set, not a poll.
+    """
+    Subcls = _messageTable[256 * msgClass + msgId]
+    if (msgClass, msgId, length) == (0x06, 0x01, 3):
+        return (0x05, None)
+    if length == 0 or \
+            (Subcls is not None and length < Subcls._layout.once.size):
+        return (msgClass, msgId)
+    if msgClass == 0x06:
+        return (0x05, None)
+    return None
+
+
+def maxPayloadLength(msgClass, msgId):
+    """Return the largest payload length that the Fields definitions allow.
+
+    For an ID with several definitions, such as CFG-TP5 and CFG-TP5_GET,
+    this is the largest of them.
+    This is 65535 for undefined messages of a known message class, and -1
+    if the message class doesn't exist.
+    """
+    return _maxLengthTable[256 * msgClass + msgId]
+
+
+def parseUBXPayload(msgClass, msgId, payload, lazy=False):
+    """Parse a UBX payload from message class, message ID and payload.
+
+    With lazy=True the fields are only decoded when they are accessed.
+    """
+    Subcls = _messageTable[256 * msgClass + msgId]
+    variants = _variantTable.get(256 * msgClass + msgId)
+    if variants is not None:
+        Subcls = next((c for c in variants if c._layout.fits(len(payload))),
+                      Subcls)
     if Subcls is None:
+        Cls = _classRegistry.get(msgClass)
+        if Cls is None:
+            err = "Cannot parse message class {}.\n Available: {}"\
+                  .format(msgClass, _classRegistry)
+            raise Exception(err)
         raise Exception(
             "Cannot parse message ID {} of message class {}.\n Available: {}"
-            .format(msgId, msgClass.__name__, Cls._lookup))
-    return Subcls(payload)
+            .format(msgId, Cls.__name__, Cls._lookup))
+    return Subcls(payload, lazy) if lazy else Subcls(payload)
 
 
 def parseUBXMessage(msg):
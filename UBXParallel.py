@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Decode capture files with several processes.
+
+The capture is split into chunks at verified UBX frame boundaries, the
+chunks are decoded in a ProcessPoolExecutor and the results are merged back
+in stream order.
+"""
+
+import os
+import sys
+import mmap
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from UBXFramer import scan, UBX, NMEA, INCOMPLETE
+from UBXMessage import messageType
+from UBXLogReader import UBXLogReader
+
+
+def chunkBoundaries(buf, chunkSize, start=0, end=None):
+    """Return the offsets at which buf[start:end] is split into chunks.
+
+    From every multiple of chunkSize the next UBX frame with a correct
+    checksum that is directly followed by another UBX frame or NMEA
+    sentence, or by the end, is located, and the chunk boundary is put at
+    its first sync char. A checksum that matches by chance inside a payload
+    therefore can't split a frame. The result starts with start and ends
+    with end.
+    """
+    end = len(buf) if end is None else end
+    boundaries = [start]
+    pos = start + chunkSize
+    while pos < end:
+        frame = None            # (start, stop) of the last item if a frame
+        for kind, i, j in scan(buf, pos, end):
+            if frame is not None and i == frame[1] and \
+                    kind in (UBX, NMEA, INCOMPLETE):
+                break
+            frame = (i, j) if kind == UBX else None
+        else:
+            break       # no frame after pos
+        boundaries.append(frame[0])
+        pos = frame[0] + chunkSize
+    boundaries.append(end)
+    return boundaries
+
+
+def _identity(obj):
+    return obj
+
+
+def _decodeChunk(filename, start, end, msgTypes, func):
+    """Decode the UBX frames in filename[start:end] in a worker process.
+
+    Returns (results, errors, stats), where results is a list of
+    (offset, func(obj)) and errors a list of (offset, msgClass, msgId,
+    errMsg) for the frames that can't be parsed.
+    """
+    import UBX     # registers the message classes
+    from UBXMessage import parseUBXPayload
+    results, errors = [], []
+    with UBXLogReader(filename, msgTypes, nmea=False) as reader:
+        for offset, msgClass, msgId, payload in reader.frames(start, end):
+            try:
+                obj = parseUBXPayload(msgClass, msgId, bytes(payload))
+            except Exception as e:
+                errors.append((offset, msgClass, msgId, str(e)))
+                continue
+            result = func(obj)
+            if result is not None:
+                results.append((offset, result))
+        payload = None
+        stats = reader.stats
+    return results, errors, stats
+
+
+class UBXParallelDecoder:
+    """Decode the UBX frames of a capture file in parallel.
+
+    Iterating yields (offset, result) in stream order, where result is
+    func(obj) for the parsed UBX object obj of the frame at offset. func
+    runs in the worker processes and must be picklable, e.g. a module level
+    function; results that are None are dropped. Transferring the parsed
+    objects from the workers costs more than parsing them, so for good
+    scaling func should reduce each object to the values that are needed.
+    It defaults to returning the object.
+
+    msgTypes restricts decoding to the given message types as in
+    UBXLogReader. chunkSize is the approximate number of bytes per chunk
+    and workers the number of processes (default: os.cpu_count()). At most
+    2 * workers chunks are decoded ahead of the iteration.
+
+    After iterating, errors holds (offset, msgClass, msgId, errMsg) of the
+    frames that couldn't be parsed, and stats the summed UBXLogReader stats
+    of all chunks.
+    """
+
+    def __init__(self, filename, msgTypes=None, func=None,
+                 chunkSize=1 << 24, workers=None):
+        """Instantiate with the capture filename."""
+        self.filename = filename
+        self.msgTypes = None if msgTypes is None \
+            else list(map(messageType, msgTypes))
+        self.func = _identity if func is None else func
+        self.chunkSize = chunkSize
+        self.workers = workers or os.cpu_count()
+        self.errors = []
+        self.stats = {}
+
+    def chunks(self):
+        """Return the list of (start, end) chunks of the capture."""
+        with open(self.filename, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                boundaries = chunkBoundaries(buf, self.chunkSize)
+        return list(zip(boundaries[:-1], boundaries[1:]))
+
+    def __iter__(self):
+        chunks = self.chunks()
+        self.errors = []
+        self.stats = {}
+        # only submit as many chunks as can be decoded while the results of
+        # the first are consumed, so the results don't pile up in memory
+        window = 2 * self.workers
+        pending = deque()
+        with ProcessPoolExecutor(self.workers) as executor:
+            try:
+                for start, end in chunks:
+                    pending.append(executor.submit(
+                        _decodeChunk, self.filename, start, end,
+                        self.msgTypes, self.func
+                    ))
+                    if len(pending) >= window:
+                        yield from self._merge(pending.popleft().result())
+                while pending:
+                    yield from self._merge(pending.popleft().result())
+            finally:
+                for future in pending:      # iteration stopped early
+                    future.cancel()
+
+    def _merge(self, chunk):
+        """Yield the results of a decoded chunk and add up its errors."""
+        results, errors, chunkStats = chunk
+        yield from results
+        self.errors += errors
+        for key, val in chunkStats.items():
+            if key == 'truncatedBytes':
+                self.stats[key] = val   # only at the end of the last
+            else:
+                self.stats[key] = self.stats.get(key, 0) + val
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2:
+        sys.stderr.write("Usage:\n  UBXParallel.py FILENAME [WORKERS]\n\n" +
+                         __doc__)
+        sys.exit(1)
+
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    decoder = UBXParallelDecoder(sys.argv[1], func=str, workers=workers)
+    for offset, msg in decoder:
+        print("{:08X} {}".format(offset, msg))
+    for offset, msgClass, msgId, errMsg in decoder.errors:
+        sys.stderr.write("{:08X} UBX ERR {:02X}:{:02X} {}\n"
+                         .format(offset, msgClass, msgId, errMsg))
+    sys.stderr.write("{}\n".format(decoder.stats))
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+"""Declarative receiver configuration, applied in one burst.
+
+A Profile lists CFG-MSG rates, CFG-RATE, CFG-PRT and CFG-GNSS settings. It
+is compiled into serialized frames that are written at once, and the
+ACK-ACK or ACK-NAK of every frame is tracked concurrently.
+"""
+
+import sys
+import json
+import threading
+from time import time
+from struct import pack
+from concurrent.futures import Future, wait
+import UBX     # registers the message classes
+from UBXMessage import UBXMessage, messageType, parseUBXPayload
+from UBXManager import _copyResult, _setResult
+
+
+def build(Cls, nBlocks=0, **fields):
+    """Return the serialized message Cls with the given field values.
+
+    nBlocks is the number of repeated blocks, the fields that are not
+    given are 0.
+    """
+    layout = Cls._layout
+    length = layout.once.size
+    if nBlocks:
+        length += nBlocks * layout.repeat.size
+    obj = Cls(bytes(length))
+    for name, val in fields.items():
+        if name not in obj.__dict__:
+            raise Exception("{} has no field {}".format(layout.clsName, name))
+        setattr(obj, name, val)
+    return obj.serialize()
+
+
+class Profile:
+    """A receiver configuration.
+
+    msgRates maps message types, as in UBXManager.subscribe(), to the
+    output rate on the port the receiver is connected to, or to a tuple of
+    the rates on all 6 ports. rate is a dict of CFG-RATE fields, ports a
+    list of dicts of CFG-PRT fields (one per port) and gnss a list of dicts
+    of the repeated CFG-GNSS fields (one per GNSS). Fields that are not
+    given are 0.
+    """
+
+    def __init__(self, msgRates=None, rate=None, ports=None, gnss=None,
+                 numTrkChUse=0xff):
+        """Instantiate, numTrkChUse is the CFG-GNSS number of channels."""
+        self.msgRates = {
+            messageType(t): r for t, r in (msgRates or {}).items()
+        }
+        self.rate = rate
+        self.ports = ports or []
+        self.gnss = gnss or []
+        self.numTrkChUse = numTrkChUse
+
+    def compile(self):
+        """Return the list of (description, frame) in the order they are sent.
+
+        The CFG-PRT frames come last, so a change of the port settings
+        can't affect the other frames.
+        """
+        items = []
+        for (msgClass, msgId), rate in self.msgRates.items():
+            if isinstance(rate, int):
+                payload = bytes([msgClass, msgId, rate])
+            else:
+                payload = bytes([msgClass, msgId] + list(rate))
+            items.append((
+                "CFG-MSG {:02X}:{:02X} rate={}".format(msgClass, msgId, rate),
+                UBXMessage.make(0x06, 0x01, payload)
+            ))
+        if self.rate is not None:
+            items.append((self._describe("CFG-RATE", self.rate),
+                          build(UBX.CFG.RATE, **self.rate)))
+        if self.gnss:
+            fields = {'numTrkChUse': self.numTrkChUse,
+                      'numConfigBlocks': len(self.gnss)}
+            for i, block in enumerate(self.gnss, 1):
+                for name, val in block.items():
+                    fields["{}_{}".format(name, i)] = val
+            items.append((
+                "CFG-GNSS gnssId={}".format(
+                    ",".join(str(b.get('gnssId', 0)) for b in self.gnss)
+                ),
+                build(UBX.CFG.GNSS, len(self.gnss), **fields)
+            ))
+        for port in self.ports:
+            items.append((self._describe("CFG-PRT", port),
+                          build(UBX.CFG.PRT, **port)))
+        return items
+
+    @staticmethod
+    def _describe(name, fields):
+        return " ".join(
+            [name] + ["{}={}".format(k, v) for k, v in fields.items()]
+        )
+
+    def apply(self, manager, timeout=1, retries=2, cache=None):
+        """Configure the receiver of a running UBXManager.
+
+        All frames are written with one write. Returns the list of
+        (description, error) once every frame is acknowledged or has
+        failed; error is None for an ACK-ACK, otherwise the exception, e.g.
+        for an ACK-NAK or a timeout. See formatReport().
+        With a ConfigCache of the receiver only the frames that change
+        something are sent, the others are reported as unchanged.
+        """
+        items = self.compile()
+        frames = [frame for description, frame in items]
+        if cache is None:
+            futures = manager.requestAll(frames, timeout, retries)
+        else:
+            futures = cache.setAll(frames, timeout, retries)
+        wait(futures)
+        return [(description, future.exception()) if
+                future.exception() is not None or
+                future.result() is not ConfigCache.UNCHANGED
+                else (description + " (unchanged)", None)
+                for (description, frame), future in zip(items, futures)]
+
+
+class ConfigCache:
+    """The last known CFG messages of one receiver.
+
+    The cache holds the payloads of CFG-PRT (per port), CFG-MSG (per
+    message type), CFG-RATE, CFG-GNSS, CFG-PM2 and CFG-RXM. It is filled
+    from every such message the receiver sends, e.g. answers to polls, and
+    from the sets it acknowledges. A type is dropped on an ACK-NAK for it,
+    all entries are dropped by coldStart(), and entries older than ttl
+    seconds are not used.
+
+    set() only sends messages that change the cached values, so bring-up
+    of a receiver that is already configured costs no round trips once
+    the cache is known, e.g. from save() of a previous run. port is the ID
+    of the port the receiver is connected to, needed to compare the 3-byte
+    CFG-MSG; get() of CFG-PRT without key sets it.
+    """
+
+    TYPES = {0x00, 0x01, 0x08, 0x11, 0x3B, 0x3E}    # CFG message IDs
+    UNCHANGED = object()    # result of set() when nothing was sent
+
+    def __init__(self, manager, ttl=None):
+        """Instantiate for the receiver of manager and subscribe."""
+        self.manager = manager
+        self.ttl = ttl
+        self.port = None
+        self._lock = threading.Lock()
+        self._cache = {}    # (message ID, key): (time, payload)
+        self._subscriptions = [
+            manager.subscribe((0x06, msgId), self._onCFG, raw=True)
+            for msgId in sorted(self.TYPES)
+        ] + [manager.subscribe((0x05, 0x00), self._onNAK, raw=True)]
+
+    def close(self):
+        """Unsubscribe from the manager."""
+        for s in self._subscriptions:
+            self.manager.unsubscribe(s)
+        self._subscriptions = []
+
+    @staticmethod
+    def _key(msgId, payload):
+        if msgId == 0x00:   # CFG-PRT by portID
+            return payload[0] if len(payload) else None
+        if msgId == 0x01:   # CFG-MSG by message type
+            return bytes(payload[:2])
+        return None
+
+    def _lookup(self, msgId, key):
+        # with _lock: return the cached payload or None
+        entry = self._cache.get((msgId, key))
+        if entry is None:
+            return None
+        if self.ttl is not None and time() - entry[0] > self.ttl:
+            del self._cache[(msgId, key)]
+            return None
+        return entry[1]
+
+    def _store(self, msgId, payload):
+        with self._lock:
+            self._cache[(msgId, self._key(msgId, payload))] = \
+                (time(), bytes(payload))
+
+    def _onCFG(self, msgClass, msgId, payload):
+        if msgId != 0x01 or len(payload) == 8:  # not the 3-byte CFG-MSG
+            self._store(msgId, payload)
+
+    def _onNAK(self, msgClass, msgId, payload):
+        if payload[0] == 0x06:
+            self.invalidate(payload[1])
+
+    def invalidate(self, msgId=None):
+        """Drop the entries of CFG message ID msgId, or all."""
+        with self._lock:
+            for k in list(self._cache):
+                if msgId is None or k[0] == msgId:
+                    del self._cache[k]
+
+    def coldStart(self):
+        """Cold start the receiver (CFG-RST) and drop the cache."""
+        # clear all BBR sections, controlled software reset (GNSS only)
+        payload = pack('<HBB', 0xffff, 0x02, 0)
+        self.manager.send(UBXMessage.make(0x06, 0x04, payload))
+        self.invalidate()
+
+    def get(self, msgType, key=None, timeout=1, retries=2):
+        """Return a Future of the CFG message msgType.
+
+        key selects the port of CFG-PRT (the current port if None) and the
+        (class ID, message ID) of CFG-MSG. A cached message is returned
+        without polling the receiver.
+        """
+        msgId = messageType(msgType)[1]
+        if msgId == 0x01:
+            key = bytes(key)
+        with self._lock:
+            payload = None if key is None and msgId == 0x00 else \
+                self._lookup(msgId, key)
+        if payload is not None:
+            future = Future()
+            future.set_result(parseUBXPayload(0x06, msgId, payload))
+            return future
+        poll = b'' if key is None else \
+            bytes([key]) if isinstance(key, int) else key
+        polled = self.manager.request(UBXMessage.make(0x06, msgId, poll),
+                                      timeout, retries)
+        if msgId != 0x00 or key is not None:
+            return polled
+        future = Future()
+
+        def onPort(f):
+            if f.exception() is None:
+                self.port = f.result().portID
+            _copyResult(f, future)
+        polled.add_done_callback(onPort)
+        return future
+
+    def _unchanged(self, msgId, payload):
+        # with _lock: whether the set payload changes nothing
+        if msgId == 0x01 and len(payload) == 3:
+            cached = self._lookup(msgId, bytes(payload[:2]))
+            return self.port is not None and cached is not None and \
+                cached[2 + self.port] == payload[2]
+        return self._lookup(msgId, self._key(msgId, payload)) == payload
+
+    def _onSet(self, msgId, payload, future):
+        if future.cancelled() or future.exception() is not None:
+            self.invalidate(msgId)
+        elif msgId == 0x01 and len(payload) == 3:
+            with self._lock:
+                cached = self._lookup(msgId, bytes(payload[:2]))
+                if cached is not None and self.port is not None:
+                    cached = bytearray(cached)
+                    cached[2 + self.port] = payload[2]
+                    self._cache[(msgId, bytes(payload[:2]))] = \
+                        (time(), bytes(cached))
+        elif msgId == 0x3E:     # the receiver merges the GNSS blocks
+            self.invalidate(msgId)
+        else:
+            self._store(msgId, payload)
+
+    def setAll(self, msgs, timeout=1, retries=2):
+        """Send the CFG messages that change something with one write.
+
+        Returns a list of Futures as UBXManager.requestAll(); the result
+        is UNCHANGED for the messages that weren't sent.
+        """
+        msgs = [m.serialize() if hasattr(m, 'serialize') else m for m in msgs]
+        futures, send = [], []
+        with self._lock:
+            for msg in msgs:
+                msgId, payload = msg[3], msg[6:-2]
+                if msg[2] == 0x06 and msgId in self.TYPES and \
+                        self._unchanged(msgId, payload):
+                    future = Future()
+                    future.set_result(self.UNCHANGED)
+                    futures.append(future)
+                else:
+                    futures.append(None)
+                    send.append(msg)
+        sent = iter(self.manager.requestAll(send, timeout, retries)
+                    if send else [])
+        for i, msg in enumerate(msgs):
+            if futures[i] is None:
+                futures[i] = next(sent)
+                if msg[2] == 0x06 and msg[3] in self.TYPES:
+                    futures[i].add_done_callback(
+                        lambda f, m=msg: self._onSet(m[3], m[6:-2], f)
+                    )
+        return futures
+
+    def set(self, msg, timeout=1, retries=2):
+        """Send a CFG message unless it changes nothing, see setAll()."""
+        return self.setAll([msg], timeout, retries)[0]
+
+    def modify(self, msgType, change, key=None, timeout=1, retries=2):
+        """Get a CFG message, change it and set it if it has changed.
+
+        change(obj) modifies the message in place. Returns a Future as
+        set().
+        """
+        future = Future()
+
+        def onGot(got):
+            try:
+                obj = got.result()
+                change(obj)
+                done = self.set(obj, timeout, retries)
+            except Exception as e:
+                _setResult(future, exception=e)
+                return
+            done.add_done_callback(lambda f: _copyResult(f, future))
+        self.get(msgType, key, timeout, retries).add_done_callback(onGot)
+        return future
+
+    def save(self, filename):
+        """Write the cache to a JSON file."""
+        with self._lock:
+            entries = [[msgId, key.hex() if isinstance(key, bytes) else key,
+                        t, payload.hex()]
+                       for (msgId, key), (t, payload) in self._cache.items()]
+        with open(filename, 'w') as f:
+            json.dump({'port': self.port, 'entries': entries}, f)
+
+    def load(self, filename):
+        """Add the entries of a file written by save(), if it exists."""
+        try:
+            with open(filename) as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self.port is None:
+                self.port = data['port']
+            for msgId, key, t, payload in data['entries']:
+                if isinstance(key, str):
+                    key = bytes.fromhex(key)
+                self._cache.setdefault((msgId, key),
+                                       (t, bytes.fromhex(payload)))
+
+
+def formatReport(report):
+    """Return the report of Profile.apply() as text, one line per item."""
+    return "\n".join(
+        "{:4s}{}{}".format("OK" if error is None else "ERR", description,
+                           "" if error is None else ": {}".format(error))
+        for description, error in report
+    )
+
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 3:
+        sys.stderr.write("Usage:\n  UBXProfile.py DEVICE PROFILE.json\n\n" +
+                         __doc__ + "\nmsgRates keys are \"CLASS:ID\" in hex.\n")
+        sys.exit(1)
+
+    import serial
+    from UBXManager import UBXManager
+    from UBXBaudrate import detectBaudrate
+
+    class Manager(UBXManager):
+        def onUBX(self, obj):
+            pass
+
+        def onNMEA(self, buffer):
+            pass
+
+    with open(sys.argv[2]) as f:
+        config = json.load(f)
+    config['msgRates'] = {
+        tuple(int(x, 16) for x in key.split(':')): val
+        for key, val in config.get('msgRates', {}).items()
+    }
+    ser = serial.Serial(sys.argv[1], 9600, timeout=0.1)
+    if detectBaudrate(ser) is None:
+        sys.stderr.write("No receiver found on {}\n".format(sys.argv[1]))
+        sys.exit(1)
+    manager = Manager(ser)
+    manager.start()
+    report = Profile(**config).apply(manager)
+    manager.shutdown()
+    print(formatReport(report))
+    sys.exit(0 if all(error is None for description, error in report) else 1)
@@ -4,11 +4,12 @@ import argparse
 import os
 import serial
 from UBXManager import UBXManager
+from UBXProfile import Profile, ConfigCache
+from UBXBaudrate import detectBaudrate, changeBaudrate
 from threading import Lock
+from concurrent.futures import wait
 from time import sleep
 import UBX
-from FSM import FSM_Get, isObj, isACK
-from enum import Enum
 import matplotlib.pyplot as plt
 import numpy as np
 import sqlite3
@@ -91,80 +92,10 @@ class graph:
         plt.pause(pause_time)
 
 
-@FSM_Get(UBX.MON.VER)
-class FSM_VER_Get:
-    # Expand this class to be able to handle the response?
-    pass
-
-
-@FSM_Get(UBX.SEC.UNIQID)
-class FSM_UNIQID_Get:
-    # Expand this class to be able to handle the response?
-    pass
-
-
-class FSM_MSG_Set:
-    """FSM handling RAW SET"""
-    _class = UBX.CFG.MSG._class
-    _id = UBX.CFG.MSG._id
-
-    class STATE(Enum):
-        START = 0
-        WAIT_GET = 1
-        WAIT_GET_ACK = 2
-        WAIT_SET_ACK = 3
-        DONE = 4
-
-    def __init__(self, msgClass, msgID, rate):
-        self.state = FSM_MSG_Set.STATE.START
-        self._gottenObj = None
-        self._msgClass = msgClass
-        self._msgID = msgID
-        self._rate = rate
-
-    def done(self):
-        return self.state == FSM_MSG_Set.STATE.DONE
-
-    def onUBX(self, obj, manager):
-        # Ignore RXM messages (receiver manager messages) as they are periodic (there may be others? - NAV, MON, HNR, ESF)
-        # inverse - check if is CFG or ACK message..
-        if isObj(obj, UBX.CFG.MSG) or isObj(obj, UBX.ACK.ACK) or isObj(obj, UBX.ACK.NAK):
-            if self.state == FSM_MSG_Set.STATE.START:
-                if isObj(obj, UBX.CFG.MSG):
-                    self._gottenObj = obj
-                    self.state = FSM_MSG_Set.STATE.WAIT_GET_ACK
-                else:
-                    # print("Didnt' get a UBX.CFG.MSG - got a {}".format(obj.__class__))
-
-                    self.state = FSM_MSG_Set.STATE.DONE
-            elif self.state == FSM_MSG_Set.STATE.WAIT_GET_ACK:
-                if isACK(obj):
-                    self._gottenObj.msgClass = self._msgClass
-                    self._gottenObj.msgID = self._msgID
-                    self._gottenObj.rate_usb = self._rate
-
-                    manager.send(self._gottenObj.serialize())
-                    self.state = FSM_MSG_Set.STATE.WAIT_SET_ACK
-                else:
-                    print("Ooops that went wrong, I was expecting an ACK")
-                    self.state = FSM_MSG_Set.STATE.DONE
-            elif self.state == FSM_MSG_Set.STATE.WAIT_SET_ACK:
-                if isACK(obj):
-                    self.state = FSM_MSG_Set.STATE.DONE
-                else:
-                    print("Ooops that went wrong, I was expecting an ACK")
-                    self.state = FSM_MSG_Set.STATE.DONE
-            else:
-                raise Exception("The FSM went boink.")
-        else:
-            logging.debug("Ignoring {} message as in config mode".format(obj.__class__))
-
-
 class Manager(UBXManager):
     def __init__(self, ser, queue,  debug=False):
         UBXManager.__init__(self, ser, debug)
         self._lock = Lock()
-        self._fsm = None
         self._dumpNMEA = False
         self._q = queue
         self._dumpRAW = False
@@ -187,79 +118,20 @@ class Manager(UBXManager):
             print("NMEA: {}".format(buffer))
 
     def onUBX(self, obj):
-        with self._lock:
-            if self._fsm is not None:
-                self._fsm.onUBX(obj, self)
-                if self._fsm.done():
-                    logging.debug("Putting {} message on queue".format(str(obj.__class__)))
-                    # Put message on queue
-                    self._q.put(obj)
-                    self._fsm = None
-            else:
-                # put message on queue
-                # print(obj)
-                if self._dumpRAW:
-                    logging.debug("NON-FSM Putting {} message on queue".format(str(obj.__class__)))
-                    # Put message on queue
-                    self._q.put(obj)
+        # responses to requests are returned by their futures
+        if self._dumpRAW:
+            logging.debug("Putting {} message on queue".format(str(obj.__class__)))
+            # Put message on queue
+            self._q.put(obj)
 
     def onUBXError(self, msgClass, msgId, errMsg):
         logging.error(msgClass, msgId, errMsg)
 
-    def done(self):
-        with self._lock:
-            return self._fsm is None
-
-    def waitUntilDone(self, timeout=None):
-        sleepTime = 0
-        while not self.done():
-            sleep(0.5)
-            sleepTime += 0.5
-            if timeout is not None and sleepTime > timeout:
-                return False
-        return True
-
     def VER_GET(self):
-        msg = UBX.MON.VER.Get().serialize()
-        with self._lock:
-            self._fsm = FSM_VER_Get()
-        self.send(msg)
+        return self.request(UBX.MON.VER.Get(), 1, retries=2)
 
     def UNIQID_GET(self):
-        msg = UBX.SEC.UNIQID.Get().serialize()
-        with self._lock:
-            self._fsm = FSM_UNIQID_Get()
-        self.send(msg)
-
-    def MSG_EN(self, msgClass, msgID, usbRate):
-        msg = UBX.CFG.MSG_GET(bytes([msgClass, msgID]))  # b'\x02\x15')
-        with self._lock:
-            self._fsm = FSM_MSG_Set(msgClass, msgID, usbRate)
-        self.send(msg.serialize())
-
-
-def num_repeated_sections(item):
-    # Get the object module symbol table - we use this to work out what fields are present
-    once = item.Fields.__dict__.items()
-    # We ignore the 'Repeated' field, and any builtin methods that start with __
-    once_fields = list(filter(lambda x: True if not x[0].startswith('__') and not x[0] == 'Repeated' else False, once))
-    # Add up all the sizes of the once fields
-    once_size = sum(list(map(lambda x: x[1]._size, once_fields)))
-
-    if 'Repeated' in item.Fields.__dict__:
-        # Get the repeated field (we only go one level down)
-        repeated = item.Fields.__dict__.get('Repeated').__dict__.items()
-        # Again - ignore repeated field (second level if exists) and builtin methods
-        repeated_fields = list(filter(lambda x: True if not x[0].startswith('__') and not x[0] == 'Repeated' else False, repeated))
-        # Add up all teh sizes of the repeated fields
-        repeated_size = sum(list(map(lambda x: x[1]._size, repeated_fields)))
-
-        num_repeated_sections = int((item._len - once_size) / repeated_size)
-    else:
-        num_repeated_sections = 0
-
-    # message len should equal once_size + N*repeated_size
-    return num_repeated_sections
+        return self.request(UBX.SEC.UNIQID.Get(), 1, retries=2)
 
 
 def startup_msg(term, msg):
@@ -299,6 +171,11 @@ if __name__ == '__main__':
             '-g', '--graph', dest='graph', action='store_true',
             help='show a graph of measurements'
             )
+
+    parser.add_argument(
+            '-b', '--baudrate', dest='baudrate', type=int,
+            help='switch the receiver to this baud rate (UART only)'
+            )
     args = parser.parse_args()
 
     debug = (os.environ.get("DEBUG") is not None) or args.debug
@@ -371,6 +248,9 @@ if __name__ == '__main__':
             startup_msg(term, "Attaching to {}".format(args.device))
             # logging.debug("Attaching to {}".format(args.device))
             ser = serial.Serial(args.device, 9600, timeout=None)
+            if detectBaudrate(ser) is None:
+                logging.error("No receiver found on {}".format(args.device))
+                raise Exception
             queue = Queue(maxsize=10)
             manager = Manager(ser, queue, debug=debug)
             manager.setDumpNMEA(False)
@@ -381,13 +261,17 @@ if __name__ == '__main__':
             # Wait for manager to init
             sleep(1)
 
+            if args.baudrate is not None:
+                changeBaudrate(manager, args.baudrate)
+                startup_msg(term, "Switched to {} baud".format(args.baudrate))
+
             # Get a unique ID to identify the device
-            manager.UNIQID_GET()
+            uniqid = manager.UNIQID_GET()
+            # Check that we have a version we can handle (good test of whether device is up and running...)
+            logging.debug("Getting version...")
+            ver = manager.VER_GET()
 
-            item = queue.get()
-            if type(item).__name__ != 'UNIQID':
-                logging.error("Got a {} msg when expecting a VER message".format(type(item).__bases__))
-                raise Exception  # TODO exception type
+            item = uniqid.result()
 
             # Assembly the uniqueID
             uniqueId = "{:x}:{:x}:{:x}:{:x}:{:x}".format(item.uniqueId_1, item.uniqueId_2, item.uniqueId_3, item.uniqueId_4, item.uniqueId_5)
@@ -395,15 +279,7 @@ if __name__ == '__main__':
             startup_msg(term, "Device Unique ID: {}".format(uniqueId))
             screen_objects['DeviceID']['value'] = uniqueId
 
-            # Check that we have a version we can handle (good test of whether device is up and running...)
-            logging.debug("Getting version...")
-            manager.VER_GET()
-
-            # wait until item appears on queue - TODO shldn't block forever
-            item = queue.get()
-            if type(item).__name__ != 'VER':
-                logging.error("Got a {} msg when expecting a VER message".format(type(item).__bases__))
-                raise Exception  # TODO exception type
+            item = ver.result()
             # Check we have a supported device
             swVersion = float(item.swVersion.split(' ')[2])
             if item.extension_4 != 'MOD=NEO-M8T-0' or swVersion < 3.01:
@@ -419,12 +295,23 @@ if __name__ == '__main__':
             # TODO - change baud rate??
             # Enable the messages we want to consume
 
-            for msg_type in fields_to_save.keys():
-                manager.MSG_EN(msg_type._class, msg_type._id, 0x01)
-                item = queue.get()  # Block till get response on queue
-                if type(item).__name__ != 'ACK':
-                    logging.error("Unable to enable {} messages".format(msg_type.__name__))
-                    raise Exception
+            # all in one burst, once per epoch on the port we are connected to,
+            # leaving out what the receiver had according to the last run
+            cache = ConfigCache(manager, ttl=24 * 3600)
+            cacheFile = "UBXconfig-{}.json".format(uniqueId.replace(':', ''))
+            cache.load(cacheFile)
+            polls = [cache.get(UBX.CFG.MSG, (msg_type._class, msg_type._id))
+                     for msg_type in fields_to_save]
+            if cache.port is None:
+                polls.append(cache.get(UBX.CFG.PRT))
+            wait(polls)
+            profile = Profile(msgRates={msg_type: 1 for msg_type in fields_to_save})
+            report = profile.apply(manager, cache=cache)
+            cache.save(cacheFile)
+            for msg_type, (description, error) in zip(fields_to_save, report):
+                if error is not None:
+                    logging.error("Unable to enable {} messages: {}".format(msg_type.__name__, error))
+                    raise error
 
                 startup_msg(term, "{} messages enabled".format(msg_type.__name__))
                 logging.info("Got ACK for setting {} messages".format(msg_type.__name__))
@@ -474,15 +361,15 @@ if __name__ == '__main__':
 
                     results['repeated'] = []
 
-                    for i in range(1, num_repeated_sections(item)+1):
-                        tmp = {}
-
-                        for field in fields_to_save[type(item)]['repeated']:
-                            if field.startswith('gnssId'):
-                                tmp[field] = gnssId_lookup[getattr(item, field+'_'+str(i))]
-                            else:
-                                tmp[field] = getattr(item, field+'_'+str(i))
-                        results['repeated'].append(tmp)
+                    repeated_fields = fields_to_save[type(item)]['repeated']
+                    if repeated_fields:
+                        # one column per field, straight from the payload
+                        columns = item.repeatedArray()[repeated_fields].tolist()
+                        for row in columns:
+                            tmp = dict(zip(repeated_fields, row))
+                            if 'gnssId' in tmp:
+                                tmp['gnssId'] = gnssId_lookup[tmp['gnssId']]
+                            results['repeated'].append(tmp)
 
                     # work out the TOW (normalise the fields)
                     new_tow = int(results[fields_to_save[type(item)]['TOW']]) * fields_to_save[type(item)]['TOW_scale']
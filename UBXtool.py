@@ -6,100 +6,14 @@ import os
 import serial
 from time import sleep
 from threading import Lock
-from enum import Enum
+from concurrent.futures import wait
 import argparse
 import datetime
 import UBX
 from UBXManager import UBXManager
-from FSM import *
-
-
-@FSM_Get(UBX.MON.VER)
-class FSM_VER_Get:
-    pass
-
-@FSM_Get(UBX.NAV.STATUS)
-class FSM_STATUS_Get:
-    pass
-
-@FSM_Get(UBX.CFG.MSG)
-class FSM_RAW_Set:
-    pass
-@FSM_Get(UBX.CFG.PRT_GET)
-class FSM_PORT_Get:
-    pass
-
-
-@FSM_Get(UBX.MON.PATCH)
-class FSM_PATCH_Get:
-    pass
-
-@FSM_Get(UBX.RXM.RAWX)
-class FSM_RXM_Get:
-    pass
-
-@FSM_Get(UBX.CFG.GNSS)
-class FSM_GNSS_Get:
-    pass
-
-
-@FSM_Get(UBX.CFG.PMS)
-class FSM_PMS_Get:
-    pass
-
-
-@FSM_Get(UBX.CFG.PM2)
-class FSM_PM2_Get:
-    pass
-
-
-@FSM_Get(UBX.CFG.RATE)
-class FSM_RATE_Get:
-    pass
-
-
-class FSM_RXM_Set:
-    """FSM handling MON.VER.Get"""
-    _class = UBX.CFG.RXM._class
-    _id = UBX.CFG.RXM._id
-    class STATE(Enum):
-        START = 0
-        WAIT_GET = 1
-        WAIT_GET_ACK = 2
-        WAIT_SET_ACK = 3
-        DONE = 4
-    def __init__(self, lpMode):
-        self.state = FSM_RXM_Set.STATE.START
-        self.ver = None
-        self._gottenObj = None
-        self.lpMode = lpMode
-    def done(self):
-        return self.state == FSM_RXM_Set.STATE.DONE
-    def onUBX(self, obj, manager):
-        print("Got ubx {}, current state: {}".format(obj.__class__, self.state))
-        if self.state == FSM_RXM_Set.STATE.START:
-            if isObj(obj, UBX.CFG.RXM):
-                self._gottenObj = obj
-                self.state = FSM_RXM_Set.STATE.WAIT_GET_ACK
-            else:
-                print("Didnt' get a UBX.CFG.RXM")
-                self.state = FSM_RXM_Set.STATE.DONE
-        elif self.state == FSM_RXM_Set.STATE.WAIT_GET_ACK:
-            if isACK(obj):
-                self._gottenObj.lpMode = self.lpMode
-                manager.send(self._gottenObj.serialize())
-                self.state = FSM_RXM_Set.STATE.WAIT_SET_ACK
-            else:
-                print("Ooops that went wrong, I was expecting an ACK")
-                self.state = FSM_RXM_Set.STATE.DONE
-        elif self.state == FSM_RXM_Set.STATE.WAIT_SET_ACK:
-            if isACK(obj):
-                self.state = FSM_RXM_Set.STATE.DONE
-            else:
-                print("Ooops that went wrong, I was expecting an ACK")
-                self.state = FSM_RXM_Set.STATE.DONE
-        else:
-            raise Exception("The FSM went boink.")
+from UBXProfile import ConfigCache
+from UBXBaudrate import detectBaudrate, changeBaudrate
+from UBXMessage import UBXMessage
 
 
 class Manager(UBXManager):
@@ -107,98 +21,69 @@ class Manager(UBXManager):
         UBXManager.__init__(self, ser, debug)
         self._lock = Lock()
         self._dumpNMEA = True    # with _lock
-        self._fsm = None         # with _lock
+        self._requests = []      # with _lock, futures of requests in flight
+        self.configCache = ConfigCache(self)
     def setDumpNMEA(self, val):
         with self._lock:
             self._dumpNMEA = val
         if self.debug:
             print("dumpNMEA={}".format(val))
     def onUBX(self, obj):
-        with self._lock:
-            if self._fsm is not None:
-                self._fsm.onUBX(obj, self)
-                if self._fsm.done():
-                    self._fsm = None
-            else:
-                print(obj)
+        print(obj)
     def onUBXError(self, msgClass, msgId, errMsg):
         print(msgClass, msgId, errMsg)
     def onNMEA(self, buffer):
         with self._lock:
             dump = self._dumpNMEA
         if dump:
-            print("{} {}".format(datetime.datetime.now().isoformat(), buffer))
+            # arrival is None in bytewise mode
+            t = datetime.datetime.now() if buffer.arrival is None else \
+                datetime.datetime.fromtimestamp(buffer.arrival[1])
+            print("{} {}".format(t.isoformat(), buffer))
+    def _track(self, future):
+        with self._lock:
+            self._requests.append(future)
+        future.add_done_callback(self._onDone)
+    def _onDone(self, future):
+        with self._lock:
+            self._requests.remove(future)
+        if not future.cancelled() and future.exception() is not None:
+            print("Ooops that went wrong: {}".format(future.exception()))
     def done(self):
         with self._lock:
-            return self._fsm is None
+            return not self._requests
     def waitUntilDone(self, timeout=None):
-        sleepTime = 0
-        while not self.done():
-            sleep(0.5)
-            sleepTime += 0.5
-            if timeout is not None and sleepTime > timeout:
-                return False
-        return True
-    def VER_GET(self):
-        msg = UBX.MON.VER.Get().serialize()
         with self._lock:
-            self._fsm = FSM_VER_Get()
-        self.send(msg)
+            requests = list(self._requests)
+        return not wait(requests, timeout).not_done
+    def VER_GET(self):
+        self._track(self.request(UBX.MON.VER.Get(), 1, retries=2))
     def PATCH_GET(self):
-        msg = UBX.MON.PATCH.Get().serialize()
-        with self._lock:
-            self._fsm = FSM_PATCH_Get()
-        self.send(msg)
+        self._track(self.request(UBX.MON.PATCH.Get(), 1, retries=2))
     def RAW_GET(self):
-        msg = UBX.RXM.RAWX.Get().serialize()
-        with self._lock:
-            self._fsm = FSM_RXM_Get()
-        self.send(msg)
+        self._track(self.request(UBX.RXM.RAWX.Get(), 1, retries=2))
     def STATUS_GET(self):
-        msg = UBX.NAV.STATUS.Get().serialize()
-        with self._lock:
-            self._fsm = FSM_STATUS_Get()
-        self.send(msg)
+        self._track(self.request(UBX.NAV.STATUS.Get(), 1, retries=2))
     def RAW_SET(self):
         print("Setting raw")
-        msg = UBX.CFG.MSG(b'\x02\x15\x01')  # .Get().serialize() # This enables the raw messages, once per second. Why was this not a get?
-        with self._lock:
-            self._fsm = FSM_RAW_Set()
-        self.send(msg.serialize())
-
+        # enables the raw messages on the current port, once per second
+        msg = UBXMessage.make(0x06, 0x01, b'\x02\x15\x01')
+        self._track(self.request(msg, 1, retries=2))
     def PORT_GET(self):
-        prt_get = UBX.CFG.PRT_GET(b'\x03')
-        
-        #prt_get.portID=3
-        msg = prt_get.serialize()
-        with self._lock:
-            self._fsm = FSM_PORT_Get()
-        self.send(msg)
+        self._track(self.request(UBX.CFG.PRT_GET(b'\x03'), 1, retries=2))
     def GNSS_GET(self):
-        msg = UBX.CFG.GNSS.Get().serialize()
-        with self._lock:
-            self._fsm = FSM_GNSS_Get()
-        self.send(msg)
+        self._track(self.request(UBX.CFG.GNSS.Get(), 1, retries=2))
     def PMS_GET(self):
-        msg = UBX.CFG.PMS.Get().serialize()
-        with self._lock:
-            self._fsm = FSM_PMS_Get()
-        self.send(msg)
+        self._track(self.request(UBX.CFG.PMS.Get(), 1, retries=2))
     def PM2_GET(self):
-        msg = UBX.CFG.PM2.Get().serialize()
-        with self._lock:
-            self._fsm = FSM_PM2_Get()
-        self.send(msg)
+        self._track(self.request(UBX.CFG.PM2.Get(), 1, retries=2))
     def RATE_GET(self):
-        msg = UBX.CFG.RATE.Get().serialize()
-        with self._lock:
-            self._fsm = FSM_RATE_Get()
-        self.send(msg)
+        self._track(self.request(UBX.CFG.RATE.Get(), 1, retries=2))
     def RXM_SET(self, lpMode):
-        msg = UBX.CFG.RXM.Get().serialize()
-        with self._lock:
-            self._fsm = FSM_RXM_Set(lpMode)
-        self.send(msg)
+        def change(obj):
+            obj.lpMode = lpMode
+        # only sent if lpMode changes
+        self._track(self.configCache.modify(UBX.CFG.RXM, change))
 
 
 if __name__ == '__main__':
@@ -242,6 +127,10 @@ if __name__ == '__main__':
         '-d', '--debug', dest='debug', action='store_true',
         help='Turn on debug mode'
         )
+    parser.add_argument(
+        '-b', '--baudrate', dest='baudrate', action='store', type=int,
+        help='Switch the receiver to this baud rate'
+        )
     parser.add_argument(
         '--RAW-GET', dest='RAW_GET', action='store_true',
         help='get a raw message'
@@ -261,6 +150,9 @@ if __name__ == '__main__':
     args = parser.parse_args()
 
     ser = serial.Serial('/dev/ttyACM0', 9600, timeout=None)
+    if detectBaudrate(ser) is None:
+        sys.stderr.write("No receiver found on {}\n".format(ser.port))
+        sys.exit(1)
     debug = (os.environ.get("DEBUG") is not None) or args.debug
 
     manager = Manager(ser, debug=debug)
@@ -271,17 +163,20 @@ if __name__ == '__main__':
 
     sleep(1)
 
-    # do all getters
+    if args.baudrate is not None:
+        changeBaudrate(manager, args.baudrate)
+
+    # do all getters, they are sent without waiting for each other
     for argName in filter(lambda s: s.endswith("_GET"), args.__dict__.keys()):
         if args.__dict__[argName]:
             print(argName)
             getattr(manager, argName)()
-            manager.waitUntilDone()
+    manager.waitUntilDone()
     # do all setters
     for argName in filter(lambda s: s.endswith("_SET"), args.__dict__.keys()):
         if args.__dict__[argName]:
             getattr(manager, argName)()
-            manager.waitUntilDone()
+    manager.waitUntilDone()
 
     if args.RXM is not None:
         manager.RXM_SET(args.RXM)
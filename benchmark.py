@@ -0,0 +1,492 @@
+#!/usr/bin/env python3
+"""Micro benchmarks for the parsing pipeline.
+
+Usage:
+  benchmark.py [NAME ...]
+
+Without arguments all benchmarks are run.
+"""
+
+import sys
+import random
+from time import perf_counter, sleep
+import UBX
+from UBXMessage import UBXMessage
+from UBXManager import UBXManager
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Decorator that registers a benchmark function under name."""
+    def decorator(f):
+        BENCHMARKS[name] = f
+        return f
+    return decorator
+
+
+def timeit(f, minTime=0.5):
+    """Return the average time in seconds of a call to f()."""
+    n, t = 0, 0.0
+    while t < minTime:
+        t0 = perf_counter()
+        f()
+        t += perf_counter() - t0
+        n += 1
+    return t / n
+
+
+def NMEASentence(body):
+    """Return a complete NMEA sentence with checksum for body (a str)."""
+    chksum = 0
+    for c in body:
+        chksum ^= ord(c)
+    return "${}*{:02X}\r\n".format(body, chksum).encode('ascii')
+
+
+def RAWXFrame(numMeas, rnd=random):
+    """Return a serialized RXM-RAWX frame with numMeas random measurements."""
+    payload = bytes(rnd.getrandbits(8) for _ in range(16 + 32 * numMeas))
+    return UBXMessage.make(UBX.RXM._class, UBX.RXM.RAWX._id, payload)
+
+
+def NAVSATFrame(numSvs, rnd=random):
+    """Return a serialized NAV-SAT frame with numSvs random satellites."""
+    payload = bytes(rnd.getrandbits(8) for _ in range(8 + 12 * numSvs))
+    return UBXMessage.make(UBX.NAV._class, UBX.NAV.SAT._id, payload)
+
+
+def mkStream(epochs=100, numMeas=32, seed=0):
+    """Return a byte stream resembling a RAWX + NAV-SAT + NMEA capture."""
+    rnd = random.Random(seed)
+    gga = NMEASentence(
+        "GPGGA,092750.000,5321.6802,N,00630.3372,W,1,8,1.03,61.7,M,55.2,M,,"
+    )
+    return b''.join(
+        RAWXFrame(numMeas, rnd) + NAVSATFrame(numMeas, rnd) + gga
+        for _ in range(epochs)
+    )
+
+
+def noisyStream(epochs=100, rate=0.2, seed=0):
+    """Return (data, intact) for a mkStream-like stream with injected noise.
+
+    A fraction rate of the messages is damaged by a flipped bit, a
+    truncation or a corrupted UBX length field, or is preceded by a burst
+    of garbage that may contain a fake UBX header. intact lists the
+    messages that are still complete as the framer reports them:
+    (msgClass, msgId, payload) for UBX frames and a str for NMEA.
+    """
+    rnd = random.Random(seed)
+    gga = NMEASentence(
+        "GPGGA,092750.000,5321.6802,N,00630.3372,W,1,8,1.03,61.7,M,55.2,M,,"
+    )
+    chunks, intact = [], []
+    for _ in range(epochs):
+        for msg in [RAWXFrame(32, rnd), NAVSATFrame(32, rnd), gga]:
+            noise = rnd.randrange(4) if rnd.random() < rate else None
+            if noise == 0 or (noise == 2 and msg[0] == ord('$')):
+                msg = bytearray(msg)
+                msg[rnd.randrange(len(msg) - 2)] ^= 1 << rnd.randrange(8)
+            elif noise == 1:
+                msg = msg[:rnd.randrange(1, len(msg) - 2)]
+            elif noise == 2:
+                msg = msg[:4] + bytes([rnd.getrandbits(8), rnd.getrandbits(8)]) \
+                    + msg[6:]
+            else:
+                if noise == 3:
+                    chunks.append(bytes(
+                        rnd.getrandbits(8) for _ in range(rnd.randrange(64))
+                    ))
+                    if rnd.random() < 0.5:
+                        chunks.append(b'\xb5\x62' + bytes(
+                            rnd.getrandbits(8) for _ in range(4)
+                        ))
+                if msg[0] == ord('$'):
+                    intact.append(msg[1:-5].decode('ascii'))
+                else:
+                    intact.append((msg[2], msg[3], msg[6:-2]))
+            chunks.append(bytes(msg))
+    return b''.join(chunks), intact
+
+
+def countRecovered(intact, received):
+    """Return how many of the intact messages are in received, in order."""
+    n = 0
+    received = iter(received)
+    for msg in intact:
+        for r in received:
+            if r == msg:
+                n += 1
+                break
+    return n
+
+
+class StreamSerial:
+    """Serial stand-in that serves a byte string and then stops manager."""
+
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.manager = None
+
+    @property
+    def in_waiting(self):
+        return len(self.data) - self.pos
+
+    def read(self, n=1):
+        chunk = self.data[self.pos:self.pos+n]
+        self.pos += n
+        if self.pos >= len(self.data):
+            self.manager.shutdown()
+        return chunk
+
+
+class CountingManager(UBXManager):
+    """UBXManager that counts messages instead of parsing them."""
+
+    def __init__(self, ser, **kwargs):
+        UBXManager.__init__(self, ser, **kwargs)
+        ser.manager = self
+        self.nUBX = self.nNMEA = self.nErr = 0
+
+    def _onUBX(self, msgClass, msgId, buffer):
+        self.nUBX += 1
+
+    def _onUBXError(self, msgClass, msgId, errMsg):
+        self.nErr += 1
+
+    def _onNMEA(self, buffer):
+        self.nNMEA += 1
+
+    def _onNMEAError(self, errMsg):
+        self.nErr += 1
+
+
+@benchmark("framer")
+def benchFramer():
+    """Compare the chunked framer with the bytewise state machine."""
+    data = mkStream()
+    print("framer: {} bytes RAWX(32) + NAV-SAT(32) + GGA".format(len(data)))
+    for label, kwargs in [
+            ("bytewise", dict(chunked=False)),
+            ("chunked 4096", dict(chunkSize=4096)),
+            ("chunked 64", dict(chunkSize=64)),
+            ]:
+        def run():
+            manager = CountingManager(StreamSerial(data), **kwargs)
+            manager.run()
+            assert manager.nUBX == 200 and manager.nNMEA == 100, label
+        t = timeit(run)
+        print("  {:14} {:8.2f} MB/s".format(label, len(data) / t / 1e6))
+
+
+@benchmark("assembly")
+def benchAssembly():
+    """Show that frame assembly cost per byte doesn't grow with frame size."""
+    print("assembly: ns per payload byte by frame size")
+    print("  {:>6} {:>10} {:>10}".format("size", "bytewise", "chunked"))
+    for size in [64, 256, 1024, 4096, 16384, 32000]:
+        frame = UBXMessage.make(UBX.RXM._class, UBX.RXM.RAWX._id, bytes(size))
+        nFrames = max(1, 65536 // len(frame))
+        data = frame * nFrames + b'\r'    # the state machine needs one more
+        times = []
+        for kwargs in [dict(chunked=False), dict(chunkSize=256)]:
+            def run():
+                manager = CountingManager(StreamSerial(data), **kwargs)
+                manager.run()
+                assert manager.nUBX == nFrames
+            times.append(timeit(run) / (nFrames * size) * 1e9)
+        print("  {:>6} {:>10.0f} {:>10.0f}".format(size, *times))
+
+
+class CollectingManager(CountingManager):
+    """UBXManager that collects the messages without parsing them."""
+
+    def __init__(self, ser, **kwargs):
+        CountingManager.__init__(self, ser, **kwargs)
+        self.received = []
+
+    def _onUBX(self, msgClass, msgId, buffer):
+        self.received.append((msgClass, msgId, bytes(buffer)))
+
+    def _onNMEA(self, buffer):
+        self.received.append(buffer)
+
+
+@benchmark("resync")
+def benchResync():
+    """Measure recovery of intact messages from a noisy stream."""
+    print("resync: % intact messages recovered, MB/s by noise rate")
+    print("  {:>5} {:>18} {:>18}".format("rate", "bytewise", "chunked"))
+    for rate in [0, 0.01, 0.1, 0.3]:
+        data, intact = noisyStream(rate=rate)
+        data += b'\r'     # the state machine needs one more
+        results = []
+        for kwargs in [dict(chunked=False), dict(chunkSize=4096)]:
+            def run():
+                manager = CollectingManager(StreamSerial(data), **kwargs)
+                manager.run()
+                return manager.received
+            recovered = countRecovered(intact, run())
+            t = timeit(run)
+            results += [100.0 * recovered / len(intact), len(data) / t / 1e6]
+        print("  {:>5} {:>7.1f}% {:6.2f} MB/s {:>7.1f}% {:6.2f} MB/s".format(
+            rate, *results))
+
+
+class QuietManager(UBXManager):
+    """UBXManager that parses messages but doesn't print them."""
+
+    def __init__(self, ser, **kwargs):
+        UBXManager.__init__(self, ser, **kwargs)
+        ser.manager = self
+
+    def onUBX(self, obj):
+        pass
+
+    def onNMEA(self, buffer):
+        pass
+
+
+@benchmark("subscribe")
+def benchSubscribe():
+    """Compare parsing everything with a subscription to one message."""
+    data = mkStream()
+    print("subscribe: {} bytes RAWX(32) + NAV-SAT(32) + GGA".format(len(data)))
+    for label, kwargs, msgType in [
+            ("dispatch all", {}, None),
+            ("NAV-SAT only", dict(dispatchAll=False), UBX.NAV.SAT),
+            ("none", dict(dispatchAll=False), None),
+            ]:
+        def run():
+            manager = QuietManager(StreamSerial(data), **kwargs)
+            if msgType is not None:
+                manager.subscribe(msgType, lambda obj: None)
+            manager.run()
+        t = timeit(run)
+        print("  {:14} {:8.2f} MB/s".format(label, len(data) / t / 1e6))
+
+
+@benchmark("hub")
+def benchHub():
+    """Measure one UBXHub thread reading many ptys."""
+    import os
+    import threading
+    import tty
+    from UBXHub import UBXHub
+    data = mkStream()
+    print("hub: {} bytes per device, RAWX(32) + NAV-SAT(32) + GGA".format(
+        len(data)))
+
+    class Hub(UBXHub):
+        def onUBX(self, obj):
+            self.n += 1
+
+        def onNMEA(self, buffer):
+            pass
+
+    for nDevices in [1, 4, 16]:
+        ptys = [os.openpty() for _ in range(nDevices)]
+        hub = Hub()
+        hub.n = 0
+        for master, slave in ptys:
+            tty.setraw(slave)
+            hub.add(slave)
+        hub.start()
+        threads = threading.active_count()
+        t0 = perf_counter()
+        for i in range(0, len(data), 1024):
+            for master, slave in ptys:
+                os.write(master, data[i:i+1024])
+        while hub.n < 200 * nDevices:
+            sleep(0.001)
+        t = perf_counter() - t0
+        hub.shutdown()
+        hub.join()
+        for master, slave in ptys:
+            os.close(master)
+            os.close(slave)
+        print("  {:2} devices {:8.2f} MB/s, {} threads".format(
+            nDevices, nDevices * len(data) / t / 1e6, threads))
+
+
+@benchmark("checksum")
+def benchChecksum():
+    """Compare bytewise Checksum.update with the batch Checksum.compute."""
+    print("checksum: ns per byte")
+    print("  {:>6} {:>10} {:>10}".format("size", "update", "compute"))
+    for size in [16, 256, 4096]:
+        data = bytes(random.getrandbits(8) for _ in range(size))
+
+        def bytewise():
+            chksum = UBXMessage.Checksum()
+            for i in data:
+                chksum.update(bytes([i]))
+            return chksum.get()
+
+        def batch():
+            return UBXMessage.Checksum.compute(data)
+
+        assert bytewise() == batch()
+        times = [timeit(f, 0.2) / size * 1e9 for f in [bytewise, batch]]
+        print("  {:>6} {:>10.1f} {:>10.1f}".format(size, *times))
+
+
+@benchmark("parse")
+def benchParse():
+    """Compare compiled-layout parsing with a field-by-field parse loop."""
+    rnd = random.Random(0)
+    print("parse: us per message")
+    print("  {:>11} {:>10} {:>10} {:>10}".format(
+        "message", "per-field", "layout", "lazy"))
+    for label, Cls, size, fields in [
+            ("RAWX(32)", UBX.RXM.RAWX, 16 + 32 * 32,
+                ['rcvrTow', 'prMeas_1', 'cno_1']),
+            ("NAV-SAT(32)", UBX.NAV.SAT, 8 + 12 * 32,
+                ['iTOW', 'elev_1', 'azim_1']),
+            ("NAV-PVT", UBX.NAV.PVT, 92, ['iTOW', 'lat', 'lon']),
+            ]:
+        payload = bytes(rnd.getrandbits(8) for _ in range(size))
+
+        def perField():
+            varNames, varTypes = Cls._layout.namesAndTypes(len(payload))
+            msg = payload
+            for varType in varTypes:
+                val, msg = varType.parse(msg)
+
+        def layout():
+            Cls(payload)
+
+        def lazy():
+            obj = Cls(payload, lazy=True)
+            for field in fields:
+                getattr(obj, field)
+
+        times = [timeit(f, 0.2) * 1e6 for f in [perField, layout, lazy]]
+        print("  {:>11} {:>10.1f} {:>10.1f} {:>10.1f}".format(label, *times))
+
+
+@benchmark("columns")
+def benchColumns():
+    """Compare per-message objects with the columnar batch decoder."""
+    from UBXColumns import decodeColumns
+    rnd = random.Random(0)
+    payload = bytes(rnd.getrandbits(8) for _ in range(16 + 32 * 32))
+    payloads = [payload] * 2000
+    print("columns: 2000 x RAWX(32), us per message")
+
+    def objects():
+        for p in payloads:
+            UBX.RXM.RAWX(p).repeatedArray()
+
+    def columns():
+        decodeColumns(UBX.RXM._class, UBX.RXM.RAWX._id, payloads)
+
+    for label, f in [("objects", objects), ("columns", columns)]:
+        print("  {:10} {:8.2f}".format(label, timeit(f) / 2000 * 1e6))
+
+
+@benchmark("logreader")
+def benchLogReader():
+    """Measure the capture file reader throughput."""
+    import os
+    import tempfile
+    from UBXLogReader import UBXLogReader
+    data = mkStream(epochs=2000)
+    fd, filename = tempfile.mkstemp()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    print("logreader: {} bytes RAWX(32) + NAV-SAT(32) + GGA".format(len(data)))
+    try:
+        for label, kwargs in [
+                ("all", {}),
+                ("RAWX only", dict(msgTypes=[UBX.RXM.RAWX], nmea=False)),
+                ]:
+            def run():
+                with UBXLogReader(filename, **kwargs) as reader:
+                    for item in reader:
+                        pass
+                    assert reader.stats['ubx'] == 4000, label
+            t = timeit(run)
+            print("  {:14} {:8.2f} MB/s".format(label, len(data) / t / 1e6))
+    finally:
+        os.remove(filename)
+
+
+@benchmark("capture")
+def benchCapture():
+    """Compare a write and flush per read with the buffered UBXCapture."""
+    import os
+    import tempfile
+    from UBXCapture import UBXCapture
+    data = mkStream()[:32768]
+    print("capture: ns per byte by read size, writing included")
+    print("  {:>6} {:>14} {:>14} {:>14}".format(
+        "size", "flush per read", "UBXCapture", "UBXCapture gz"))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "UBX.log")
+
+        def flushEach(reads):
+            with open(path, "wb") as f:
+                for chunk in reads:
+                    f.write(chunk)
+                    f.flush()
+
+        def buffered(reads, **kwargs):
+            # the manager passes the time the framer has read already
+            capture = UBXCapture(path, **kwargs)
+            now = (0.0, 0.0)
+            for chunk in reads:
+                capture.write(chunk, now)
+            capture.close()
+
+        for size in [1, 64, 4096]:
+            reads = [data[i:i+size] for i in range(0, len(data), size)]
+            times = [timeit(lambda: f(reads, **kwargs)) / len(data) * 1e9
+                     for f, kwargs in [(flushEach, {}), (buffered, {}),
+                                       (buffered, dict(compress='gz'))]]
+            print("  {:6} {:14.1f} {:14.1f} {:14.1f}".format(size, *times))
+
+
+def rcvrTow(obj):
+    """Reduce a parsed message to its receiver time of week, if any."""
+    return getattr(obj, 'rcvrTow', None)
+
+
+@benchmark("parallel")
+def benchParallel():
+    """Measure the multi-process decoder by number of workers."""
+    import os
+    import tempfile
+    from UBXParallel import UBXParallelDecoder
+    data = mkStream(epochs=4000)
+    fd, filename = tempfile.mkstemp()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    print("parallel: {} bytes RAWX(32) + NAV-SAT(32) + GGA, {} cpus".format(
+        len(data), os.cpu_count()))
+    try:
+        for workers in [1, 2, 4, 8]:
+            def run():
+                decoder = UBXParallelDecoder(
+                    filename, func=rcvrTow, chunkSize=1 << 20,
+                    workers=workers
+                )
+                assert sum(1 for _ in decoder) == 4000
+            t = timeit(run, 1.0)
+            print("  {:2} workers {:8.2f} MB/s".format(
+                workers, len(data) / t / 1e6))
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            sys.stderr.write(__doc__)
+            sys.stderr.write("Available: {}\n".format(", ".join(BENCHMARKS)))
+            sys.exit(1)
+        BENCHMARKS[name]()
@@ -103,7 +103,7 @@ struct CFG::PRT : public Message
     uint8_t reserved1;
     uint16_t txReady;
     uint32_t mode;
-    uint32_t reserved2;
+    uint32_t baudRate;
     uint16_t inProtoMask;
     uint16_t outProtoMask;
     uint16_t flags;
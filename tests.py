@@ -2,8 +2,35 @@
 """Unit tests."""
 
 import unittest
+import asyncio
+import importlib.util
+import os
+import tempfile
+import gzip
+import random
+import struct
+import threading
+import tty
+import termios
+import fcntl
+import select
+import queue
+from itertools import chain
 import UBX
-from UBXMessage import parseUBXPayload, parseUBXMessage
+import Types
+from UBXMessage import UBXMessage, parseUBXPayload, parseUBXMessage
+from UBXMessage import classFromMessageClass, lookupMessage
+from UBXManager import UBXManager
+from AsyncUBXManager import AsyncUBXManager
+from UBXHub import UBXHub
+from UBXFramer import UBXFramer
+from UBXLogReader import UBXLogReader
+from UBXCapture import UBXCapture, readTimestamps
+from UBXLogIndex import UBXLogIndex, WEEK_MS
+from UBXParallel import UBXParallelDecoder, chunkBoundaries
+from UBXProfile import Profile, ConfigCache, formatReport
+from UBXBaudrate import BAUDRATES, detectBaudrate, changeBaudrate
+from UBXBudget import Budget, Meter
 
 
 class TestStringMethods(unittest.TestCase):
@@ -18,6 +45,35 @@ class TestStringMethods(unittest.TestCase):
         self.assertEqual(UBX.MON.VER._class, 0x0A)
         self.assertEqual(UBX.MON.VER._id, 0x04)
 
+    def testRegistry(self):
+        self.assertIs(lookupMessage(0x05, 0x01), UBX.ACK.ACK)
+        self.assertIs(lookupMessage(0x02, 0x15), UBX.RXM.RAWX)
+        self.assertIsNone(lookupMessage(0x05, 0x42))
+        self.assertIs(classFromMessageClass()[0x0A], UBX.MON)
+        with self.assertRaisesRegex(Exception, "message class 66"):
+            parseUBXPayload(0x42, 0x01, b'')
+        with self.assertRaisesRegex(Exception, "message ID 66 of message class ACK"):
+            parseUBXPayload(0x05, 0x42, b'')
+
+    def testTP5(self):
+        # CFG-TP5 and CFG-TP5_GET share an ID, the payload length decides
+        from UBXMessage import expectedResponse
+        self.assertIs(lookupMessage(0x06, 0x31), UBX.CFG.TP5)
+        poll = UBXMessage.make(0x06, 0x31, b'\x01')
+        self.assertEqual(expectedResponse(0x06, 0x31, 1), (0x06, 0x31))
+        get = parseUBXMessage(poll)
+        self.assertIsInstance(get, UBX.CFG.TP5_GET)
+        self.assertEqual(get.tpIdx, 1)
+        self.assertEqual(get.serialize(), poll)
+        payload = struct.pack('<BBHhhIIIIiI', 1, 1, 0, 50, 0, 1, 1,
+                              100000, 100000, 0, 0x77)
+        reply = parseUBXMessage(UBXMessage.make(0x06, 0x31, payload))
+        self.assertIsInstance(reply, UBX.CFG.TP5)
+        self.assertEqual((reply.tpIdx, reply.antCableDelay, reply.flags),
+                         (1, 50, 0x77))
+        self.assertEqual(reply.serialize(),
+                         UBXMessage.make(0x06, 0x31, payload))
+
     def testRXM(self):
         rxm = UBX.CFG.RXM(b'\x48\x00')
         self.assertEqual(rxm.reserved1, 0x48)
@@ -37,6 +93,51 @@ class TestStringMethods(unittest.TestCase):
         self.assertEqual(ver.extension_2, "PROTVER=18.00")
         self.assertEqual(ver.extension_3, "GPS;GLO;GAL;BDS")
         self.assertEqual(ver.extension_4, "SBAS;IMES;QZSS")
+        ver2 = parseUBXMessage(ver.serialize())
+        self.assertEqual(ver2.swVersion, ver.swVersion)
+        self.assertEqual(ver2.extension_4, ver.extension_4)
+
+    def testRXM_RAWX(self):
+        once = struct.pack('<dHbBBBBB', 1.5, 2000, 18, 2, 0, 1, 0, 0)
+        meas = [
+            struct.pack('<ddfBBBBHBBBBBB', 1e7 + i, 2e7 + i, -0.5, 0, i + 1,
+                        0, 0, 100, 40 + i, 1, 2, 3, 7, 0)
+            for i in range(2)
+        ]
+        rawx = parseUBXPayload(UBX.RXM._class, UBX.RXM.RAWX._id,
+                               once + b''.join(meas))
+        self.assertEqual(rawx.rcvrTow, 1.5)
+        self.assertEqual(rawx.numMeas, 2)
+        self.assertEqual(rawx.prMeas_1, 1e7)
+        self.assertEqual(rawx.cpMeas_2, 2e7 + 1)
+        self.assertEqual(rawx.svId_2, 2)
+        self.assertEqual(rawx.cno_2, 41)
+        self.assertFalse(hasattr(rawx, 'prMeas_3'))
+        self.assertEqual(parseUBXMessage(rawx.serialize()).trkStat_2, 7)
+        with self.assertRaisesRegex(Exception, "does not match"):
+            UBX.RXM.RAWX(once + meas[0][:-1])
+
+    def testLazy(self):
+        payload = b'\x00\x20\x20\x07\x00\x08\x10\x00\x01\x00\x01\x01\x01\x01\x03\x00\x01\x00\x01\x01\x02\x04\x08\x00\x00\x00\x01\x01\x03\x08\x10\x00\x00\x00\x01\x01\x04\x00\x08\x00\x00\x00\x01\x03\x05\x00\x03\x00\x01\x00\x01\x05\x06\x08\x0e\x00\x01\x00\x01\x01'
+        eager = parseUBXPayload(UBX.CFG._class, UBX.CFG.GNSS._id, payload)
+        lazy = parseUBXPayload(UBX.CFG._class, UBX.CFG.GNSS._id, payload,
+                               lazy=True)
+        self.assertNotIn('numConfigBlocks', lazy.__dict__)
+        self.assertEqual(lazy.numConfigBlocks, 0x07)
+        self.assertIn('numConfigBlocks', lazy.__dict__)
+        self.assertNotIn('maxTrkCh_7', lazy.__dict__)
+        self.assertEqual(lazy.maxTrkCh_7, 0x0E)
+        self.assertFalse(hasattr(lazy, 'maxTrkCh_8'))
+        lazy.msgVer = 1
+        eager.msgVer = 1
+        self.assertEqual(lazy.to_dict(), eager.to_dict())
+        self.assertEqual(str(lazy), str(eager))
+        self.assertEqual(lazy.serialize(), eager.serialize())
+        with self.assertRaisesRegex(Exception, "does not match"):
+            UBX.CFG.GNSS(payload[:-1], lazy=True)
+        ver = UBX.MON.VER(b'ab' + bytes(68), lazy=True)
+        self.assertEqual(ver.swVersion, "ab")
+        self.assertEqual(ver.extension_1, "")
 
     def testCFG_GNSS(self):
         payload = b'\x00\x20\x20\x07\x00\x08\x10\x00\x01\x00\x01\x01\x01\x01\x03\x00\x01\x00\x01\x01\x02\x04\x08\x00\x00\x00\x01\x01\x03\x08\x10\x00\x00\x00\x01\x01\x04\x00\x08\x00\x00\x00\x01\x03\x05\x00\x03\x00\x01\x00\x01\x05\x06\x08\x0e\x00\x01\x00\x01\x01'
@@ -48,5 +149,1229 @@ class TestStringMethods(unittest.TestCase):
         self.assertEqual(gnss.maxTrkCh_7, 0x0E)
 
 
+haveNumpy = importlib.util.find_spec('numpy') is not None
+
+
+@unittest.skipUnless(haveNumpy, "numpy is not installed")
+class TestNumpy(unittest.TestCase):
+
+    def testRepeatedArray(self):
+        rnd = random.Random(3)
+        payload = bytes(rnd.getrandbits(8) for _ in range(16 + 32 * 5))
+        rawx = UBX.RXM.RAWX(payload)
+        blocks = rawx.repeatedArray()
+        self.assertEqual(blocks.dtype.itemsize, 32)
+        self.assertEqual(len(blocks), 5)
+        for i in range(5):
+            for field in ['prMeas', 'cpMeas', 'doMes', 'svId', 'lockTime']:
+                self.assertEqual(
+                    blocks[field][i].item(), getattr(rawx, field + '_' + str(i+1))
+                )
+        with self.assertRaisesRegex(Exception, "no repeated block"):
+            UBX.NAV.PVT(bytes(92)).repeatedArray()
+
+    def testColumns(self):
+        from UBXColumns import decodeColumns, iterColumns
+        rnd = random.Random(4)
+        payloads = [
+            bytes(rnd.getrandbits(8) for _ in range(8 + 12 * n))
+            for n in [3, 0, 1, 5]
+        ]
+        objs = [UBX.NAV.SAT(p) for p in payloads]
+        once, repeated = decodeColumns(UBX.NAV._class, UBX.NAV.SAT._id,
+                                       [memoryview(p) for p in payloads])
+        self.assertEqual(once['iTOW'].tolist(), [o.iTOW for o in objs])
+        self.assertEqual(repeated['parent'].tolist(), [0, 0, 0, 2, 3, 3, 3, 3, 3])
+        self.assertEqual(
+            repeated['azim'].tolist(),
+            [getattr(o, 'azim_' + str(i+1))
+             for o in objs for i in range(o._len // 12)]
+        )
+        batches = list(iterColumns(UBX.NAV._class, UBX.NAV.SAT._id,
+                                   payloads, batchSize=3))
+        self.assertEqual(len(batches), 2)
+        self.assertEqual(batches[1][1]['parent'].tolist(), [3] * 5)
+        once, repeated = decodeColumns(UBX.NAV._class, UBX.NAV.PVT._id,
+                                       [bytes(92)] * 2)
+        self.assertIsNone(repeated)
+        self.assertEqual(once['lat'].tolist(), [0, 0])
+        with self.assertRaisesRegex(Exception, "Payload 1 has length 91"):
+            decodeColumns(UBX.NAV._class, UBX.NAV.PVT._id, [bytes(92), bytes(91)])
+
+
+class TestTypes(unittest.TestCase):
+
+    def testParseFromPackInto(self):
+        fields = [
+            (Types.U1(1), 0xfe), (Types.I1(2), -3), (Types.X1(3), 0x81),
+            (Types.U2(4), 0xbeef), (Types.I2(5), -300), (Types.X2(6), 0x8001),
+            (Types.U4(7), 0xdeadbeef), (Types.I4(8), -70000),
+            (Types.X4(9), 0x80000001), (Types.R4(10), 1.5),
+            (Types.R8(11), -2.25), (Types.CH(12, 4), b'ab\x00c'),
+            (Types.CH(13, 6, nullTerminatedString=True), "abc"),
+            (Types.U(14, 3), b'\x01\x02\x03'),
+        ]
+        size = sum(typ._size for typ, val in fields)
+        buffer = bytearray(size + 1)
+        offset = 1
+        for typ, val in fields:
+            offset = typ.pack_into(buffer, offset, val)
+        self.assertEqual(offset, size + 1)
+        self.assertEqual(
+            bytes(buffer[1:]),
+            b''.join(typ.serialize(val) for typ, val in fields)
+        )
+        view = memoryview(bytes(buffer))
+        offset = 1
+        for typ, val in fields:
+            parsed, offset = typ.parse_from(view, offset)
+            self.assertEqual(parsed, val)
+            self.assertEqual(typ.parse(view[offset-typ._size:].tobytes())[0], val)
+        self.assertEqual(offset, size + 1)
+
+    def testCHSerialize(self):
+        ch = Types.CH(1, 6, nullTerminatedString=True)
+        self.assertEqual(ch.serialize("abc"), b'abc\x00\x00\x00')
+        with self.assertRaises(Exception):
+            ch.serialize("abcdef")
+        with self.assertRaises(Exception):
+            Types.CH(1, 6).serialize(b'abc')
+
+
+class TestChecksum(unittest.TestCase):
+
+    @staticmethod
+    def bytewise(msg):
+        chksum = UBXMessage.Checksum()
+        for i in msg:
+            chksum.update(bytes([i]))
+        return chksum.get()
+
+    def testCompute(self):
+        rnd = random.Random(1)
+        for n in [0, 1, 2, 255, 256, 257, 5000]:
+            msg = bytes(rnd.getrandbits(8) for _ in range(n))
+            self.assertEqual(UBXMessage.Checksum.compute(msg), self.bytewise(msg))
+            self.assertEqual(UBXMessage.Checksum(msg).get(), self.bytewise(msg))
+            self.assertEqual(
+                UBXMessage.Checksum.compute(bytearray(b'xx' + msg + b'y'), 2, n+2),
+                self.bytewise(msg)
+            )
+
+    def testUpdateBytes(self):
+        rnd = random.Random(2)
+        msg = bytes(rnd.getrandbits(8) for _ in range(3000))
+        chksum = UBXMessage.Checksum()
+        view = memoryview(msg)
+        for i in range(0, len(msg), 77):
+            chksum.update_bytes(view[i:i+77])
+        self.assertEqual(chksum.get(), self.bytewise(msg))
+
+
+class RecordingManager(UBXManager):
+    """UBXManager that records all handler calls, reading from a bytestring."""
+
+    class Serial:
+        def __init__(self, data, manager):
+            self.data, self.pos, self.manager = data, 0, manager
+            self.reads = []     # lengths of the chunks read
+        @property
+        def in_waiting(self):
+            return len(self.data) - self.pos
+        def read(self, n=1):
+            chunk = self.data[self.pos:self.pos+n]
+            self.pos += n
+            self.reads.append(len(chunk))
+            if self.pos >= len(self.data):
+                self.manager.shutdown()
+            return chunk
+
+    def __init__(self, data, **kwargs):
+        UBXManager.__init__(self, None, **kwargs)
+        self.ser = RecordingManager.Serial(data, self)
+        self.calls = []
+    def _onUBX(self, msgClass, msgId, buffer):
+        self.calls.append(('UBX', msgClass, msgId, bytes(buffer)))
+    def _onUBXError(self, msgClass, msgId, errMsg):
+        self.calls.append(('UBXError', msgClass, msgId))
+    def _onNMEA(self, buffer):
+        self.calls.append(('NMEA', buffer))
+    def _onNMEAError(self, errMsg):
+        self.calls.append(('NMEAError',))
+
+
+class TestFramer(unittest.TestCase):
+
+    stream = (
+        b'garbage\xb5\x00' +
+        UBX.MON.VER.Get().serialize() +
+        b'$GPTXT,01,01,02,ANTSTATUS=OK*3B\r\n' +
+        UBXMessage.make(0x06, 0x11, b'\x48\x00') +
+        b'$GPTXT,01,01,02,ANTSTATUS=OK*00\r\n' +         # bad checksum
+        UBXMessage.make(0x05, 0x01, b'\x06\x11')[:-1] + b'\x00' +  # bad
+        UBXMessage.make(0x05, 0x01, b'\x06\x08') +
+        b'$GPTXT'
+    )
+
+    def testSameAsStateMachine(self):
+        bytewise = RecordingManager(self.stream, chunked=False)
+        bytewise.run()
+        self.assertEqual(len(bytewise.calls), 6)
+        for chunkSize in [1, 2, 3, 7, 64, 4096]:
+            chunked = RecordingManager(self.stream, chunkSize=chunkSize)
+            chunked.run()
+            self.assertEqual(chunked.calls, bytewise.calls)
+            reads = chunked.ser.reads
+            self.assertEqual(reads[:-1], [chunkSize] * (len(reads) - 1))
+            self.assertEqual(sum(reads), len(self.stream))
+
+    def testLargeFrame(self):
+        payload = bytes(range(256)) * 20
+        # the state machine only delivers a frame on the byte after it
+        data = UBXMessage.make(0x02, 0x15, payload) + b'\r'
+        for kwargs in [dict(chunked=False), dict(chunkSize=100)]:
+            manager = RecordingManager(data, **kwargs)
+            manager.run()
+            self.assertEqual(manager.calls, [('UBX', 0x02, 0x15, payload)])
+        self.assertEqual(manager.ser.reads[0], 100)
+
+    def testIncomplete(self):
+        calls = []
+        framer = UBXFramer(
+            lambda c, i, p: calls.append((c, i, p)), None, None, None
+        )
+        msg = UBXMessage.make(0x06, 0x11, b'\x48\x00')
+        framer.feed(msg[:5])
+        self.assertEqual(calls, [])
+        framer.feed(msg[5:])
+        self.assertEqual(calls, [(0x06, 0x11, b'\x48\x00')])
+        self.assertEqual(len(framer.buffer), 0)
+
+    def testDoubledSyncChar(self):
+        # the state machine loses this frame, the framer doesn't
+        calls = []
+        framer = UBXFramer(
+            lambda c, i, p: calls.append((c, i, p)), None, None, None
+        )
+        framer.feed(b'\xb5' + UBXMessage.make(0x05, 0x01, b'\x06\x08'))
+        self.assertEqual(calls, [(0x05, 0x01, b'\x06\x08')])
+
+    def testResync(self):
+        # a bad checksum or an implausible length must not hide good frames
+        good = UBXMessage.make(0x05, 0x01, b'\x06\x08')
+        for data in [
+                good[:-1] + good,                       # truncated
+                b'\xb5\x62\x05\x01\x10\x00' + good,     # false sync
+                b'\xb5\x62\x05\x01\x00\x10' + good,     # too long for ACK
+                b'\xb5\x62\x42\x00\x00\x10' + good,     # no class 0x42
+                b'$GPTXT,01' + good,                    # cut off NMEA
+                ]:
+            calls = []
+            framer = UBXFramer(
+                lambda c, i, p: calls.append((c, i, p)),
+                lambda c, i, e: None, None, None
+            )
+            framer.feed(data)
+            self.assertEqual(calls, [(0x05, 0x01, b'\x06\x08')])
+
+    def testLongerThanDefined(self):
+        from UBXMessage import maxPayloadLength
+        self.assertEqual(maxPayloadLength(0x06, 0x31), 32)   # TP5, TP5_GET
+        frames = [(0x06, 0x31, bytes(range(32))),    # CFG-TP5
+                  (0x01, 0x07, bytes(100)),          # NAV-PVT of 92 bytes
+                  (0x29, 0x00, b'\x01\x02\x03\x04')]  # unknown class
+        calls, errors = [], []
+        framer = UBXFramer(
+            lambda c, i, p: calls.append((c, i, p)),
+            lambda c, i, e: errors.append((c, i, e)), None, None
+        )
+        framer.feed(b''.join(UBXMessage.make(*f) for f in frames))
+        self.assertEqual(calls, frames[:1])
+        self.assertEqual(errors, [
+            (0x01, 0x07, "Incorrect Length: 100 exceeds 92"),
+            (0x29, 0x00, "Unknown message class"),
+        ])
+
+    def testChunking(self):
+        pvt = UBXMessage.make(0x01, 0x07, bytes(92))
+        data = b''.join([
+            UBXMessage.make(0x01, 0x07, bytes(100))[:50],   # cut off, too long
+            pvt,
+            b'$GPGGA,1*4B\r\n',
+            UBXMessage.make(0x29, 0x00, bytes(4)),           # unknown class
+            pvt[:40] + b'\x01' + pvt[41:],                  # bad checksum
+            pvt,
+            pvt[:30],                                       # incomplete
+        ])
+
+        def run(chunks):
+            calls = []
+            framer = UBXFramer(
+                lambda c, i, p: calls.append(('UBX', c, i, p)),
+                lambda c, i, e: calls.append(('UBXError', c, i, e)),
+                lambda s: calls.append(('NMEA', s)),
+                lambda e: calls.append(('NMEAError', e))
+            )
+            for chunk in chunks:
+                framer.feed(chunk)
+            return calls, framer.counts, framer.skippedBytes, framer.buffer
+
+        whole = run([data])
+        self.assertEqual([c[0] for c in whole[0]],
+                         ['UBXError', 'UBX', 'NMEA', 'UBXError', 'UBXError',
+                          'UBX'])
+        self.assertEqual(run(data[i:i+1] for i in range(len(data))), whole)
+
+    def testNoise(self):
+        from benchmark import noisyStream, countRecovered
+        data, intact = noisyStream(epochs=30, rate=0.3, seed=1)
+        received = []
+        framer = UBXFramer(
+            lambda c, i, p: received.append((c, i, p)),
+            lambda c, i, e: None, received.append, lambda e: None
+        )
+        # a false sync of an undefined message can claim up to 64 KiB
+        data += bytes(0x10000)
+        for i in range(0, len(data), 1000):
+            framer.feed(data[i:i+1000])
+        self.assertEqual(countRecovered(intact, received), len(intact))
+        self.assertEqual(len(received), len(intact))
+
+
+class TestSubscribe(unittest.TestCase):
+
+    class Manager(UBXManager):
+        def __init__(self, data, **kwargs):
+            UBXManager.__init__(self, None, **kwargs)
+            self.ser = RecordingManager.Serial(data + b'\r', self)
+            self.objs, self.frames = [], []
+        def _onUBX(self, msgClass, msgId, buffer):
+            self.frames.append((msgClass, msgId))
+            UBXManager._onUBX(self, msgClass, msgId, buffer)
+        def onUBX(self, obj):
+            self.objs.append(obj)
+        def onUBXError(self, msgClass, msgId, errMsg):
+            pass
+        def onNMEA(self, buffer):
+            pass
+        def onNMEAError(self, errMsg):
+            pass
+
+    def testSubscribe(self):
+        for chunked in [True, False]:
+            manager = self.Manager(TestFramer.stream, chunked=chunked,
+                                   dispatchAll=False)
+            acks, raw, big = [], [], []
+            manager.subscribe(UBX.ACK.ACK, acks.append)
+            manager.subscribe((0x06, 0x11),
+                              lambda c, i, p: raw.append((c, i, p)), raw=True)
+            sub = manager.subscribe(lambda c, i, n: n > 2, big.append)
+            manager.unsubscribe(sub)
+            manager.run()
+            self.assertEqual(manager.objs, [])
+            self.assertEqual(manager.frames, [(0x06, 0x11), (0x05, 0x01)])
+            self.assertEqual([(a.clsID, a.msgID) for a in acks], [(6, 8)])
+            self.assertEqual(raw, [(0x06, 0x11, b'\x48\x00')])
+            self.assertEqual(big, [])
+
+    def testDispatchAll(self):
+        manager = self.Manager(TestFramer.stream)
+        pvt, small = [], []
+        manager.subscribe(UBX.NAV.PVT, pvt.append)
+        manager.subscribe(lambda c, i, n: n <= 2, small.append)
+        manager.run()
+        # the MON-VER poll doesn't parse as MON-VER
+        self.assertEqual(len(manager.objs), 2)
+        self.assertEqual(pvt, [])
+        self.assertEqual([type(obj) for obj in small],
+                         [UBX.CFG.RXM, UBX.ACK.ACK])
+
+    def testStats(self):
+        for chunkSize in [1, 5, 4096]:
+            manager = self.Manager(TestFramer.stream, chunkSize=chunkSize,
+                                   statsInterval=0)
+            reports = []
+            manager.onStats = reports.append
+            manager.run()
+            stats = manager.stats(reset=True)
+            self.assertEqual(reports[-1]['ubx'], stats['ubx'])
+            self.assertEqual(stats['ubx'], {
+                (0x0A, 0x04): dict(frames=1, bytes=8, checksumErrors=0,
+                                   parseErrors=1),
+                (0x06, 0x11): dict(frames=1, bytes=10, checksumErrors=0,
+                                   parseErrors=0),
+                (0x05, 0x01): dict(frames=1, bytes=10, checksumErrors=1,
+                                   parseErrors=0),
+            })
+            self.assertEqual(stats['nmea'],
+                             dict(frames=1, bytes=33, checksumErrors=1))
+            # garbage, then the bad sentence and the bad frame at once
+            self.assertEqual((stats['syncLosses'], stats['skippedBytes']),
+                             (2, 9 + 33 + 10))
+            self.assertEqual(manager.stats()['ubx'], {})
+
+    def testArrival(self):
+        msg = UBXMessage.make(0x05, 0x01, b'\x06\x08')
+        # 1000 s between wall clock and monotonic time
+        for byteTime, first, second in [(0.01, 9.96, 10.98),
+                                        (None, 10.0, 10.75)]:
+            times = iter([(10.0, 1010.0), (11.0, 1011.0), (11.5, 1011.5)])
+            calls = []
+            framer = UBXFramer(
+                lambda c, i, p: calls.append(
+                    framer.arrival + framer.completed
+                ), None, None, None, clock=lambda: next(times)
+            )
+            framer.byteTime = byteTime
+            framer.feed(b'xx' + msg[:5])
+            framer.feed(msg[5:] + msg[:3])
+            framer.feed(msg[3:])
+            for call, expected in zip(calls, [
+                    (first, first + 1000, 11.0, 1011.0),
+                    (second, second + 1000, 11.5, 1011.5)]):
+                for t, e in zip(call, expected):
+                    self.assertAlmostEqual(t, e)
+        manager = self.Manager(TestFramer.stream, chunkSize=5)
+        manager.nmea = []
+        manager.onNMEA = manager.nmea.append
+        manager.run()
+        self.assertEqual(manager.nmea, ['GPTXT,01,01,02,ANTSTATUS=OK'])
+        self.assertEqual(len(manager.nmea[0].arrival), 2)
+        self.assertLessEqual(manager.nmea[0].arrival[0],
+                             manager.objs[0].arrival[0])
+
+    def testCaptureTimestamps(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                self.Manager(TestFramer.stream, debug=True).run()
+                with open("UBX.log", "rb") as f:
+                    log = f.read()
+                records = readTimestamps("UBX.log")
+            finally:
+                os.chdir(cwd)
+        self.assertEqual(log, TestFramer.stream + b'\r')
+        # all in one read
+        self.assertEqual(records, [(len(log),) + records[0][1:]])
+        self.assertEqual(sorted(records), records)
+
+    def testCaptureOnError(self):
+        def fail(sentence):
+            raise RuntimeError("handler failed")
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "UBX.log")
+            capture = UBXCapture(path, flushSeconds=60)
+            manager = self.Manager(TestFramer.stream, capture=capture)
+            manager.onNMEA = fail
+            with self.assertRaisesRegex(RuntimeError, "handler failed"):
+                manager.run()
+            self.assertFalse(capture._writer.is_alive())
+            with open(path, "rb") as f:
+                self.assertEqual(f.read(), TestFramer.stream + b'\r')
+            self.assertEqual(readTimestamps(path)[-1][0],
+                             len(TestFramer.stream) + 1)
+
+
+    def testTrace(self):
+        manager = self.Manager(TestFramer.stream, chunkSize=5, trace=True)
+        manager.run()
+        self.assertEqual([list(obj.trace) for obj in manager.objs],
+                         [['sync', 'framed', 'parsed', 'handled']] * 2)
+        trace = manager.objs[0].trace
+        self.assertEqual(sorted(trace.values()), list(trace.values()))
+        latency = manager.latency(reset=True)
+        self.assertEqual(sorted(latency), [(0x05, 0x01), (0x06, 0x11),
+                                           (0x0A, 0x04)])
+        self.assertEqual(sum(latency[(0x06, 0x11)]['total'].values()), 1)
+        self.assertEqual(latency[(0x0A, 0x04)]['parse'], {})  # no parse
+        self.assertEqual(manager.latency(), {})
+
+
+class TestRequests(unittest.TestCase):
+
+    class Serial:
+        """Fake receiver, answers from write number hold on."""
+        def __init__(self, answer, hold=4):
+            self.answer, self.written, self.pending = answer, [], []
+            self.hold = hold
+            self.drop = None
+            self.data, self.cond = bytearray(), threading.Condition()
+        @property
+        def in_waiting(self):
+            return len(self.data)
+        def read(self, n=1):
+            with self.cond:
+                self.cond.wait_for(lambda: self.data, 0.05)
+                data = bytes(self.data[:n])
+                del self.data[:n]
+                return data
+        def write(self, msg):
+            self.written.append(msg)
+            if msg == self.drop:
+                self.drop = None
+            else:
+                self.pending.append(msg)
+            if len(self.written) >= self.hold:
+                answers = b''.join(map(self.answer, self.pending))
+                self.pending = []
+                with self.cond:
+                    self.data += answers
+                    self.cond.notify()
+
+    class Manager(UBXManager):
+        def onUBX(self, obj):
+            pass
+
+    def answer(self, msg):
+        if msg == UBX.MON.VER.Get().serialize():
+            return TestAsync.ver
+        if msg == UBX.CFG.RATE.Get().serialize():
+            return UBXMessage.make(0x06, 0x08, b'\xe8\x03\x01\x00\x01\x00') + \
+                UBXMessage.make(0x05, 0x01, b'\x06\x08')
+        if msg[2:4] == b'\x06\x08':
+            return UBXMessage.make(0x05, 0x01, b'\x06\x08')
+        if msg[2:4] == b'\x06\x11':
+            return UBXMessage.make(0x05, 0x00, b'\x06\x11')
+        return b''
+
+    def testPipelined(self):
+        ser = self.Serial(self.answer)
+        manager = self.Manager(ser)
+        manager.start()
+        try:
+            ver = manager.request(UBX.MON.VER.Get(), timeout=5)
+            rate = manager.request(UBX.CFG.RATE.Get(), timeout=5)
+            ack = manager.modify(UBX.CFG.RATE.Get(),
+                                 lambda obj: setattr(obj, 'measRate', 200))
+            nak = manager.request(UBX.CFG.RXM(b'\x48\x00'), timeout=5)
+            self.assertEqual(ver.result(5).swVersion, "ROM CORE 3.01")
+            self.assertEqual(rate.result(5).measRate, 1000)
+            self.assertEqual((ack.result(5).clsID, ack.result().msgID), (6, 8))
+            with self.assertRaisesRegex(Exception, "NAK for message 06:11"):
+                nak.result(5)
+            ser.drop = UBX.CFG.RATE.Get().serialize()    # answer the retry
+            retried = manager.request(UBX.CFG.RATE.Get(), 0.1, retries=1)
+            self.assertEqual(retried.result(5).measRate, 1000)
+            lost = manager.request(UBXMessage.make(0x06, 0x09, bytes(12)),
+                                   0.05, retries=2)
+            with self.assertRaises(TimeoutError):
+                lost.result(5)
+        finally:
+            manager.shutdown()
+            manager.join()
+        self.assertEqual(ser.written[4][6:8], b'\xc8\x00')    # measRate
+        self.assertEqual(ser.written[5], ser.written[6])
+        self.assertEqual(len(ser.written), 10)
+        self.assertEqual(manager.correlator._subscriptions, {})
+
+
+class TestProfile(unittest.TestCase):
+
+    @staticmethod
+    def answer(msgs):
+        # acknowledges everything in a burst but CFG-GNSS
+        answers, pos = b'', 0
+        while pos < len(msgs):
+            length = 8 + msgs[pos + 4] + 256 * msgs[pos + 5]
+            cls = 0x00 if msgs[pos + 3] == 0x3E else 0x01
+            answers += UBXMessage.make(0x05, cls, msgs[pos + 2:pos + 4])
+            pos += length
+        return answers
+
+    def testApply(self):
+        profile = Profile(
+            msgRates={UBX.RXM.RAWX: 1, (0x01, 0x07): (0, 1, 0, 1, 0, 0)},
+            rate={'measRate': 200, 'navRate': 1, 'timeRef': 1},
+            ports=[{'portID': 1, 'mode': 0x8d0, 'baudRate': 115200,
+                    'inProtoMask': 1, 'outProtoMask': 1}],
+            gnss=[{'gnssId': 0, 'maxTrkCh': 16, 'flags': 0x01010001},
+                  {'gnssId': 6, 'maxTrkCh': 14, 'flags': 0x01010001}]
+        )
+        items = profile.compile()
+        self.assertEqual(items[0], ("CFG-MSG 02:15 rate=1",
+                                    UBXMessage.make(6, 1, b'\x02\x15\x01')))
+        prt = parseUBXMessage(items[-1][1])
+        self.assertEqual((prt.portID, prt.baudRate), (1, 115200))
+        gnss = parseUBXMessage(items[3][1])
+        self.assertEqual((gnss.numConfigBlocks, gnss.gnssId_2), (2, 6))
+        ser = TestRequests.Serial(self.answer, hold=1)
+        manager = TestRequests.Manager(ser)
+        manager.start()
+        try:
+            report = profile.apply(manager, timeout=5)
+        finally:
+            manager.shutdown()
+            manager.join()
+        self.assertEqual(ser.written, [b''.join(f for d, f in items)])
+        self.assertEqual([e is None for d, e in report],
+                         [True, True, True, False, True])
+        self.assertIn("ERR CFG-GNSS gnssId=0,6: NAK for message 06:3E",
+                      formatReport(report))
+
+
+class TestConfigCache(unittest.TestCase):
+
+    rate = UBXMessage.make(0x06, 0x08, b'\xe8\x03\x01\x00\x01\x00')
+
+    def answer(self, msgs):
+        # answers polls of CFG-RATE, CFG-PRT, CFG-MSG and CFG-RXM, and
+        # acknowledges all sets but CFG-RXM
+        answers = b''
+        while msgs:
+            msg, msgs = msgs[:8 + msgs[4]], msgs[8 + msgs[4]:]
+            msgClass, msgId, payload = UBXMessage.extract(msg)
+            ack = UBXMessage.make(0x05, 0x01, msg[2:4])
+            if msg == UBX.CFG.RATE.Get().serialize():
+                answers += self.rate + ack
+            elif msg == UBXMessage.make(0x06, 0x00, b''):
+                answers += UBXMessage.make(0x06, 0x00, b'\x03' + bytes(19)) + ack
+            elif msgId == 0x01 and len(payload) == 2:
+                answers += UBXMessage.make(0x06, 0x01, payload + bytes(6)) + ack
+            elif msg == UBX.CFG.RXM.Get().serialize():
+                answers += UBXMessage.make(0x06, 0x11, b'\x08\x04') + ack
+            elif msgId == 0x11:
+                answers += UBXMessage.make(0x05, 0x00, msg[2:4])
+            elif msgId != 0x04:
+                answers += ack
+        return answers
+
+    def testCache(self):
+        ser = TestRequests.Serial(self.answer, hold=1)
+        manager = TestRequests.Manager(ser)
+        manager.start()
+        fd, filename = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            cache = ConfigCache(manager)
+            self.assertEqual(cache.get(UBX.CFG.RATE).result(5).measRate, 1000)
+            self.assertEqual(cache.get(UBX.CFG.RATE).result(5).navRate, 1)
+            self.assertEqual(cache.get(UBX.CFG.PRT).result(5).portID, 3)
+            self.assertEqual(cache.port, 3)
+            cache.get(UBX.CFG.MSG, (0x02, 0x15)).result(5)
+            self.assertEqual(len(ser.written), 3)
+            profile = Profile(msgRates={UBX.RXM.RAWX: 1},
+                              rate={'measRate': 1000, 'navRate': 1,
+                                    'timeRef': 1})
+            report = profile.apply(manager, cache=cache)
+            self.assertEqual(report[1], ("CFG-RATE measRate=1000 navRate=1 "
+                                         "timeRef=1 (unchanged)", None))
+            self.assertEqual(ser.written[3], UBXMessage.make(
+                0x06, 0x01, b'\x02\x15\x01'))
+            report = profile.apply(manager, cache=cache)
+            self.assertTrue(all(d.endswith("(unchanged)") for d, e in report))
+            self.assertEqual(len(ser.written), 4)
+            cache.save(filename)
+            # the NAK drops CFG-RXM, so it is polled again
+            self.assertEqual(cache.modify(
+                UBX.CFG.RXM, lambda rxm: setattr(rxm, 'lpMode', 4)
+            ).result(5), ConfigCache.UNCHANGED)
+            with self.assertRaisesRegex(Exception, "NAK for message 06:11"):
+                cache.modify(UBX.CFG.RXM,
+                             lambda rxm: setattr(rxm, 'lpMode', 1)).result(5)
+            cache.get(UBX.CFG.RXM).result(5)
+            self.assertEqual(len(ser.written), 7)
+            cache.coldStart()
+            cache.get(UBX.CFG.RATE).result(5)
+            self.assertEqual(len(ser.written), 9)
+            cache.close()
+            loaded = ConfigCache(manager, ttl=3600)
+            loaded.load(filename)
+            self.assertEqual(loaded.port, 3)
+            report = profile.apply(manager, cache=loaded)
+            self.assertTrue(all(d.endswith("(unchanged)") for d, e in report))
+            loaded.ttl = -1
+            loaded.get(UBX.CFG.RATE).result(5)
+            self.assertEqual(len(ser.written), 10)
+            loaded.close()
+        finally:
+            manager.shutdown()
+            manager.join()
+            os.remove(filename)
+
+
+class TestBaudrate(unittest.TestCase):
+
+    class Tty:
+        """Minimal pyserial-like wrapper of a tty."""
+        def __init__(self, fd):
+            self.fd, self.timeout = fd, None
+            self.line = queue.Queue()   # (baud rate, length) of the writes
+        @property
+        def baudrate(self):
+            speed = termios.tcgetattr(self.fd)[4]
+            return next(b for b in BAUDRATES
+                        if getattr(termios, 'B{}'.format(b)) == speed)
+        @baudrate.setter
+        def baudrate(self, baudrate):
+            attrs = termios.tcgetattr(self.fd)
+            attrs[4] = attrs[5] = getattr(termios, 'B{}'.format(baudrate))
+            termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+        @property
+        def in_waiting(self):
+            return struct.unpack('i', fcntl.ioctl(
+                self.fd, termios.FIONREAD, b'\x00' * 4))[0]
+        def read(self, n=1):
+            if not select.select([self.fd], [], [], self.timeout)[0]:
+                return b''
+            return os.read(self.fd, n)
+        def write(self, data):
+            self.line.put((self.baudrate, len(data)))
+            os.write(self.fd, data)
+        def reset_input_buffer(self):
+            termios.tcflush(self.fd, termios.TCIFLUSH)
+        def flush(self):
+            termios.tcdrain(self.fd)
+
+    class Receiver(threading.Thread):
+        """Stand-in receiver on UART 1, garbles what isn't at its rate."""
+        def __init__(self, master, host, baudrate):
+            threading.Thread.__init__(self, daemon=True)
+            self.master, self.host, self.baudrate = master, host, baudrate
+            self.ignoreSets = False
+            self.nakAfterSet = self.nakPolls = False
+        def run(self):
+            while True:
+                baudrate, n = self.host.line.get()
+                if baudrate is None:
+                    return
+                data = b''
+                while len(data) < n:
+                    try:
+                        data += os.read(self.master, n - len(data))
+                    except OSError:
+                        return
+                if baudrate != self.baudrate:
+                    os.write(self.master, random.randbytes(len(data) + 20))
+                elif data == UBXMessage.make(0x06, 0x00, b'') and \
+                        self.nakPolls:
+                    os.write(self.master,
+                             UBXMessage.make(0x05, 0x00, b'\x06\x00'))
+                elif data == UBXMessage.make(0x06, 0x00, b''):
+                    os.write(self.master, UBXMessage.make(
+                        0x06, 0x00, struct.pack('<BBHIIHHHH', 1, 0, 0, 0x8d0,
+                                                self.baudrate, 7, 3, 0, 0)
+                    ) + UBXMessage.make(0x05, 0x01, b'\x06\x00'))
+                elif data[2:4] == b'\x06\x00' and not self.ignoreSets:
+                    self.baudrate = parseUBXMessage(data).baudRate
+                    self.nakPolls = self.nakAfterSet
+
+    def testNegotiate(self):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        ser = self.Tty(slave)
+        ser.baudrate = 9600
+        receiver = self.Receiver(master, ser, 38400)
+        receiver.start()
+        manager = TestRequests.Manager(ser)
+        try:
+            self.assertEqual(detectBaudrate(ser, timeout=0.2), 38400)
+            self.assertEqual(ser.baudrate, 38400)
+            ser.timeout = 0.05
+            manager.start()
+            changeBaudrate(manager, 115200)
+            self.assertEqual((ser.baudrate, receiver.baudrate),
+                             (115200, 115200))
+            receiver.ignoreSets = True
+            with self.assertRaisesRegex(Exception, "did not switch to 230400"):
+                changeBaudrate(manager, 230400, timeout=0.1, retries=0)
+            self.assertEqual(ser.baudrate, 115200)
+            # switched, but the verification is NAKed
+            receiver.ignoreSets, receiver.nakAfterSet = False, True
+            with self.assertRaisesRegex(Exception, "230400 baud: NAK"):
+                changeBaudrate(manager, 230400, timeout=0.5, retries=0)
+            self.assertEqual(ser.baudrate, 115200)
+        finally:
+            manager.shutdown()
+            if manager.is_alive():
+                manager.join()
+            ser.line.put((None, 0))
+            receiver.join()
+            os.close(master)
+            os.close(slave)
+
+
+class TestBudget(unittest.TestCase):
+
+    def testBudget(self):
+        budget = Budget({UBX.RXM.RAWX: 1, UBX.NAV.PVT: 1, UBX.NAV.SAT: 2,
+                         UBX.NAV.STATUS: 0},
+                        measRate=500, navRate=2, nmea={'GSV': 1, 'GGA': 1},
+                        satellites=20, baudrate=9600)
+        self.assertEqual(budget.rows(), [
+            ('RXM-RAWX', 664, 2.0, 1328.0),
+            ('NAV-PVT', 100, 1.0, 100.0),
+            ('NAV-SAT', 256, 0.5, 128.0),
+            ('GSV', 350, 1.0, 350.0),
+            ('GGA', 75, 1.0, 75.0),
+        ])
+        self.assertEqual(budget.total(), 1981.0)
+        self.assertTrue(budget.format().endswith("206% of 9600 baud"))
+        profile = Profile(msgRates={UBX.RXM.RAWX: (0, 1, 0, 2, 0, 0)},
+                          rate={'measRate': 200})
+        self.assertEqual(Budget.fromProfile(profile, port=3).rows(),
+                         [('RXM-RAWX', 984, 2.5, 2460.0)])
+        with self.assertRaisesRegex(ValueError, "select one with port"):
+            Budget.fromProfile(profile)
+
+    def testLive(self):
+        ser = TestRequests.Serial(TestConfigCache().answer, hold=1)
+        manager = TestRequests.Manager(ser)
+        manager.start()
+        try:
+            budget = Budget.fromReceiver(ConfigCache(manager),
+                                         [UBX.RXM.RAWX])
+        finally:
+            manager.shutdown()
+            manager.join()
+        self.assertEqual(budget.msgRates, {(0x02, 0x15): 0})
+        self.assertEqual((budget.measRate, budget.baudrate), (1000, None))
+        manager = TestSubscribe.Manager(TestFramer.stream, dispatchAll=False)
+        meter = Meter(manager)
+        manager.run()
+        self.assertEqual(meter.counts(), {'MON-VER': (1, 8),
+                                          'CFG-RXM': (1, 10),
+                                          'ACK-ACK': (1, 10),
+                                          'NMEA': (1, 33)})
+        self.assertIn('observed', budget.format(meter.rates()))
+        # the NMEA sentences are compared in one row
+        budget = Budget({}, nmea={'GGA': 1, 'GSV': 1}, satellites=8)
+        self.assertEqual(budget.rows(nmeaTotal=True),
+                         [('NMEA', 108, 2.0, 215.0)])
+        rates = meter.rates()
+        table = budget.format(rates).splitlines()
+        self.assertEqual(len(table), 3)
+        self.assertTrue(table[1].startswith('NMEA'))
+        self.assertTrue(table[1].endswith(
+            " {:10.1f}".format(rates['NMEA'][1])))
+        self.assertNotEqual(rates['NMEA'][1], 0)
+
+
+class TestAsync(unittest.TestCase):
+
+    ver = UBXMessage.make(0x0A, 0x04, b'ROM CORE 3.01'.ljust(30, b'\x00') +
+                          b'00080000'.ljust(10, b'\x00'))
+    ack = UBXMessage.make(0x05, 0x01, b'\x06\x08')
+
+    def testFile(self):
+        fd, filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(TestFramer.stream)
+
+        async def main():
+            manager = await AsyncUBXManager.openFile(filename,
+                                                     dispatchAll=False)
+            task = manager.start()
+            msgs = [msg async for msg in manager.messages(UBX.ACK.ACK)]
+            await task
+            manager.shutdown()
+            return msgs
+        try:
+            msgs = asyncio.run(main())
+        finally:
+            os.remove(filename)
+        self.assertEqual([(m.clsID, m.msgID) for m in msgs], [(6, 8)])
+
+    def testDevice(self):
+        master, slave = os.openpty()
+        received = []
+
+        def receiver():
+            # answers MON-VER polls, acknowledges CFG-RATE, NAKs CFG-RXM
+            data = os.read(master, 1024)
+            received.append(data)
+            if data == UBX.MON.VER.Get().serialize():
+                os.write(master, b'junk' + self.ver)
+            elif data[2:4] == b'\x06\x08':
+                os.write(master, self.ack)
+            elif data[2:4] == b'\x06\x11':
+                os.write(master, UBXMessage.make(0x05, 0x00, data[2:4]))
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            manager = await AsyncUBXManager.openDevice(os.ttyname(slave),
+                                                       dispatchAll=False)
+            loop.add_reader(master, receiver)
+            task = manager.start()
+            ver = await manager.request(UBX.MON.VER.Get(), timeout=5)
+            ack = await manager.request(
+                UBXMessage.make(0x06, 0x08, bytes(6)), timeout=5)
+            with self.assertRaisesRegex(Exception, "NAK for message 06:11"):
+                await manager.request(UBX.CFG.RXM(b'\x48\x00'), timeout=5)
+            with self.assertRaises(asyncio.TimeoutError):
+                await manager.request(UBXMessage.make(0x06, 0x09, bytes(12)),
+                                      timeout=0.1)
+            loop.remove_reader(master)
+            manager.shutdown()
+            await task
+            return ver, ack
+        try:
+            ver, ack = asyncio.run(main())
+        finally:
+            os.close(master)
+            os.close(slave)
+        self.assertEqual(ver.swVersion, "ROM CORE 3.01")
+        self.assertEqual((ack.clsID, ack.msgID), (6, 8))
+        self.assertEqual(received[0], UBX.MON.VER.Get().serialize())
+
+    def testConcurrentRequests(self):
+        master, slave = os.openpty()
+        rate = UBXMessage.make(0x06, 0x08, b'\xe8\x03\x01\x00\x01\x00')
+
+        def receiver():
+            # answers each frame: MON-VER with its number, CFG-RATE polls
+            # with CFG-RATE and ACK-ACK, CFG-RATE sets with ACK-NAK
+            data = os.read(master, 1024)
+            while data:
+                n = 8 + (data[4] | data[5] << 8)
+                frame, data = data[:n], data[n:]
+                receiver.n += 1
+                if frame[2:4] == b'\x0a\x04':
+                    os.write(master, UBXMessage.make(
+                        0x0A, 0x04, str(receiver.n).encode().ljust(40, b'\0')))
+                elif frame == UBX.CFG.RATE.Get().serialize():
+                    os.write(master, rate + self.ack)
+                elif frame[2:4] == b'\x06\x08':
+                    os.write(master, UBXMessage.make(0x05, 0x00, b'\x06\x08'))
+        receiver.n = 0
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            manager = await AsyncUBXManager.openDevice(os.ttyname(slave),
+                                                       dispatchAll=False)
+            loop.add_reader(master, receiver)
+            task = manager.start()
+            vers = await asyncio.gather(
+                manager.request(UBX.MON.VER.Get(), timeout=5),
+                manager.request(UBX.MON.VER.Get(), timeout=5))
+            # the ACK of the poll must not acknowledge the set
+            results = await asyncio.gather(
+                manager.request(UBX.CFG.RATE.Get(), timeout=5),
+                manager.request(rate, timeout=5), return_exceptions=True)
+            loop.remove_reader(master)
+            manager.shutdown()
+            await task
+            return vers, results
+        try:
+            vers, results = asyncio.run(main())
+        finally:
+            os.close(master)
+            os.close(slave)
+        self.assertEqual([v.swVersion for v in vers], ["1", "2"])
+        self.assertEqual(results[0].measRate, 1000)
+        self.assertRegex(str(results[1]), "NAK for message 06:08")
+
+
+class TestHub(unittest.TestCase):
+
+    class Hub(UBXHub):
+        def __init__(self, n):
+            UBXHub.__init__(self, trace=True)
+            self.n, self.calls, self.done = n, [], threading.Event()
+            self.arrivals = []
+        def record(self, call):
+            self.calls.append(call)
+            if len(self.calls) == self.n:
+                self.done.set()
+        def onUBX(self, obj):
+            self.arrivals.append(obj.arrival)
+            self.record((obj.device.id, type(obj)))
+        def onNMEA(self, buffer):
+            self.arrivals.append(buffer.arrival)
+            self.record((self.device.id, buffer))
+
+    def testHub(self):
+        ptys = [os.openpty() for _ in range(2)]
+        for master, slave in ptys:
+            tty.setraw(slave)
+        hub = self.Hub(4)
+        hub.add(ptys[0][1], identify=True)
+        hub.add(ptys[1][1], deviceId='B')
+        hub.start()
+        try:
+            poll = UBX.SEC.UNIQID.Get().serialize()
+            self.assertEqual(os.read(ptys[0][0], 1024), poll)
+            ack = UBXMessage.make(0x05, 0x01, b'\x06\x08')
+            os.write(ptys[1][0], b'$GPTXT,01,01,02,ANTSTATUS=OK*3B\r\n' + ack)
+            os.write(ptys[0][0], UBXMessage.make(
+                0x27, 0x03, b'\x01\x00\x00\x00\x12\x34\x56\x78\x9a') + ack)
+            self.assertTrue(hub.done.wait(5))
+        finally:
+            hub.shutdown()
+            hub.join()
+            for fd in chain(*ptys):
+                os.close(fd)
+        calls = hub.calls
+        self.assertIn(('B', 'GPTXT,01,01,02,ANTSTATUS=OK'), calls)
+        self.assertIn(('B', UBX.ACK.ACK), calls)
+        self.assertEqual(
+            [c for c in calls if c[0] != 'B'],
+            [('123456789A', UBX.SEC.UNIQID), ('123456789A', UBX.ACK.ACK)]
+        )
+        self.assertNotIn(None, hub.arrivals)
+        stats = hub.stats()
+        self.assertEqual({k: v['frames'] for k, v in stats['ubx'].items()},
+                         {(0x05, 0x01): 2, (0x27, 0x03): 1})
+        self.assertEqual(stats['nmea']['frames'], 1)
+        self.assertEqual(sorted(hub.latency()), [(0x05, 0x01), (0x27, 0x03)])
+        self.assertIsNone(hub.framer)
+
+    def testRemove(self):
+        ptys = [os.openpty() for _ in range(2)]
+        for master, slave in ptys:
+            tty.setraw(slave)
+        hub = self.Hub(1)
+        a, b = hub.add(ptys[0][1], 'A'), hub.add(ptys[1][1], 'B')
+        hub.start()
+        try:
+            ack = UBXMessage.make(0x05, 0x01, b'\x06\x08')
+            os.write(ptys[1][0], ack)
+            self.assertTrue(hub.done.wait(5))
+            hub.remove(b)
+            for _ in range(250):    # removed by the hub thread
+                if hub.devices == [a]:
+                    break
+                threading.Event().wait(0.02)
+            self.assertEqual(hub.devices, [a])
+            hub.n, hub.done = 2, threading.Event()
+            os.write(ptys[1][0], ack)
+            os.write(ptys[0][0], ack)
+            self.assertTrue(hub.done.wait(5))
+        finally:
+            hub.shutdown()
+            hub.join()
+            for fd in chain(*ptys):
+                os.close(fd)
+        self.assertEqual(hub.calls, [('B', UBX.ACK.ACK), ('A', UBX.ACK.ACK)])
+
+    def testSendNonBlocking(self):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        fcntl.fcntl(slave, fcntl.F_SETFL,
+                    fcntl.fcntl(slave, fcntl.F_GETFL) | os.O_NONBLOCK)
+        hub = self.Hub(0)
+        device = hub.add(slave)
+        msg = UBXMessage.make(0x02, 0x15, bytes(range(256)) * 100) * 4
+        received = bytearray()
+
+        def reader():
+            while len(received) < len(msg):
+                received.extend(os.read(master, 4096))
+        thread = threading.Thread(target=reader, daemon=True)
+        try:
+            thread.start()
+            device.send(msg)
+            thread.join(5)
+        finally:
+            os.close(master)
+            os.close(slave)
+        self.assertEqual(bytes(received), msg)
+
+
+class TestCapture(unittest.TestCase):
+
+    data = bytes(range(256)) * 4
+
+    def capture(self, path, **kwargs):
+        """Capture data in reads of 50 bytes, one per second."""
+        capture = UBXCapture(path, blockSize=100, **kwargs)
+        for i in range(0, len(self.data), 50):
+            capture.write(self.data[i:i+50], (i / 50, 1000 + i / 50))
+        capture.close()
+        return capture.files
+
+    def testRotate(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cap-%Y.log')
+            files = self.capture(path, maxBytes=300, compress='gz',
+                                 interval=0)
+            base = os.path.join(tmp, 'cap-1970.log')
+            self.assertEqual(files, [base + '.gz', base + '.1.gz',
+                                     base + '.2.gz', base + '.3.gz'])
+            data = b''
+            for name in files:
+                with gzip.open(name) as f:
+                    data += f.read()
+            self.assertEqual(data, self.data)
+            self.assertEqual(readTimestamps(files[1])[:2],
+                             [(50, 6.0, 1006.0), (100, 7.0, 1007.0)])
+            self.assertEqual(readTimestamps(files[3])[-1],
+                             (124, 20.0, 1020.0))
+            files = self.capture(path, maxSeconds=5, interval=2)
+            self.assertEqual(len(files), 4)
+            data = b''
+            for name in files:
+                with open(name, 'rb') as f:
+                    data += f.read()
+            self.assertEqual(data, self.data)
+            self.assertEqual([r[0] for r in readTimestamps(files[0])],
+                             [50, 150, 250])
+
+    def testFlushWhileIdle(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'cap.log')
+            capture = UBXCapture(path, flushSeconds=0.05)
+            capture.write(self.data[:50])
+            # no more writes, the writer thread flushes the block itself
+            for _ in range(100):
+                if os.path.exists(path) and os.path.getsize(path) == 50:
+                    break
+                threading.Event().wait(0.02)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), self.data[:50])
+            capture.close()
+
+
+class TestLogReader(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(TestFramer.stream)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def testFrames(self):
+        with UBXLogReader(self.filename) as reader:
+            frames = [(o, c, i, bytes(p) if c is not None else p)
+                      for o, c, i, p in reader]
+            stream = TestFramer.stream
+            self.assertEqual(
+                [(c, i) for o, c, i, p in frames],
+                [(0x0A, 0x04), (None, None), (0x06, 0x11), (0x05, 0x01)]
+            )
+            for offset, msgClass, msgId, payload in frames:
+                if msgClass is None:
+                    self.assertEqual(stream[offset:offset+6], b'$GPTXT')
+                    self.assertEqual(payload, 'GPTXT,01,01,02,ANTSTATUS=OK')
+                else:
+                    self.assertEqual(stream[offset+2:offset+4],
+                                     bytes([msgClass, msgId]))
+            self.assertEqual(frames[-1][3], b'\x06\x08')
+            self.assertEqual(reader.stats, {
+                'bytes': len(stream), 'ubx': 3, 'nmea': 1,
+                'checksumErrors': 2, 'truncatedBytes': 0,
+                'corruptedBytes': 9 + 35 + 10 + 6,
+            })
+            self.assertEqual(len(list(reader.frames(final=False))), 4)
+            self.assertEqual(reader.stats['truncatedBytes'], 6)
+            self.assertEqual(reader.stats['corruptedBytes'], 9 + 35 + 10)
+
+    def testFilter(self):
+        with UBXLogReader(self.filename, [UBX.ACK.ACK, (0x06, 0x11)],
+                          nmea=False) as reader:
+            self.assertEqual([(c, i) for o, c, i, p in reader],
+                             [(0x06, 0x11), (0x05, 0x01)])
+            self.assertEqual(reader.stats['ubx'], 3)
+
+    def testEmpty(self):
+        open(self.filename, 'wb').close()
+        with UBXLogReader(self.filename) as reader:
+            self.assertEqual(list(reader), [])
+
+
+class TestLogIndex(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        for filename in [self.filename, self.filename + '.idx']:
+            if os.path.exists(filename):
+                os.remove(filename)
+
+    @staticmethod
+    def epoch(iTOW):
+        """Return a RAWX, NAV-SAT and ACK frame of epoch iTOW."""
+        return (
+            UBXMessage.make(0x02, 0x15, struct.pack('<d', iTOW / 1000) +
+                            bytes(8)) +
+            UBXMessage.make(0x01, 0x35, struct.pack('<I', iTOW) + bytes(4)) +
+            UBXMessage.make(0x05, 0x01, b'\x06\x08')
+        )
+
+    def write(self, data):
+        with open(self.filename, 'ab') as f:
+            f.write(data)
+
+    def testIndex(self):
+        week = WEEK_MS
+        self.write(UBXMessage.make(0x05, 0x01, b'\x06\x08') +
+                   self.epoch(week - 2000) + self.epoch(week - 1000) +
+                   self.epoch(0) + self.epoch(1000)[:-5])
+        index = UBXLogIndex(self.filename)
+        self.assertEqual(len(index), 1 + 3 * 3 + 2)
+        self.assertEqual(list(index.times), [-1] +
+                         [week - 2000] * 3 + [week - 1000] * 3 +
+                         [week] * 3 + [week + 1000] * 2)
+        records = list(index.records(week - 1000, week + 1000))
+        self.assertEqual([r[0] for r in records],
+                         [week - 1000] * 3 + [week] * 3)
+        frames = list(index.frames(week - 1500, None, [UBX.NAV.SAT]))
+        self.assertEqual([(f[0], f[2], f[3]) for f in frames], [
+            (week - 1000, 0x01, 0x35), (week, 0x01, 0x35),
+            (week + 1000, 0x01, 0x35)
+        ])
+        self.assertEqual(bytes(frames[0][4][:4]),
+                         struct.pack('<I', week - 1000))
+        frames = None
+        # the incomplete epoch is picked up when the capture grows
+        self.write(self.epoch(1000)[-5:] + self.epoch(2000))
+        index = UBXLogIndex(self.filename, update=False)
+        self.assertEqual(len(index), 12)
+        self.assertEqual(index.update(), 4)
+        self.assertEqual(list(UBXLogIndex(self.filename).times)[-6:],
+                         [week + 1000] * 3 + [week + 2000] * 3)
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(0)
+        self.stream = b''.join(
+            TestLogIndex.epoch(1000 * i) +
+            bytes(rnd.randrange(0x25, 0xb5) for _ in range(rnd.randrange(20)))
+            for i in range(50)
+        )
+        fd, self.filename = tempfile.mkstemp()
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.stream)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def testChunkBoundaries(self):
+        boundaries = chunkBoundaries(self.stream, 100)
+        self.assertEqual(boundaries[0], 0)
+        self.assertEqual(boundaries[-1], len(self.stream))
+        for i in boundaries[1:-1]:
+            self.assertEqual(self.stream[i:i+2], b'\xb5\x62')
+        self.assertGreater(len(boundaries), 5)
+        # a valid frame inside a payload doesn't split its frame
+        inner = UBXMessage.make(0x05, 0x01, b'\x06\x08')
+        outer = UBXMessage.make(0x02, 0x15, bytes(10) + inner + bytes(10))
+        ack = UBXMessage.make(0x05, 0x01, b'\x06\x11')
+        self.assertEqual(chunkBoundaries(outer + ack + ack, 10)[:2],
+                         [0, len(outer)])
+
+    def testSameAsSequential(self):
+        with UBXLogReader(self.filename, nmea=False) as reader:
+            expected = [(offset, str(parseUBXPayload(c, i, bytes(p))))
+                        for offset, c, i, p in reader]
+            stats = reader.stats
+        for chunkSize in [100, 1000, 1 << 20]:
+            decoder = UBXParallelDecoder(self.filename, func=str,
+                                         chunkSize=chunkSize, workers=2)
+            self.assertEqual(list(decoder), expected)
+            self.assertEqual(decoder.stats, stats)
+            self.assertEqual(decoder.errors, [])
+        decoder = UBXParallelDecoder(self.filename, [UBX.NAV.SAT],
+                                     chunkSize=100, workers=2)
+        self.assertEqual([obj.iTOW for offset, obj in decoder],
+                         [1000 * i for i in range(50)])
+
+
 if __name__ == '__main__':
     unittest.main()